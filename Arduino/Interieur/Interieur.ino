@@ -1,4 +1,5 @@
 #include <WiFi.h>
+#include <time.h>
 #include "DHT.h"
 
 // Configuration du WiFi
@@ -19,6 +20,67 @@ DHT dht(DHTPIN, DHTTYPE);
 unsigned long restartInterval = 86400000; // 24h = 86 400 000 ms
 unsigned long startMillis;
 
+// Mesure toutes les minutes
+const unsigned long measureInterval = 60000;
+unsigned long lastMeasure = 0;
+
+// Protocole v2 : connexion persistante, trames de mesures horodatées, accusé de réception par trame
+const size_t FRAME_MAX = 50;              // mesures max par trame
+const unsigned long ACK_TIMEOUT = 5000;   // attente max de l'accusé de réception (ms)
+const unsigned long RETRY_INTERVAL = 5000; // délai entre deux tentatives de connexion (ms)
+unsigned long lastAttempt = 0;
+WiFiClient client;
+
+// Mesures en attente d'envoi, en mémoire RTC : conservées pendant une coupure WiFi ou serveur
+// et à travers le redémarrage quotidien (ESP.restart). 400 mesures = plus de 6 h d'arriéré.
+#define BUFFER_SIZE 400
+#define BUFFER_MAGIC 0x44485432 // "DHT2" : contenu valide (la mémoire est aléatoire à la mise sous tension)
+
+struct Reading {
+  uint32_t seq;      // numéro de séquence croissant
+  uint32_t epoch;    // heure de mesure (secondes UTC, NTP)
+  int16_t temp;      // température en centièmes de °C
+  uint16_t hum;      // humidité en centièmes de %
+};
+
+struct Buffer {
+  uint32_t magic;
+  uint32_t nextSeq;
+  uint32_t frameId;
+  uint16_t head;     // plus ancienne mesure non acquittée
+  uint16_t count;
+  Reading readings[BUFFER_SIZE];
+};
+
+RTC_NOINIT_ATTR Buffer buffer;
+
+void initBuffer() {
+  if (buffer.magic != BUFFER_MAGIC || buffer.head >= BUFFER_SIZE || buffer.count > BUFFER_SIZE) {
+    buffer.magic = BUFFER_MAGIC;
+    buffer.nextSeq = 1;
+    buffer.frameId = 1;
+    buffer.head = 0;
+    buffer.count = 0;
+    Serial.println("Tampon RTC initialisé");
+  } else {
+    Serial.println("Tampon RTC conservé : " + String(buffer.count) + " mesure(s) en attente");
+  }
+}
+
+void pushReading(uint32_t epoch, float temperature, float humidity) {
+  if (buffer.count == BUFFER_SIZE) {
+    // Tampon plein : la plus ancienne mesure est sacrifiée
+    buffer.head = (buffer.head + 1) % BUFFER_SIZE;
+    buffer.count--;
+  }
+  Reading& r = buffer.readings[(buffer.head + buffer.count) % BUFFER_SIZE];
+  r.seq = buffer.nextSeq++;
+  r.epoch = epoch;
+  r.temp = (int16_t) lroundf(temperature * 100);
+  r.hum = (uint16_t) lroundf(humidity * 100);
+  buffer.count++;
+}
+
 void connectToWiFi() {
   Serial.print("Connexion au WiFi");
   WiFi.begin(ssid, password);
@@ -29,50 +91,118 @@ void connectToWiFi() {
   Serial.println("\nConnecté au WiFi !");
 }
 
+bool timeIsSet() {
+  return time(nullptr) > 1700000000;
+}
+
+void syncTime() {
+  // Heure UTC par NTP : l'horloge continue ensuite de tourner même sans réseau
+  configTime(0, 0, "pool.ntp.org", "time.nist.gov");
+  unsigned long start = millis();
+  while (!timeIsSet() && millis() - start < 10000) {
+    delay(200);
+  }
+  Serial.println(timeIsSet() ? "Heure synchronisée" : "Synchronisation NTP échouée");
+}
+
+bool ensureConnected() {
+  if (client.connected()) {
+    return true;
+  }
+  if (millis() - lastAttempt < RETRY_INTERVAL) {
+    return false;
+  }
+  lastAttempt = millis();
+  if (!client.connect(serverAddress, serverPort)) {
+    Serial.println("Connexion au serveur échouée ! Nouvelle tentative dans 5 secondes...");
+    return false;
+  }
+  client.setNoDelay(true);
+  Serial.println("Connecté au serveur");
+  return true;
+}
+
+// Envoie une trame des plus anciennes mesures en attente et les retire du tampon une fois acquittées
+bool sendFrame() {
+  size_t n = buffer.count < FRAME_MAX ? buffer.count : FRAME_MAX;
+  uint32_t frameId = buffer.frameId;
+  String frame = "V2 " + String(frameId) + " " + String(NANO_ID) + " " + String(n) + "\n";
+  for (size_t i = 0; i < n; i++) {
+    const Reading& r = buffer.readings[(buffer.head + i) % BUFFER_SIZE];
+    frame += String(r.seq) + " " + String(r.epoch) + " " + String(r.temp / 100.0, 2) + " " + String(r.hum / 100.0, 2) + "\n";
+  }
+  client.print(frame);
+
+  client.setTimeout(ACK_TIMEOUT);
+  String reply = client.readStringUntil('\n');
+  reply.trim();
+  if (reply.startsWith("ACK " + String(frameId) + " ")) {
+    buffer.head = (buffer.head + n) % BUFFER_SIZE;
+    buffer.count -= n;
+    buffer.frameId++;
+    Serial.println("Trame " + String(frameId) + " acquittée (" + String(n) + " mesures) : " + reply);
+    return true;
+  }
+  // NACK ou délai dépassé : les mesures restent dans le tampon, la trame sera renvoyée
+  Serial.println("Trame " + String(frameId) + " non acquittée : " + (reply.length() ? reply : String("délai dépassé")));
+  if (!reply.startsWith("NACK")) {
+    client.stop();
+  }
+  return false;
+}
+
 void setup() {
   Serial.begin(115200);
   dht.begin();
+  initBuffer();
   connectToWiFi();
+  syncTime();
   startMillis = millis(); // Enregistrer l'heure de démarrage
 }
 
 void loop() {
-  // Redémarrage automatique après 24h
+  // Redémarrage automatique après 24h (le tampon RTC est conservé)
   if (millis() - startMillis >= restartInterval) {
     Serial.println("Redémarrage automatique après 24h...");
+    client.stop();
     delay(1000); // petite pause pour le message
     ESP.restart();
   }
 
-  // Vérifier connexion WiFi
-  if (WiFi.status() != WL_CONNECTED) {
-    Serial.println("WiFi déconnecté. Reconnexion...");
-    connectToWiFi();
+  // Mesure toutes les minutes, mise en tampon avec son heure et son numéro de séquence
+  if (lastMeasure == 0 || millis() - lastMeasure >= measureInterval) {
+    float temperature = dht.readTemperature() - 0.5;
+    float humidity = dht.readHumidity();
+    if (isnan(temperature) || isnan(humidity)) {
+      Serial.println("Erreur de lecture du capteur DHT!");
+      delay(2000);
+      return;
+    }
+    lastMeasure = millis();
+    if (timeIsSet()) {
+      pushReading((uint32_t) time(nullptr), temperature, humidity);
+    } else {
+      // Sans heure fiable, la mesure ne peut pas être horodatée : elle est ignorée
+      Serial.println("Heure inconnue, mesure ignorée");
+    }
   }
 
-  // Lecture DHT
-  float temperature = dht.readTemperature() - 0.5;
-  float humidity = dht.readHumidity();
-
-  if (isnan(temperature) || isnan(humidity)) {
-    Serial.println("Erreur de lecture du capteur DHT!");
-    delay(2000);
+  // Vérifier connexion WiFi (sans bloquer la prise de mesures)
+  if (WiFi.status() != WL_CONNECTED) {
+    WiFi.reconnect();
+    delay(1000);
     return;
   }
-
-  String data = "ID:" + String(NANO_ID) + " Temperature:" + String(temperature) + "C Humidity:" + String(humidity) + "%";
-
-  // Connexion serveur (répétée jusqu'à succès)
-  WiFiClient client;
-  while (!client.connect(serverAddress, serverPort)) {
-    Serial.println("Connexion au serveur échouée ! Nouvelle tentative dans 5 secondes...");
-    delay(5000);
+  if (!timeIsSet()) {
+    syncTime();
   }
 
-  Serial.println("Envoi des données au serveur : " + data);
-  client.println(data);
-  delay(100);
-  client.stop();
+  // Envoi de l'arriéré par trames successives sur la même connexion
+  while (buffer.count > 0 && ensureConnected()) {
+    if (!sendFrame()) {
+      break;
+    }
+  }
 
-  delay(60000); // Pause 1 min
+  delay(200);
 }
@@ -1,8 +1,15 @@
 from flask import (
-    Blueprint, render_template, request, redirect, url_for, session, flash, send_file, abort
+    Blueprint, render_template, request, redirect, url_for, session, flash, send_file, abort, jsonify
 )
 from werkzeug.security import generate_password_hash
-from db import get_mysql_connection
+from db import get_mysql_connection, get_pool_stats
+from sequence import bump
+from writer import get_writer_stats
+import latest
+from live import get_live_stats
+from httpcache import get_cache_stats
+from anomaly import get_anomaly_stats, flag_names
+from dedup import get_dedup_stats
 from auth import admin_required
 from sendmail import log_admin_action
 from homeassistant import send_to_home_assistant
@@ -54,16 +61,11 @@ homeassistant_enabled = get_homeassistant_enabled()
 def toggle_homeassistant():
     current = get_homeassistant_enabled()
     set_homeassistant_enabled(not current)
-    # Si on vient d'activer, on envoie la dernière mesure à Home Assistant
+    # Si on vient d'activer, on envoie la dernière mesure de chaque capteur à Home Assistant
     if not current:
         try:
-            with get_mysql_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT device_id, temperature, humidity FROM measurements ORDER BY time DESC LIMIT 1")
-                last = cursor.fetchone()
-            if last:
-                device_id, temperature, humidity = last
-                send_to_home_assistant(device_id, temperature, humidity)
+            for device_id, reading in latest.get_all().items():
+                send_to_home_assistant(device_id, reading["temperature"], reading["humidity"])
         except Exception as e:
             logging.error(f"Erreur lors de l'envoi à Home Assistant : {e}")
     flash(
@@ -86,6 +88,38 @@ def admin_panel():
     homeassistant_enabled = get_homeassistant_enabled()
     return render_template("admin_panel.html", users=users, homeassistant_enabled=homeassistant_enabled)
 
+@admin_bp.route("/stats")
+@admin_required
+def admin_stats():
+    # Import local : workers -> socket_server -> ingest importe ce module
+    from workers import get_ingest_totals
+    return jsonify({
+        "mysql_pool": get_pool_stats(), "writer": get_writer_stats(), "live": get_live_stats(),
+        "http_cache": get_cache_stats(), "anomaly": get_anomaly_stats(),
+        "dedup": get_dedup_stats(), "ingest": get_ingest_totals()
+    })
+
+@admin_bp.route("/quarantine")
+@admin_required
+def admin_quarantine():
+    # 100 dernières mesures mises à l'écart à l'ingestion (anomaly.py)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT device_id, time, temperature, humidity, flags FROM measurements_quarantine ORDER BY id DESC LIMIT 100"
+        )
+        rows = cursor.fetchall()
+    return jsonify([
+        {
+            "device_id": device_id,
+            "time": t.strftime("%d/%m/%Y %H:%M:%S"),
+            "temperature": temperature,
+            "humidity": humidity,
+            "flags": flag_names(flags)
+        }
+        for device_id, t, temperature, humidity, flags in rows
+    ])
+
 @admin_bp.route("/delete_user/<int:user_id>", methods=["POST"])
 @admin_required
 def delete_user(user_id):
@@ -93,6 +127,7 @@ def delete_user(user_id):
         with get_mysql_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            bump(cursor, "users", -cursor.rowcount)
             conn.commit()
     except Exception as e:
         logging.error(f"Erreur suppression utilisateur : {e}")
@@ -0,0 +1,42 @@
+from threading import Lock
+
+from db import get_mysql_connection
+from climate import derive_one
+
+# Seuils maximum facultatifs sur les grandeurs dérivées (NULL = non surveillé), dans l'ordre de climate.DERIVED
+ALERT_DERIVED_COLUMNS = ("dew_point_max", "abs_humidity_max", "heat_index_max")
+ALERT_CONFIG_QUERY = (
+    "SELECT temp_min, temp_max, humidity_min, humidity_max, "
+    f"{', '.join(ALERT_DERIVED_COLUMNS)} FROM alert_config WHERE id=1"
+)
+
+# Seuils d'alerte gardés en mémoire, rechargés après chaque modification (invalidate_alert_config)
+_lock = Lock()
+_alert_config = None
+
+def get_alert_config():
+    # (temp_min, temp_max, humidity_min, humidity_max, dew_point_max, abs_humidity_max, heat_index_max)
+    # ou None si aucune configuration
+    global _alert_config
+    with _lock:
+        if _alert_config is None:
+            with get_mysql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(ALERT_CONFIG_QUERY)
+                _alert_config = cursor.fetchone()
+        return _alert_config
+
+def invalidate_alert_config():
+    global _alert_config
+    with _lock:
+        _alert_config = None
+
+def is_alert(temperature, humidity, config):
+    temp_min, temp_max, humidity_min, humidity_max = config[:4]
+    if temperature < temp_min or temperature > temp_max or humidity < humidity_min or humidity > humidity_max:
+        return True
+    derived_max = config[4:]
+    if all(limit is None for limit in derived_max):
+        return False
+    derived = derive_one(temperature, humidity)
+    return any(limit is not None and value > limit for value, limit in zip(derived.values(), derived_max))
@@ -0,0 +1,134 @@
+import math
+import logging
+from datetime import datetime, timedelta
+from threading import Lock
+
+from db import get_mysql_connection
+from config import (
+    ANOMALY_TEMP_RANGE, ANOMALY_HUMIDITY_RANGE, ANOMALY_STUCK_SECONDS, ANOMALY_MAX_TEMP_RATE,
+    ANOMALY_MAX_HUMIDITY_RATE, ANOMALY_MIN_INTERVAL_SECONDS, ANOMALY_EWMA_ALPHA, ANOMALY_Z_THRESHOLD,
+    ANOMALY_MIN_DEVIATION, ANOMALY_WARMUP_SAMPLES, ANOMALY_QUARANTINE_DAYS
+)
+
+# Détection en flux des défauts de capteur : état de taille fixe par capteur (moyennes et variances
+# glissantes exponentielles, dernières valeurs, heure du dernier changement), coût constant par mesure.
+# Les mesures invalides ou physiquement impossibles partent en quarantaine ; les autres défauts
+# sont notés dans measurements.flags (champ de bits).
+FLAG_INVALID = 1        # valeur non numérique (NaN, infini)
+FLAG_OUT_OF_RANGE = 2   # hors de la plage de mesure du capteur
+FLAG_STUCK = 4          # température et humidité figées depuis ANOMALY_STUCK_SECONDS
+FLAG_RATE = 8           # variation plus rapide que physiquement plausible
+FLAG_OUTLIER = 16       # trop loin de la moyenne glissante
+FLAG_NAMES = {
+    FLAG_INVALID: "invalid",
+    FLAG_OUT_OF_RANGE: "out_of_range",
+    FLAG_STUCK: "stuck",
+    FLAG_RATE: "rate",
+    FLAG_OUTLIER: "outlier",
+}
+QUARANTINE_FLAGS = FLAG_INVALID | FLAG_OUT_OF_RANGE
+
+_lock = Lock()
+_states = {}  # device_id -> état du détecteur
+_stats = {"checked": 0, "flagged": 0, "quarantined": 0}
+
+def flag_names(flags):
+    return [name for flag, name in FLAG_NAMES.items() if flags & flag]
+
+def is_quarantined(flags):
+    return bool(flags & QUARANTINE_FLAGS)
+
+def _deviates(value, mean, variance, min_deviation):
+    deviation = abs(value - mean)
+    return deviation > min_deviation and deviation > ANOMALY_Z_THRESHOLD * math.sqrt(variance)
+
+def _update(state, index, value):
+    # Moyenne et variance exponentielles (Welford pondéré), mises à jour en place
+    diff = value - state["mean"][index]
+    increment = ANOMALY_EWMA_ALPHA * diff
+    state["mean"][index] += increment
+    state["var"][index] = (1 - ANOMALY_EWMA_ALPHA) * (state["var"][index] + diff * increment)
+
+def check(device_id, temperature, humidity, now):
+    # now : secondes (time.time()) à la réception ; renvoie le champ de bits des défauts détectés
+    if not (math.isfinite(temperature) and math.isfinite(humidity)):
+        flags = FLAG_INVALID
+    elif not (ANOMALY_TEMP_RANGE[0] <= temperature <= ANOMALY_TEMP_RANGE[1]
+              and ANOMALY_HUMIDITY_RANGE[0] <= humidity <= ANOMALY_HUMIDITY_RANGE[1]):
+        flags = FLAG_OUT_OF_RANGE
+    else:
+        flags = 0
+    with _lock:
+        _stats["checked"] += 1
+        if flags:
+            # Valeur inutilisable : comptée, mais sans effet sur l'état du capteur
+            _stats["flagged"] += 1
+            return flags
+        state = _states.get(device_id)
+        if state is None:
+            _states[device_id] = {
+                "mean": [temperature, humidity], "var": [0.0, 0.0], "count": 1,
+                "last": (temperature, humidity), "last_change": now,
+                "clean": (temperature, humidity), "clean_time": now
+            }
+            return 0
+        if (temperature, humidity) != state["last"]:
+            state["last_change"] = now
+        elif now - state["last_change"] > ANOMALY_STUCK_SECONDS:
+            flags |= FLAG_STUCK
+        # Vitesse mesurée depuis la dernière mesure sans défaut : le retour à la normale après
+        # un pic n'est pas signalé, un vrai changement cesse de l'être quand le temps passe
+        minutes = max(now - state["clean_time"], ANOMALY_MIN_INTERVAL_SECONDS) / 60
+        if (abs(temperature - state["clean"][0]) / minutes > ANOMALY_MAX_TEMP_RATE
+                or abs(humidity - state["clean"][1]) / minutes > ANOMALY_MAX_HUMIDITY_RATE):
+            flags |= FLAG_RATE
+        if state["count"] >= ANOMALY_WARMUP_SAMPLES and (
+            _deviates(temperature, state["mean"][0], state["var"][0], ANOMALY_MIN_DEVIATION[0])
+            or _deviates(humidity, state["mean"][1], state["var"][1], ANOMALY_MIN_DEVIATION[1])
+        ):
+            flags |= FLAG_OUTLIER
+        # L'état suit aussi les mesures signalées : un vrai changement d'ambiance cesse d'être aberrant
+        _update(state, 0, temperature)
+        _update(state, 1, humidity)
+        state["count"] += 1
+        state["last"] = (temperature, humidity)
+        if flags:
+            _stats["flagged"] += 1
+        else:
+            state["clean"] = (temperature, humidity)
+            state["clean_time"] = now
+        return flags
+
+def quarantine(device_id, temperature, humidity, flags, measured_at=None):
+    # Mesure mise à l'écart : gardée pour diagnostic, jamais écrite dans measurements
+    # measured_at : heure donnée par le capteur (protocole v2, /api/ingest), sinon heure d'arrivée
+    with _lock:
+        _stats["quarantined"] += 1
+    logging.warning(f"Mesure de {device_id} en quarantaine ({', '.join(flag_names(flags))}) : {temperature}C {humidity}%")
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO measurements_quarantine (device_id, time, temperature, humidity, flags) VALUES (%s, %s, %s, %s, %s)",
+            (
+                device_id, (measured_at or datetime.now()).replace(microsecond=0),
+                temperature if math.isfinite(temperature) else None,
+                humidity if math.isfinite(humidity) else None,
+                flags
+            )
+        )
+        conn.commit()
+
+def purge_quarantine(now=None):
+    # Appelé par la rétention : la quarantaine ne garde que les ANOMALY_QUARANTINE_DAYS derniers jours
+    cutoff = (now or datetime.now()) - timedelta(days=ANOMALY_QUARANTINE_DAYS)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM measurements_quarantine WHERE time < %s", (cutoff,))
+        conn.commit()
+        return cursor.rowcount
+
+def get_anomaly_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["devices"] = len(_states)
+    return stats
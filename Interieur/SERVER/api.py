@@ -1,42 +1,255 @@
 from flask import Blueprint, jsonify, request, session
+from datetime import datetime
+import numpy as np
 from db import get_mysql_connection
+from utils import get_measurements_range, rows_to_dicts, rows_to_columns, format_fr
+from downsample import downsample_rows
+from rollups import get_rollups
+from sequence import bump
+import archive
+import latest
+from alerts import ALERT_DERIVED_COLUMNS, get_alert_config, invalidate_alert_config, is_alert
+from climate import derive, derive_one
+from anomaly import flag_names
+import httpcache
+from httpcache import cached
+from export import FORMATS, iter_measurements, export_response
+from stats import PERIODS, get_stats
+from config import HISTORY_DEFAULT_POINTS, HISTORY_MAX_POINTS, STATS_MAX_PERIODS
 from sendmail import log_admin_action
-from auth import admin_required
+from auth import admin_required, ingest_token_required
+from ingest import BULK_FORMATS, ingest_bulk
 import logging
 import requests
+from werkzeug.utils import secure_filename
 import os
 
 OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY")
 
 api_bp = Blueprint('api', __name__)
 
+def reading_to_dict(reading):
+    return {
+        "temperature": reading["temperature"],
+        "humidity": reading["humidity"],
+        **derive_one(reading["temperature"], reading["humidity"]),
+        "faults": flag_names(reading["flags"]),
+        "time": format_fr(reading["time"]),
+        "last_seen": format_fr(reading["last_seen"])
+    }
+
+def age_seconds(reading):
+    return int((datetime.now() - reading["last_seen"]).total_seconds())
+
 @api_bp.route("/api/check_alert")
+@cached
 def check_alert():
-    with get_mysql_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT temp_min, temp_max, humidity_min, humidity_max FROM alert_config WHERE id=1")
-        alert_conf = cursor.fetchone()
-        if not alert_conf:
-            return jsonify({"error": "Config introuvable"}), 404
-        temp_min, temp_max, humidity_min, humidity_max = alert_conf
-        cursor.execute("SELECT temperature, humidity FROM measurements ORDER BY time DESC LIMIT 1")
-        last_measure = cursor.fetchone()
-    if not last_measure:
-        return jsonify({"alert": False})
-    temperature, humidity = last_measure
-    alert = temperature < temp_min or temperature > temp_max or humidity < humidity_min or humidity > humidity_max
-    if alert:
+    # Réponse depuis le registre des dernières mesures, par capteur ; les champs de premier niveau
+    # décrivent le capteur en alerte le plus récent (ou la dernière mesure s'il n'y en a pas)
+    alert_conf = get_alert_config()
+    if not alert_conf:
+        return jsonify({"error": "Config introuvable"}), 404
+    temp_min, temp_max, humidity_min, humidity_max = alert_conf[:4]
+    devices = {}
+    for device_id, reading in sorted(latest.get_all().items(), key=lambda item: item[1]["time"], reverse=True):
+        devices[device_id] = dict(
+            reading_to_dict(reading),
+            alert=is_alert(reading["temperature"], reading["humidity"], alert_conf)
+        )
+    alerting = [device_id for device_id, d in devices.items() if d["alert"]]
+    shown = alerting[0] if alerting else next(iter(devices), None)
+    return jsonify({
+        "alert": bool(alerting),
+        # Capteurs dont la dernière mesure porte un défaut (anomaly.py) : {device_id: [défauts]}
+        "faults": {device_id: d["faults"] for device_id, d in devices.items() if d["faults"]},
+        "device_id": shown,
+        "temperature": devices[shown]["temperature"] if shown else None,
+        "humidity": devices[shown]["humidity"] if shown else None,
+        "dew_point": devices[shown]["dew_point"] if shown else None,
+        "temp_min": temp_min,
+        "temp_max": temp_max,
+        "humidity_min": humidity_min,
+        "humidity_max": humidity_max,
+        **dict(zip(ALERT_DERIVED_COLUMNS, alert_conf[4:])),
+        "devices": devices
+    })
+
+@api_bp.route("/api/latest")
+@api_bp.route("/api/latest/<device_id>")
+def get_latest(device_id=None):
+    # Dernière mesure et dernier passage de chaque capteur (ou d'un seul), sans requête en base
+    if device_id is not None:
+        reading = latest.get_latest(device_id)
+        if reading is None:
+            return jsonify({"error": "Capteur inconnu"}), 404
+        return jsonify(dict(reading_to_dict(reading), device_id=device_id, age_seconds=age_seconds(reading)))
+    return jsonify({
+        device_id: dict(reading_to_dict(reading), age_seconds=age_seconds(reading))
+        for device_id, reading in latest.get_all().items()
+    })
+
+def parse_datetime_arg(name):
+    # Accepte "AAAA-MM-JJ HH:MM[:SS]" et le format des champs datetime-local ("AAAA-MM-JJTHH:MM")
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("T", " "))
+
+def history_from_archive(start, end, device_id, max_points):
+    # Mois entièrement archivés : lecture memmap et réduction directement sur les colonnes
+    devices = [device_id] if device_id else archive.archived_devices(start, end)
+    series = {device: archive.read_range(device, start, end) for device in devices}
+    total = sum(len(columns[0]) for columns in series.values())
+    rows = []
+    for device, (epochs, temperatures, humidities) in series.items():
+        if max_points and total > max_points:
+            budget = max(max_points * len(epochs) // total, 3)
+            selected = downsample_rows(epochs, temperatures, humidities, budget)
+            epochs, temperatures, humidities = epochs[selected], temperatures[selected], humidities[selected]
+        # L'archive ne garde que les mesures brutes : grandeurs dérivées calculées sur les colonnes retenues,
+        # défauts inconnus (None)
+        derived = (column.tolist() for column in derive(temperatures, humidities))
+        for epoch, temperature, humidity, *values in zip(epochs.tolist(), temperatures.tolist(), humidities.tolist(), *derived):
+            rows.append((None, device, datetime.fromtimestamp(epoch), round(temperature, 2), round(humidity, 2), *values, None))
+    rows.sort(key=lambda row: row[2])
+    return total, rows
+
+@api_bp.route("/api/history")
+@cached
+def api_history():
+    try:
+        start = parse_datetime_arg("start")
+        end = parse_datetime_arg("end")
+    except ValueError:
+        return jsonify({"error": "Dates invalides"}), 400
+    if not start or not end or start > end:
+        return jsonify({"error": "Plage de dates invalide"}), 400
+    device_id = request.args.get("device")
+    # max_points=0 : mesures brutes sans réduction
+    max_points = request.args.get("max_points", HISTORY_DEFAULT_POINTS, type=int)
+    max_points = min(max(max_points, 0), HISTORY_MAX_POINTS)
+    # ?format=columnar : points en tableaux parallèles (voir utils.rows_to_columns)
+    columnar = request.args.get("format") == "columnar"
+    to_points = rows_to_columns if columnar else rows_to_dicts
+    if archive.covers(start, end, device_id):
+        total, rows = history_from_archive(start, end, device_id, max_points)
         return jsonify({
-            "alert": True,
-            "temperature": temperature,
-            "temp_min": temp_min,
-            "temp_max": temp_max,
-            "humidity": humidity,
-            "humidity_min": humidity_min,
-            "humidity_max": humidity_max
+            "total": total,
+            "downsampled": len(rows) < total,
+            "points": to_points(rows)
         })
-    else:
-        return jsonify({"alert": False})
+    rows = get_measurements_range(start, end, device_id, epoch=columnar)
+    total = len(rows)
+    if max_points and total > max_points:
+        if columnar:
+            epochs = np.array([row[2] for row in rows], dtype=np.float64)
+        else:
+            epochs = np.array([row[2].timestamp() for row in rows], dtype=np.float64)
+        temperatures = np.array([row[3] for row in rows], dtype=np.float64)
+        humidities = np.array([row[4] for row in rows], dtype=np.float64)
+        # Réduction par capteur, budget de points réparti selon le nombre de mesures
+        by_device = {}
+        for i, row in enumerate(rows):
+            by_device.setdefault(row[1], []).append(i)
+        keep = []
+        for indices in by_device.values():
+            indices = np.array(indices)
+            budget = max(max_points * len(indices) // total, 3)
+            selected = downsample_rows(epochs[indices], temperatures[indices], humidities[indices], budget)
+            keep.extend(indices[selected].tolist())
+        keep.sort()
+        rows = [rows[i] for i in keep]
+    return jsonify({
+        "total": total,
+        "downsampled": len(rows) < total,
+        "points": to_points(rows)
+    })
+
+@api_bp.route("/api/stats")
+@cached
+def api_stats():
+    # Résumés par capteur et par période entière (?period=day|week|month) intersectant [start, end]
+    try:
+        start = parse_datetime_arg("start")
+        end = parse_datetime_arg("end")
+    except ValueError:
+        return jsonify({"error": "Dates invalides"}), 400
+    if not start or not end or start > end:
+        return jsonify({"error": "Plage de dates invalide"}), 400
+    period = request.args.get("period", "day")
+    if period not in PERIODS:
+        return jsonify({"error": f"Période inconnue : {period}"}), 400
+    if (end - start).days > STATS_MAX_PERIODS * {"day": 1, "week": 7, "month": 31}[period]:
+        return jsonify({"error": f"Plus de {STATS_MAX_PERIODS} périodes demandées"}), 400
+    results = get_stats(start, end, period, request.args.get("device"))
+    for summary in results:
+        summary["start"] = format_fr(summary["start"])
+        summary["end"] = format_fr(summary["end"])
+    return jsonify({"period": period, "stats": results})
+
+@api_bp.route("/api/export")
+def api_export():
+    # Export brut en flux : ?start&end (facultatifs), ?device, ?format=csv|ndjson|xlsx
+    try:
+        start = parse_datetime_arg("start")
+        end = parse_datetime_arg("end")
+    except ValueError:
+        return jsonify({"error": "Dates invalides"}), 400
+    if start and end and start > end:
+        return jsonify({"error": "Plage de dates invalide"}), 400
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Format inconnu : {fmt}"}), 400
+    device_id = request.args.get("device")
+    filename = secure_filename(f"mesures_{device_id}") if device_id else "mesures"
+    return export_response(iter_measurements(start, end, device_id), fmt, filename)
+
+@api_bp.route("/api/rollups")
+@cached
+def api_rollups():
+    try:
+        start = parse_datetime_arg("start")
+        end = parse_datetime_arg("end")
+    except ValueError:
+        return jsonify({"error": "Dates invalides"}), 400
+    if not start or not end or start > end:
+        return jsonify({"error": "Plage de dates invalide"}), 400
+    # Résolution souhaitée en secondes : la granularité la plus grossière qui la respecte est utilisée
+    resolution = request.args.get("resolution", 3600, type=int)
+    granularity, rows = get_rollups(start, end, resolution, request.args.get("device"))
+    if granularity is None:
+        return jsonify({"error": "Résolution inférieure à la minute : utiliser /api/history"}), 400
+    return jsonify({
+        "resolution": granularity,
+        "buckets": [
+            {
+                "device_id": row[0],
+                "bucket": row[1].strftime("%d/%m/%Y %H:%M:%S"),
+                "count": row[2],
+                "temperature": {"mean": row[3], "min": row[4], "max": row[5], "last": row[6]},
+                "humidity": {"mean": row[7], "min": row[8], "max": row[9], "last": row[10]}
+            }
+            for row in rows
+        ]
+    })
+
+@api_bp.route("/api/ingest", methods=["POST"])
+@ingest_token_required
+def api_ingest():
+    # Envoi groupé par une passerelle : NDJSON (une mesure JSON par ligne) ou CSV avec en-tête,
+    # champs device_id, temperature, humidity, time (epoch ou date ISO, à la seconde), seq (facultatif).
+    # Corps éventuellement compressé (Content-Encoding: gzip), lu en flux.
+    fmt = request.args.get("format")
+    if fmt is None:
+        content_type = request.mimetype
+        fmt = next((name for name, mimetype in BULK_FORMATS.items() if mimetype == content_type), None)
+    if fmt not in BULK_FORMATS:
+        return jsonify({"error": "Format invalide (ndjson ou csv)"}), 400
+    encoding = request.headers.get("Content-Encoding", "").lower()
+    if encoding not in ("", "identity", "gzip"):
+        return jsonify({"error": "Content-Encoding non supporté (gzip)"}), 415
+    result = ingest_bulk(request.stream, fmt, compressed=encoding == "gzip")
+    return jsonify(result)
 
 @api_bp.route("/api/weather")
 def api_weather():
@@ -107,23 +320,30 @@ def save_alert_config():
     humidity_max = data.get("humidity_max")
     if None in (temp_min, temp_max, humidity_min, humidity_max):
         return jsonify({"error": "Paramètres incomplets"}), 400
+    # Seuils sur les grandeurs dérivées : facultatifs, absents ou null = non surveillés
+    derived_max = tuple(data.get(column) for column in ALERT_DERIVED_COLUMNS)
+    values = (temp_min, temp_max, humidity_min, humidity_max) + derived_max
     try:
         with get_mysql_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT id FROM alert_config WHERE id = 1")
             exists = cursor.fetchone()
             if exists:
-                cursor.execute("""
+                cursor.execute(f"""
                     UPDATE alert_config
-                    SET temp_min = %s, temp_max = %s, humidity_min = %s, humidity_max = %s
+                    SET temp_min = %s, temp_max = %s, humidity_min = %s, humidity_max = %s,
+                        {", ".join(f"{column} = %s" for column in ALERT_DERIVED_COLUMNS)}
                     WHERE id = 1
-                """, (temp_min, temp_max, humidity_min, humidity_max))
+                """, values)
             else:
-                cursor.execute("""
-                    INSERT INTO alert_config (id, temp_min, temp_max, humidity_min, humidity_max)
-                    VALUES (1, %s, %s, %s, %s)
-                """, (temp_min, temp_max, humidity_min, humidity_max))
+                cursor.execute(f"""
+                    INSERT INTO alert_config (id, temp_min, temp_max, humidity_min, humidity_max, {", ".join(ALERT_DERIVED_COLUMNS)})
+                    VALUES (1, %s, %s, %s, %s, %s, %s, %s)
+                """, values)
+                bump(cursor, "alert_config", 1)
             conn.commit()
+        invalidate_alert_config()
+        httpcache.invalidate()
     except Exception as e:
         logging.error(f"Erreur sauvegarde config alerte : {e}")
         return jsonify({"error": "Erreur interne"}), 500
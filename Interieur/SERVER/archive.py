@@ -0,0 +1,197 @@
+import os
+import re
+import sys
+import json
+import logging
+from datetime import datetime, date, timedelta
+from threading import Lock
+
+import numpy as np
+
+from db import get_mysql_connection, as_datetime
+from writer import add_commit_listener
+from config import ARCHIVE_DIR, INGEST_MAX_BACKLOG_DAYS
+
+# Une archive = trois colonnes binaires de même longueur par capteur et par mois, triées par temps
+COLUMNS = (("time", np.int64), ("temp", np.float32), ("hum", np.float32))
+INDEX_FILE = os.path.join(ARCHIVE_DIR, "index.json")  # {"AAAA-MM": {device_id: nombre de lignes}}
+
+_lock = Lock()
+_index = None
+
+def _device_dir(device_id):
+    return os.path.join(ARCHIVE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", device_id))
+
+def _column_path(device_id, month, column):
+    return os.path.join(_device_dir(device_id), f"{month}.{column}")
+
+def _month_key(d):
+    return f"{d.year:04d}-{d.month:02d}"
+
+def _next_month(d):
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+def _months(start, end):
+    month = date(start.year, start.month, 1)
+    while month <= date(end.year, end.month, 1):
+        yield month
+        month = _next_month(month)
+
+def _settled(month):
+    # Un mois n'est archivé qu'une fois passé le délai de rattrapage des capteurs (INGEST_MAX_BACKLOG_DAYS)
+    end = datetime.combine(_next_month(month), datetime.min.time())
+    return end + timedelta(days=INGEST_MAX_BACKLOG_DAYS) <= datetime.now()
+
+def _load_index():
+    global _index
+    with _lock:
+        if _index is None:
+            try:
+                with open(INDEX_FILE) as f:
+                    _index = json.load(f)
+            except FileNotFoundError:
+                _index = {}
+        return _index
+
+def _save_index():
+    tmp = INDEX_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_index, f, indent=1, sort_keys=True)
+    os.replace(tmp, INDEX_FILE)
+
+def export_month(month):
+    # Exporte un mois clos de measurements vers les fichiers colonnaires de chaque capteur
+    start = datetime(month.year, month.month, 1)
+    end = datetime.combine(_next_month(month), datetime.min.time())
+    if not _settled(month):
+        raise ValueError(
+            f"Le mois {_month_key(month)} n'est pas clos depuis au moins {INGEST_MAX_BACKLOG_DAYS} jours"
+        )
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT device_id, time, temperature, humidity FROM measurements
+            WHERE time >= %s AND time < %s
+            ORDER BY device_id, time
+        """, (start, end))
+        rows = cursor.fetchall()
+    by_device = {}
+    for device_id, t, temperature, humidity in rows:
+        by_device.setdefault(device_id, []).append((t.timestamp(), temperature, humidity))
+    key = _month_key(month)
+    counts = {}
+    for device_id, values in by_device.items():
+        os.makedirs(_device_dir(device_id), exist_ok=True)
+        times, temps, hums = zip(*values)
+        for (column, dtype), data in zip(COLUMNS, (times, temps, hums)):
+            path = _column_path(device_id, key, column)
+            np.asarray(data, dtype=dtype).tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        counts[device_id] = len(values)
+    index = _load_index()
+    with _lock:
+        index[key] = counts
+        _save_index()
+    return counts
+
+def export_closed_months():
+    # Exporte tous les mois clos absents de l'archive (jamais exportés ou invalidés depuis)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(time) FROM measurements")
+        first = as_datetime(cursor.fetchone()[0])
+    if first is None:
+        return []
+    index = _load_index()
+    current = date.today().replace(day=1)
+    exported = []
+    for month in _months(first, current):
+        if month >= current or not _settled(month) or _month_key(month) in index:
+            continue
+        counts = export_month(month)
+        logging.info(f"Archive {_month_key(month)} : {counts}")
+        exported.append(_month_key(month))
+    return exported
+
+def invalidate(start, end):
+    # Retire de l'index les mois archivés de [start, end] (start None : depuis le premier) : ils sont
+    # de nouveau lus en base, puis réexportés par le prochain export_closed_months
+    global _index
+    first = _month_key(start) if start else ""
+    last = _month_key(end)
+    with _lock:
+        # Index relu sur disque : un export fait par un autre processus n'est pas écrasé
+        _index = None
+    index = _load_index()
+    with _lock:
+        removed = sorted(key for key in index if first <= key <= last)
+        for key in removed:
+            del index[key]
+        if removed:
+            _save_index()
+    if removed:
+        logging.info(f"Archive : mois invalidé(s) {removed}")
+    return removed
+
+def _on_commit(batch):
+    # Mesures écrites dans un mois déjà archivé (import, réécriture) : ce mois repart en base
+    months = {as_datetime(row[1]).strftime("%Y-%m") for row in batch}
+    archived = months & set(_load_index())
+    for key in sorted(archived):
+        month = datetime.strptime(key, "%Y-%m")
+        invalidate(month, month)
+
+def start_archive():
+    # Appelé au démarrage du serveur
+    add_commit_listener(_on_commit)
+
+def covers(start, end, device_id=None):
+    # Vrai si tous les mois de la plage sont archivés (et le capteur connu de l'archive s'il est précisé)
+    index = _load_index()
+    months = [_month_key(m) for m in _months(start, end)]
+    if not all(m in index for m in months):
+        return False
+    return device_id is None or any(device_id in index[m] for m in months)
+
+def archived_devices(start, end):
+    index = _load_index()
+    devices = set()
+    for month in _months(start, end):
+        devices.update(index.get(_month_key(month), {}))
+    return sorted(devices)
+
+def read_range(device_id, start, end):
+    # (epochs int64, températures float32, humidités float32) entre start et end inclus.
+    # Recherche dichotomique sur la colonne temps ; sur un seul mois, les tableaux sont des vues du memmap.
+    lo, hi = start.timestamp(), end.timestamp()
+    parts = []
+    for month in _months(start, end):
+        key = _month_key(month)
+        if not _load_index().get(key, {}).get(device_id):
+            continue
+        columns = [
+            np.memmap(_column_path(device_id, key, column), dtype=dtype, mode="r")
+            for column, dtype in COLUMNS
+        ]
+        first = np.searchsorted(columns[0], lo, side="left")
+        last = np.searchsorted(columns[0], hi, side="right")
+        parts.append([c[first:last] for c in columns])
+    if not parts:
+        return tuple(np.empty(0, dtype=dtype) for _, dtype in COLUMNS)
+    if len(parts) == 1:
+        return tuple(parts[0])
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+if __name__ == "__main__":
+    # python archive.py export [AAAA-MM]
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "export":
+        print("Usage : python archive.py export [AAAA-MM]")
+        sys.exit(1)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    if len(sys.argv) > 2:
+        print(export_month(datetime.strptime(sys.argv[2], "%Y-%m").date()))
+    else:
+        print(f"Mois archivés : {export_closed_months()}")
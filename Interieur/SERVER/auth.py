@@ -1,7 +1,12 @@
+import os
+import hmac
 from functools import wraps
-from flask import session, redirect, url_for, render_template
+from flask import session, redirect, url_for, render_template, request, jsonify
 from db import get_mysql_connection
 
+# Jetons des passerelles autorisées à envoyer des mesures par /api/ingest (séparés par des virgules)
+INGEST_TOKENS = [token.strip() for token in os.environ.get("INGEST_TOKENS", "").split(",") if token.strip()]
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -25,4 +30,15 @@ def admin_required(f):
                        message="Vous n'avez pas les droits nécessaires pour accéder à cette page.",
                        redirect_url=url_for("index")), 403
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def ingest_token_required(f):
+    # En-tête "Authorization: Bearer <jeton>" ; sans INGEST_TOKENS, l'ingestion HTTP est fermée
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth = request.headers.get("Authorization", "")
+        token = auth[7:].strip() if auth.startswith("Bearer ") else ""
+        if not token or not any(hmac.compare_digest(token, allowed) for allowed in INGEST_TOKENS):
+            return jsonify({"error": "Jeton d'ingestion invalide"}), 401
+        return f(*args, **kwargs)
+    return decorated_function
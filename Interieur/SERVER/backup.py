@@ -1,21 +1,23 @@
 import os
-import shutil
+import tarfile
 import logging
 import time
 from datetime import datetime, timedelta
-from config import BACKUP_DIR, CSV_FILE, BACKUP_INTERVAL_SECONDS, BACKUP_RETENTION_DAYS, CLEANUP_INTERVAL_SECONDS
+from config import BACKUP_DIR, SEGMENTS_DIR, BACKUP_INTERVAL_SECONDS, BACKUP_RETENTION_DAYS, CLEANUP_INTERVAL_SECONDS
 
-def backup_csv():
+def backup_segments():
     while True:
         try:
             if not os.path.exists(BACKUP_DIR):
                 os.makedirs(BACKUP_DIR)
-            backup_filename = datetime.now().strftime("%d-%m-%Y_%H-%M-%S") + "_data.csv"
+            backup_filename = datetime.now().strftime("%d-%m-%Y_%H-%M-%S") + "_segments.tar"
             backup_path = os.path.join(BACKUP_DIR, backup_filename)
-            shutil.copy(CSV_FILE, backup_path)
+            # Segments fermés déjà compressés : archive tar simple
+            with tarfile.open(backup_path, "w") as tar:
+                tar.add(SEGMENTS_DIR, arcname="segments")
             logging.info(f"Sauvegarde effectuée : {backup_path}")
         except Exception as e:
-            logging.error(f"Backup CSV : {e}")
+            logging.error(f"Backup segments : {e}")
         time.sleep(BACKUP_INTERVAL_SECONDS)
 
 def cleanup_old_backups():
@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+# python bench_storage.py [nombre de mesures]
+# Compare les latences d'écriture et de lecture des moteurs MySQL et SQLite.
+# Chaque moteur est mesuré dans un sous-processus (DB_BACKEND positionné) ; SQLite travaille sur un
+# fichier temporaire, MySQL sur la base du .env (de préférence une base de test). Les mesures du
+# capteur de test sont supprimées à la fin.
+
+DEVICE_ID = "bench"
+READ_REPEAT = 50
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return {"p50_ms": round(pick(0.5), 3), "p95_ms": round(pick(0.95), 3)}
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def _cleanup(get_mysql_connection):
+    from sequence import bump
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM measurements WHERE device_id = %s", (DEVICE_ID,))
+        bump(cursor, "measurements", -cursor.rowcount)
+        cursor.execute("DELETE FROM measurements_rollup WHERE device_id = %s", (DEVICE_ID,))
+        conn.commit()
+
+def run(count):
+    from db import get_mysql_connection, is_sqlite
+    from migrations import upgrade, check_schema
+    from writer import insert_rows
+    from utils import get_measurements, get_measurements_range
+    from rollups import get_rollups
+    from config import WRITE_BATCH_SIZE
+
+    if is_sqlite():
+        upgrade()
+    else:
+        check_schema()
+    _cleanup(get_mysql_connection)
+
+    # Une mesure par minute jusqu'à maintenant, comme un capteur réel
+    now = datetime.now().replace(microsecond=0)
+    times = [now - timedelta(minutes=count - i) for i in range(count)]
+    rows = [
+        (DEVICE_ID, t.strftime("%Y-%m-%d %H:%M:%S"),
+         round(random.uniform(18, 25), 1), round(random.uniform(35, 60), 1), 0, None, int(t.timestamp()))
+        for t in times
+    ]
+
+    def write(batch):
+        with get_mysql_connection() as conn:
+            insert_rows(conn.cursor(), batch)
+            conn.commit()
+
+    results = {}
+    try:
+        # Écriture : une mesure par transaction (sans file), puis par lots du writer
+        single = rows[:min(200, count)]
+        samples = []
+        for row in single:
+            start = time.perf_counter()
+            write([row])
+            samples.append(time.perf_counter() - start)
+        results["ingest_1_row"] = _percentiles(samples)
+        samples = []
+        batched = rows[len(single):]
+        for i in range(0, len(batched), WRITE_BATCH_SIZE):
+            batch = batched[i:i + WRITE_BATCH_SIZE]
+            start = time.perf_counter()
+            write(batch)
+            samples.append(time.perf_counter() - start)
+        if samples:
+            results[f"ingest_{WRITE_BATCH_SIZE}_rows"] = dict(
+                _percentiles(samples), rows_per_s=round(len(batched) / sum(samples))
+            )
+
+        def latest():
+            with get_mysql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT temperature, humidity FROM measurements ORDER BY time DESC LIMIT 1")
+                cursor.fetchone()
+
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(id) FROM measurements")
+            last_id = cursor.fetchone()[0]
+        reads = {
+            "latest": latest,
+            "tail_1000": lambda: get_measurements(limit=1000),
+            "since_id_60": lambda: get_measurements(since_id=last_id - 60),
+            "range_24h": lambda: get_measurements_range(now - timedelta(days=1), now, DEVICE_ID),
+            "rollups_7d_hourly": lambda: get_rollups(now - timedelta(days=7), now, 3600, DEVICE_ID),
+        }
+        for name, fn in reads.items():
+            fn()
+            results[f"read_{name}"] = _percentiles(_timed(fn, READ_REPEAT))
+    finally:
+        _cleanup(get_mysql_connection)
+    return results
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    backends = ["sqlite"]
+    if os.environ.get("MYSQL_HOST", "").strip():
+        backends.insert(0, "mysql")
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            env = dict(os.environ, DB_BACKEND=backend)
+            if backend == "sqlite":
+                env["SQLITE_PATH"] = os.path.join(tmp, "bench.db")
+            out = subprocess.run(
+                [sys.executable, __file__, "--run", str(count)], env=env, capture_output=True, text=True
+            )
+            if out.returncode != 0:
+                print(f"{backend} : échec\n{out.stderr}")
+                continue
+            report[backend] = json.loads(out.stdout.strip().splitlines()[-1])
+    for backend, results in report.items():
+        print(f"== {backend} ({count} mesures)")
+        for name, values in results.items():
+            print(f"  {name:<24} " + "  ".join(f"{k}={v}" for k, v in values.items()))
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        print(json.dumps(run(int(sys.argv[2]))))
+    else:
+        main()
@@ -0,0 +1,57 @@
+import numpy as np
+
+# Grandeurs dérivées de la température (°C) et de l'humidité relative (%), calculées sur des
+# tableaux numpy entiers (un lot du writer, une colonne d'archive) ; acceptent aussi des scalaires.
+DERIVED = ("dew_point", "abs_humidity", "heat_index")
+
+# Constantes de Magnus (Alduchov & Eskridge), valables de -40 à +50 °C
+MAGNUS_A = 17.625
+MAGNUS_B = 243.04
+
+def _inputs(temperature, humidity):
+    temperature = np.asarray(temperature, dtype=np.float64)
+    # Une humidité nulle donnerait log(0) : bornée à 0,1 %
+    humidity = np.clip(np.asarray(humidity, dtype=np.float64), 0.1, 100.0)
+    return temperature, humidity
+
+def dew_point(temperature, humidity):
+    # Point de rosée (°C)
+    temperature, humidity = _inputs(temperature, humidity)
+    gamma = np.log(humidity / 100.0) + MAGNUS_A * temperature / (MAGNUS_B + temperature)
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+def absolute_humidity(temperature, humidity):
+    # Humidité absolue (g/m³) : pression de vapeur saturante (Magnus) et loi des gaz parfaits
+    temperature, humidity = _inputs(temperature, humidity)
+    saturation = 6.112 * np.exp(MAGNUS_A * temperature / (MAGNUS_B + temperature))
+    return saturation * humidity * 2.1674 / (273.15 + temperature)
+
+def heat_index(temperature, humidity):
+    # Indice de chaleur (°C), algorithme du NWS : formule simple de Steadman sous 80 °F,
+    # régression de Rothfusz et ses corrections au-delà
+    temperature, humidity = _inputs(temperature, humidity)
+    f = temperature * 9 / 5 + 32
+    simple = 0.5 * (f + 61.0 + (f - 68.0) * 1.2 + humidity * 0.094)
+    full = (
+        -42.379 + 2.04901523 * f + 10.14333127 * humidity
+        - 0.22475541 * f * humidity - 6.83783e-3 * f * f
+        - 5.481717e-2 * humidity * humidity + 1.22874e-3 * f * f * humidity
+        + 8.5282e-4 * f * humidity * humidity - 1.99e-6 * f * f * humidity * humidity
+    )
+    dry = (humidity < 13) & (f >= 80) & (f <= 112)
+    full = full - np.where(dry, (13 - humidity) / 4 * np.sqrt(np.clip(17 - np.abs(f - 95), 0, None) / 17), 0)
+    humid = (humidity > 85) & (f >= 80) & (f <= 87)
+    full = full + np.where(humid, (humidity - 85) / 10 * (87 - f) / 5, 0)
+    index = np.where((simple + f) / 2 >= 80, full, simple)
+    return (index - 32) * 5 / 9
+
+def derive(temperatures, humidities):
+    # (points de rosée, humidités absolues, indices de chaleur) arrondis au centième
+    return tuple(
+        np.round(metric(temperatures, humidities), 2)
+        for metric in (dew_point, absolute_humidity, heat_index)
+    )
+
+def derive_one(temperature, humidity):
+    # Même calcul pour une seule mesure : {"dew_point": ..., "abs_humidity": ..., "heat_index": ...}
+    return dict(zip(DERIVED, (float(value) for value in derive(temperature, humidity))))
@@ -6,10 +6,94 @@ WEB_DIR = os.path.join(BASE_DIR, "WEB")
 DATA_DIR = os.path.join(BASE_DIR, "DATA")
 BACKUP_DIR = os.path.join(BASE_DIR, "BACKUPS")
 CSV_FILE = os.path.join(DATA_DIR, "data.csv")
+SEGMENTS_DIR = os.path.join(DATA_DIR, "segments")  # un fichier CSV par capteur et par jour
+SEGMENT_INDEX_FILE = os.path.join(SEGMENTS_DIR, "index.json")
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")  # archives colonnaires mensuelles (numpy.memmap)
 # Variables d'environnement et valeurs par défaut
 SERVER_ADDRESS = os.environ.get("SERVER_ADDRESS")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", 10000))
 
 BACKUP_INTERVAL_SECONDS = 86400  # 24h
 CLEANUP_INTERVAL_SECONDS = 86400  # 24h
-BACKUP_RETENTION_DAYS = 5
\ No newline at end of file
+BACKUP_RETENTION_DAYS = 5
+
+# Rétention des mesures : par capteur ("default" pour les autres), liste de paliers
+# (âge en jours, pas en secondes) -> au-delà de cet âge, moyennes par pas de N secondes.
+# Ex. : brut 30 jours, puis moyennes 5 min pendant un an, puis horaires sans limite.
+RETENTION_POLICY = {
+    "default": [(30, 300), (365, 3600)],
+}
+RETENTION_MAX_AGE_DAYS = None  # suppression définitive au-delà (None = jamais)
+RETENTION_CHUNK_HOURS = 24  # fenêtre traitée par transaction
+RETENTION_DELETE_BATCH = 5000  # lignes supprimées par transaction (purge)
+RETENTION_INTERVAL_SECONDS = 86400  # 24h
+
+# Serveur d'ingestion (socket_server)
+INGEST_BACKLOG = int(os.environ.get("INGEST_BACKLOG", 1024))  # file d'attente du listen()
+INGEST_LINE_LIMIT = 4096  # taille max d'une ligne reçue (octets)
+INGEST_READ_TIMEOUT = float(os.environ.get("INGEST_READ_TIMEOUT", 30))  # secondes sans données avant fermeture
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))  # mesures en attente de traitement
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 4))  # threads de traitement (MySQL, Home Assistant)
+# Processus d'ingestion (workers.py) : chacun écoute SERVER_PORT avec SO_REUSEPORT et a son propre
+# writer ; 0 = ingestion dans un thread du processus Flask
+INGEST_PROCESSES = int(os.environ.get("INGEST_PROCESSES", 0))
+INGEST_STATS_INTERVAL_SECONDS = 5  # relevé des compteurs de chaque processus
+INGEST_RESTART_MAX_DELAY_SECONDS = 60  # attente max avant de relancer un processus qui plante en boucle
+INGEST_SESSION_TIMEOUT = float(os.environ.get("INGEST_SESSION_TIMEOUT", 180))  # inactivité tolérée sur une connexion v2 (s)
+INGEST_FRAME_MAX_READINGS = 500  # mesures max par trame v2
+INGEST_CLOCK_SKEW_SECONDS = 300  # avance max tolérée de l'horloge d'un capteur
+INGEST_MAX_BACKLOG_DAYS = 7  # âge max d'une mesure horodatée par le capteur
+INGEST_HTTP_MAX_READINGS = int(os.environ.get("INGEST_HTTP_MAX_READINGS", 100000))  # mesures max par requête /api/ingest
+INGEST_HTTP_MAX_ERRORS = 100  # erreurs détaillées renvoyées par requête /api/ingest
+
+# File d'écriture différée des mesures (writer)
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 500))  # lignes max par lot
+WRITE_FLUSH_INTERVAL_MS = int(os.environ.get("WRITE_FLUSH_INTERVAL_MS", 1000))  # délai max avant écriture d'un lot
+
+# Journal d'écriture local (journal) : mesures gardées sur disque jusqu'à leur écriture en base
+JOURNAL_DIR = os.path.join(DATA_DIR, "journal")  # un sous-dossier par processus écrivain
+JOURNAL_SEGMENT_BYTES = 4 * 1024 * 1024  # taille d'un segment avant passage au suivant
+JOURNAL_FSYNC_INTERVAL_MS = int(os.environ.get("JOURNAL_FSYNC_INTERVAL_MS", 200))  # 0 = fsync à chaque mesure
+JOURNAL_RETRY_MAX_SECONDS = 30  # attente max entre deux essais quand la base refuse un lot
+
+# Lecture incrémentale des mesures (/data)
+MEASUREMENTS_MAX_LIMIT = int(os.environ.get("MEASUREMENTS_MAX_LIMIT", 5000))  # lignes max par requête since/tail
+HISTORY_DEFAULT_POINTS = 2000  # points renvoyés par défaut par /api/history
+HISTORY_MAX_POINTS = 20000  # plafond de max_points pour /api/history
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", 5000))  # lignes lues par fetchmany pendant un export
+
+# Diffusion en direct des mesures (live, Server-Sent Events)
+LIVE_PORT = int(os.environ.get("LIVE_PORT", 5001))  # port du flux /stream (0 = désactivé, polling seul)
+LIVE_CLIENT_QUEUE = 256  # messages en attente par client avant déconnexion d'un client trop lent
+LIVE_KEEPALIVE_SECONDS = 15  # commentaire envoyé sur un flux inactif
+LIVE_READ_TIMEOUT = 10  # délai max de lecture de la requête HTTP (s)
+
+# Cache HTTP des lectures JSON (httpcache)
+HTTP_CACHE_MAX_ENTRIES = 64  # réponses sérialisées gardées pour l'ETag courant
+HTTP_COMPRESS_MIN_BYTES = 1024  # taille à partir de laquelle la réponse est compressée (gzip, brotli)
+
+# Détection des défauts de capteur à l'ingestion (anomaly)
+ANOMALY_TEMP_RANGE = (-40.0, 80.0)  # plage de mesure du DHT22 (°C), hors plage = quarantaine
+ANOMALY_HUMIDITY_RANGE = (0.0, 100.0)  # %
+ANOMALY_STUCK_SECONDS = int(os.environ.get("ANOMALY_STUCK_SECONDS", 3600))  # valeurs figées au-delà
+ANOMALY_MAX_TEMP_RATE = 5.0  # variation max plausible (°C par minute)
+ANOMALY_MAX_HUMIDITY_RATE = 20.0  # variation max plausible (% par minute)
+ANOMALY_MIN_INTERVAL_SECONDS = 10  # écart minimal pris en compte dans le calcul des vitesses
+ANOMALY_EWMA_ALPHA = 0.05  # poids d'une nouvelle mesure dans la moyenne et la variance glissantes
+ANOMALY_Z_THRESHOLD = 6.0  # écart à la moyenne glissante, en écarts types, au-delà duquel la mesure est aberrante
+ANOMALY_MIN_DEVIATION = (1.0, 5.0)  # écart absolu minimal (°C, %) pour une mesure aberrante
+ANOMALY_WARMUP_SAMPLES = 30  # mesures nécessaires avant de juger les écarts à la moyenne
+ANOMALY_QUARANTINE_DAYS = 30  # conservation des mesures en quarantaine
+
+# Statistiques par période (/api/stats)
+STATS_PERCENTILES = (5, 25, 50, 75, 95)
+STATS_MAX_GAP_SECONDS = 900  # durée max attribuée à une mesure pour le temps hors seuils (trous de données)
+STATS_MAX_PERIODS = 400  # périodes max par requête
+STATS_BATCH_DAYS = 31  # plage lue en une fois pour les périodes à calculer
+
+# Compteurs de lignes de la table sequence
+SEQUENCE_RECONCILE_INTERVAL_SECONDS = None  # vérification périodique des compteurs (None = désactivée)
+SEQUENCE_RECONCILE_CHUNK = 100000  # plage d'id comptée par requête
+
+# Segments CSV journaliers (segments)
+SEGMENT_FSYNC_INTERVAL_SECONDS = float(os.environ.get("SEGMENT_FSYNC_INTERVAL_SECONDS", 5))  # 0 = fsync à chaque lot
@@ -1,11 +1,305 @@
 import os
+import time
+import queue
+import sqlite3
+import logging
+from datetime import datetime, date
+from threading import Lock, local
 import mysql.connector
 
-def get_mysql_connection():
+from config import DATA_DIR
+
+# Erreurs d'unicité, quel que soit le moteur
+IntegrityError = (mysql.connector.IntegrityError, sqlite3.IntegrityError)
+
+class PoolTimeout(Exception):
+    pass
+
+def get_backend():
+    # DB_BACKEND=mysql (défaut) ou sqlite ; lu à l'appel car le .env est chargé après les imports
+    return os.environ.get("DB_BACKEND", "mysql").strip().lower()
+
+def is_sqlite():
+    return get_backend() == "sqlite"
+
+def epoch_sql(column):
+    # Expression SQL : heure enregistrée en secondes depuis 1970, comptée comme UTC (indépendante du fuseau)
+    if is_sqlite():
+        return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400) AS INTEGER)"
+    return f"TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', {column})"
+
+def as_datetime(value):
+    # SQLite renvoie du texte pour les agrégats (MIN(time), ...) : conversion homogène
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+# ========== SQLITE ==========
+sqlite3.register_adapter(datetime, lambda d: d.strftime("%Y-%m-%d %H:%M:%S"))
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+
+class SQLiteCursor:
+    # Même usage qu'un curseur mysql.connector : paramètres "%s" traduits en "?"
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace("%s", "?"), tuple(params))
+        return self
+
+    def executemany(self, query, seq):
+        self._cursor.executemany(query.replace("%s", "?"), seq)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteConnection:
+    # Une connexion par thread, réutilisée ; la sortie du "with" le plus externe annule
+    # ce qui n'a pas été validé, comme la fermeture d'une connexion MySQL.
+    def __init__(self, raw):
+        self._raw = raw
+        self._depth = 0
+
+    def cursor(self, **kwargs):
+        return SQLiteCursor(self._raw.cursor())
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0 and self._raw.in_transaction:
+            self._raw.rollback()
+
+_sqlite_local = local()
+
+def _sqlite_connect():
+    path = os.environ.get("SQLITE_PATH", os.path.join(DATA_DIR, "dhtlogger.db"))
+    raw = sqlite3.connect(
+        path,
+        timeout=float(os.environ.get("SQLITE_BUSY_TIMEOUT", 10)),
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=512  # cache de requêtes préparées par connexion
+    )
+    # WAL : lecteurs concurrents pendant l'écriture, un seul fsync par transaction au checkpoint
+    raw.execute("PRAGMA journal_mode=WAL")
+    raw.execute("PRAGMA synchronous=NORMAL")
+    raw.execute("PRAGMA temp_store=MEMORY")
+    raw.execute("PRAGMA cache_size=-16000")
+    return SQLiteConnection(raw)
+
+def _get_sqlite_connection():
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is None:
+        conn = _sqlite_local.conn = _sqlite_connect()
+    return conn
+
+# ========== MYSQL ==========
+
+def _connect():
     return mysql.connector.connect(
         host=os.environ.get("MYSQL_HOST"),
         port=int(os.environ.get("MYSQL_PORT", 3306)),
         user=os.environ.get("MYSQL_USER"),
         password=os.environ.get("MYSQL_PASSWORD"),
         database=os.environ.get("MYSQL_DATABASE")
-    )
\ No newline at end of file
+    )
+
+class PooledConnection:
+    # Enveloppe d'une connexion MySQL : même API, mais "with" / close() la rendent au pool
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = True
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self)
+
+class ConnectionPool:
+    def __init__(self, size, max_overflow, recycle, pre_ping, timeout):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = Lock()
+        self._open = 0
+        self._stats = {
+            "checkouts": 0,
+            "connects": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+            "timeouts": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+        }
+
+    def _discard(self, conn):
+        with self._lock:
+            self._open -= 1
+        try:
+            conn._raw.close()
+        except Exception:
+            pass
+
+    def _reserve_slot(self):
+        with self._lock:
+            if self._open < self.size + self.max_overflow:
+                self._open += 1
+                return True
+        return False
+
+    def _new_connection(self):
+        try:
+            raw = _connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+        with self._lock:
+            self._stats["connects"] += 1
+        return PooledConnection(self, raw, time.monotonic())
+
+    def _usable(self, conn):
+        if self.recycle and time.monotonic() - conn._created_at > self.recycle:
+            with self._lock:
+                self._stats["recycled"] += 1
+            self._discard(conn)
+            return False
+        if self.pre_ping:
+            try:
+                conn._raw.ping(reconnect=False)
+            except Exception:
+                with self._lock:
+                    self._stats["ping_failures"] += 1
+                self._discard(conn)
+                return False
+        return True
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve_slot():
+                    conn = self._new_connection()
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    conn = self._idle.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"Aucune connexion MySQL disponible après {self.timeout}s")
+            if self._usable(conn):
+                break
+        waited_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_total_ms"] += waited_ms
+            self._stats["wait_max_ms"] = max(self._stats["wait_max_ms"], waited_ms)
+        conn._released = False
+        return conn
+
+    def release(self, conn):
+        try:
+            # Résultats non lus et transaction ouverte ne doivent pas fuir vers le prochain emprunteur
+            conn._raw.consume_results()
+            conn._raw.rollback()
+        except Exception as e:
+            logging.warning(f"Connexion MySQL écartée du pool : {e}")
+            self._discard(conn)
+            return
+        # Au-delà de "size" connexions inactives, les connexions de débordement sont fermées
+        if self._idle.qsize() >= self.size:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = self._open
+        stats["idle"] = self._idle.qsize()
+        stats["in_use"] = stats["open"] - stats["idle"]
+        stats["wait_avg_ms"] = stats["wait_total_ms"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+_pool = None
+_pool_lock = Lock()
+
+def _get_pool():
+    global _pool
+    # Création paresseuse : les variables du .env sont chargées après l'import des modules
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                size=int(os.environ.get("MYSQL_POOL_SIZE", 5)),
+                max_overflow=int(os.environ.get("MYSQL_POOL_MAX_OVERFLOW", 10)),
+                recycle=int(os.environ.get("MYSQL_POOL_RECYCLE", 3600)),
+                pre_ping=os.environ.get("MYSQL_POOL_PRE_PING", "1") == "1",
+                timeout=float(os.environ.get("MYSQL_POOL_TIMEOUT", 30))
+            )
+        return _pool
+
+def get_mysql_connection():
+    # Point d'entrée unique de l'accès base, quel que soit le moteur configuré
+    if is_sqlite():
+        return _get_sqlite_connection()
+    pool = _get_pool()
+    if pool.size + pool.max_overflow <= 0:
+        # Pool désactivé (MYSQL_POOL_SIZE=0 et MYSQL_POOL_MAX_OVERFLOW=0)
+        return _connect()
+    return pool.acquire()
+
+def get_pool_stats():
+    if is_sqlite():
+        return {"backend": "sqlite"}
+    return _get_pool().stats()
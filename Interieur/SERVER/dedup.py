@@ -0,0 +1,31 @@
+from threading import Lock
+
+# Marques de niveau par capteur : dernière mesure enregistrée (séquence, epoch). Une trame renvoyée
+# après un ACK perdu est reconnue ici sans passer par la base ; la clé unique (device_id, time, epoch)
+# de measurements reste le filet de sécurité (redémarrage du serveur, imports).
+_lock = Lock()
+_marks = {}  # device_id -> (séquence, epoch)
+_stats = {"checked": 0, "duplicates": 0}
+
+def is_duplicate(device_id, seq, epoch):
+    # Doublon si la séquence ET l'heure ne dépassent pas la dernière mesure enregistrée : un capteur
+    # dont la séquence repart de 1 (mémoire RTC perdue) reste accepté puisque son heure avance
+    with _lock:
+        _stats["checked"] += 1
+        mark = _marks.get(device_id)
+        if mark is not None and seq <= mark[0] and epoch <= mark[1]:
+            _stats["duplicates"] += 1
+            return True
+        return False
+
+def mark_stored(device_id, seq, epoch):
+    # Appelé une fois la mesure enregistrée seulement : une mesure refusée puis renvoyée par le
+    # client n'est pas prise pour un doublon
+    with _lock:
+        _marks[device_id] = (seq, epoch)
+
+def get_dedup_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["devices"] = len(_marks)
+    return stats
@@ -0,0 +1,40 @@
+import numpy as np
+
+def lttb_indices(x, y, threshold):
+    # Largest-Triangle-Three-Buckets : indices des points à garder pour conserver la forme de la courbe
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Premier et dernier points toujours gardés, le reste découpé en threshold - 2 paquets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Point moyen du paquet suivant
+        next_start = end
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        if next_end <= next_start:
+            next_end = next_start + 1
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Point du paquet courant formant le plus grand triangle avec a et le point moyen
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+def downsample_rows(epochs, temperatures, humidities, max_points):
+    # Garde les points significatifs des deux courbes (moitié du budget chacune)
+    if max_points <= 0 or len(epochs) <= max_points:
+        return np.arange(len(epochs))
+    half = max(max_points // 2, 3)
+    temp_idx = lttb_indices(epochs, temperatures, half)
+    hum_idx = lttb_indices(epochs, humidities, half)
+    return np.union1d(temp_idx, hum_idx)
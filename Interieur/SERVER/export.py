@@ -0,0 +1,183 @@
+import io
+import csv
+import json
+import tempfile
+from datetime import datetime, date
+
+import numpy as np
+from flask import Response, stream_with_context
+from openpyxl import Workbook
+
+from db import get_mysql_connection, as_datetime
+import archive
+from utils import MEASUREMENT_COLUMNS
+from climate import DERIVED, derive
+from anomaly import flag_names
+from config import EXPORT_FETCH_SIZE
+
+# Exports en flux : chaque format est un générateur de blocs d'octets, alimenté par un curseur
+# non bufferisé lu par fetchmany. La mémoire reste bornée quelle que soit la plage exportée.
+HEADER = [
+    "ID", "Date/Heure", "Temperature (C)", "Humidite (%)",
+    "Point de rosee (C)", "Humidite absolue (g/m3)", "Indice de chaleur (C)", "Defauts"
+]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+XLSX_MAX_ROWS = 1048576  # lignes max d'une feuille Excel (en-tête compris)
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+def _month_bounds(start, end):
+    # Découpe [start, end] par mois civil : chaque morceau est lu depuis l'archive ou depuis la base
+    month = date(start.year, start.month, 1)
+    while month <= date(end.year, end.month, 1):
+        following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        yield max(start, datetime(month.year, month.month, 1)), min(end, datetime.combine(following, datetime.min.time()))
+        month = following
+
+def _iter_database(start, end, device_id, inclusive):
+    query = f"""
+        SELECT device_id, time, {MEASUREMENT_COLUMNS} FROM measurements
+        WHERE time >= %s AND time {'<=' if inclusive else '<'} %s
+    """
+    params = [start, end]
+    if device_id:
+        query += " AND device_id = %s"
+        params.append(device_id)
+    query += " ORDER BY time ASC"
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(query, params)
+        while True:
+            chunk = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not chunk:
+                break
+            yield from chunk
+
+def _iter_archive(start, end, device_id, inclusive):
+    # Mois clos archivés : colonnes memmap de chaque capteur fusionnées par ordre chronologique
+    devices = [device_id] if device_id else archive.archived_devices(start, end)
+    columns = [archive.read_range(device, start, end) for device in devices]
+    if not columns:
+        return
+    owners = np.concatenate([np.full(len(c[0]), i, dtype=np.int32) for i, c in enumerate(columns)])
+    epochs, temperatures, humidities = (np.concatenate(column) for column in zip(*columns))
+    order = np.argsort(epochs, kind="stable")
+    limit = end.timestamp()
+    for i in range(0, len(order), EXPORT_FETCH_SIZE):
+        chunk = order[i:i + EXPORT_FETCH_SIZE]
+        # L'archive ne garde que les mesures brutes : grandeurs dérivées calculées par bloc, défauts inconnus
+        derived = (column.tolist() for column in derive(temperatures[chunk], humidities[chunk]))
+        for owner, epoch, temperature, humidity, *values in zip(
+            owners[chunk].tolist(), epochs[chunk].tolist(),
+            temperatures[chunk].tolist(), humidities[chunk].tolist(), *derived
+        ):
+            if epoch > limit or (epoch == limit and not inclusive):
+                return
+            yield (devices[owner], datetime.fromtimestamp(epoch), round(temperature, 2), round(humidity, 2), *values, None)
+
+def measurement_bounds(device_id=None):
+    # Première et dernière heure de mesure (None, None si aucune mesure)
+    query = "SELECT MIN(time), MAX(time) FROM measurements"
+    params = ()
+    if device_id:
+        query += " WHERE device_id = %s"
+        params = (device_id,)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        first, last = cursor.fetchone()
+    return as_datetime(first), as_datetime(last)
+
+def iter_measurements(start=None, end=None, device_id=None):
+    # (device_id, time, temperature, humidity, grandeurs dérivées) de [start, end], triées par heure ; sans borne,
+    # depuis la première ou jusqu'à la dernière mesure
+    if start is None or end is None:
+        first, last = measurement_bounds(device_id)
+        if first is None:
+            return
+        start, end = start or first, end or last
+    for chunk_start, chunk_end in _month_bounds(start, end):
+        inclusive = chunk_end == end
+        source = _iter_archive if archive.covers(chunk_start, chunk_start, device_id) else _iter_database
+        yield from source(chunk_start, chunk_end, device_id, inclusive)
+
+def _buffered(lines, size=64 * 1024):
+    # Regroupe les lignes produites en blocs d'environ 64 Ko avant envoi
+    buffer = io.StringIO()
+    for line in lines:
+        buffer.write(line)
+        if buffer.tell() >= size:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def _flags_text(flags):
+    # Défauts signalés à l'ingestion, "?" pour les mesures archivées (non conservés)
+    return "?" if flags is None else "+".join(flag_names(flags))
+
+def _csv_lines(rows, prefix=()):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(prefix)
+    writer.writerow(HEADER)
+    for device_id, t, *values, flags in rows:
+        writer.writerow((device_id, t.strftime(TIME_FORMAT), *values, _flags_text(flags)))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def _ndjson_lines(rows):
+    for device_id, t, *values, flags in rows:
+        yield json.dumps({
+            "device_id": device_id, "time": t.strftime(TIME_FORMAT), **dict(zip(("temperature", "humidity") + DERIVED, values)),
+            "flags": flag_names(flags) if flags is not None else None
+        }) + "\n"
+
+def _xlsx_chunks(rows):
+    # Mode write-only : les lignes partent sur disque au fil de l'eau ; le classeur n'est
+    # complet (et donc envoyé) qu'une fois toutes les lignes écrites
+    workbook = Workbook(write_only=True)
+    sheet = None
+    count = XLSX_MAX_ROWS
+    for row in rows:
+        if count >= XLSX_MAX_ROWS:
+            sheet = workbook.create_sheet(f"Données {len(workbook.worksheets) + 1}")
+            sheet.append(HEADER)
+            count = 1
+        sheet.append(row[:-1] + (_flags_text(row[-1]),))
+        count += 1
+    if sheet is None:
+        workbook.create_sheet("Données 1").append(HEADER)
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while True:
+            chunk = file.read(64 * 1024)
+            if not chunk:
+                break
+            yield chunk
+
+def stream_export(rows, fmt, prefix=()):
+    # prefix : lignes écrites avant l'en-tête (CSV uniquement)
+    if fmt == "csv":
+        return _buffered(_csv_lines(rows, prefix))
+    if fmt == "ndjson":
+        return _buffered(_ndjson_lines(rows))
+    if fmt == "xlsx":
+        return _xlsx_chunks(rows)
+    raise ValueError(f"Format d'export inconnu : {fmt}")
+
+def export_response(rows, fmt, filename, prefix=()):
+    # Réponse envoyée au fil de la lecture : ni la base ni Flask ne gardent l'export entier en mémoire
+    mimetype, extension = FORMATS[fmt]
+    return Response(
+        stream_with_context(stream_export(rows, fmt, prefix)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+    )
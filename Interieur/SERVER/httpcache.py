@@ -0,0 +1,125 @@
+import gzip
+from functools import wraps
+from threading import Lock
+from collections import OrderedDict
+
+from flask import request, make_response
+
+from db import get_mysql_connection, as_datetime
+from writer import add_commit_listener
+from config import HTTP_CACHE_MAX_ENTRIES, HTTP_COMPRESS_MIN_BYTES
+
+try:
+    import brotli  # facultatif : pip install brotli
+except ImportError:
+    brotli = None
+
+# Validateur des lectures : dernier id et dernière heure de mesure validés en base, plus une
+# génération incrémentée quand des données existantes changent (rétention, seuils d'alerte).
+# Tenu en mémoire par le writer : un client à jour reçoit 304 sans requête en base.
+_lock = Lock()
+_validator = None  # [dernier id, dernière heure, génération]
+_cache = OrderedDict()  # (chemin, requête, etag) -> {"body", "gzip", "br", "mimetype"}
+_building = {}  # clé -> Lock : une seule sérialisation pour des requêtes identiques simultanées
+
+def _on_commit(batch):
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM measurements")
+        last_id = cursor.fetchone()[0] or 0
+    newest = max(as_datetime(row[1]) for row in batch)
+    with _lock:
+        _validator[0] = last_id
+        _validator[1] = max(_validator[1], newest) if _validator[1] else newest
+
+def start_http_cache():
+    # Appelé au démarrage du serveur ; sans lui, les réponses ne sont ni mises en cache ni validées
+    global _validator
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id), MAX(time) FROM measurements")
+        last_id, last_time = cursor.fetchone()
+    _validator = [last_id or 0, as_datetime(last_time), 0]
+    add_commit_listener(_on_commit)
+
+def invalidate():
+    # Données existantes modifiées : tous les ETag émis deviennent obsolètes
+    with _lock:
+        if _validator is not None:
+            _validator[2] += 1
+            _cache.clear()
+
+def current_etag():
+    with _lock:
+        if _validator is None:
+            return None
+        last_id, last_time, generation = _validator
+    return f"{last_id}-{int(last_time.timestamp()) if last_time else 0}-{generation}"
+
+def _store(key, response):
+    body = response.get_data()
+    entry = {"body": body, "gzip": None, "br": None, "mimetype": response.mimetype}
+    if len(body) >= HTTP_COMPRESS_MIN_BYTES:
+        entry["gzip"] = gzip.compress(body, compresslevel=6)
+        if brotli is not None:
+            entry["br"] = brotli.compress(body, quality=5)
+    with _lock:
+        # Les entrées d'un ancien ETag ne seront plus servies
+        for old in [k for k in _cache if k[2] != key[2]]:
+            del _cache[old]
+        _cache[key] = entry
+        while len(_cache) > HTTP_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return entry
+
+def _respond(entry, etag):
+    accepted = request.accept_encodings
+    encoding = None
+    if entry["br"] is not None and accepted["br"]:
+        encoding = "br"
+    elif entry["gzip"] is not None and accepted["gzip"]:
+        encoding = "gzip"
+    response = make_response(entry[encoding] if encoding else entry["body"])
+    response.mimetype = entry["mimetype"]
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.set_etag(etag)
+    # no-cache : le navigateur garde la réponse mais revalide à chaque appel (If-None-Match)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def cached(view):
+    # Lecture JSON dépendant uniquement des mesures : 304 si le client est à jour, sinon réponse
+    # sérialisée une fois par ETag et par URL, compressée si elle est assez grosse
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = current_etag()
+        if etag is None:
+            return view(*args, **kwargs)
+        if etag in request.if_none_match:
+            response = make_response("", 304)
+            response.set_etag(etag)
+            return response
+        key = (request.path, request.query_string, etag)
+        with _lock:
+            entry = _cache.get(key)
+            building = _building.setdefault(key, Lock()) if entry is None else None
+        if entry is None:
+            try:
+                with building:
+                    with _lock:
+                        entry = _cache.get(key)
+                    if entry is None:
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        entry = _store(key, response)
+            finally:
+                with _lock:
+                    _building.pop(key, None)
+        return _respond(entry, etag)
+    return wrapper
+
+def get_cache_stats():
+    return {"entries": len(_cache), "etag": current_etag()}
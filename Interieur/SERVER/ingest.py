@@ -0,0 +1,223 @@
+import io
+import csv
+import gzip
+import json
+import time
+import zlib
+import logging
+from datetime import datetime
+
+from db import get_mysql_connection
+from utils import add_measurement
+from homeassistant import send_to_home_assistant
+from admin import get_homeassistant_enabled
+from anomaly import check, is_quarantined, quarantine
+from dedup import is_duplicate, mark_stored
+import journal
+from config import (
+    INGEST_CLOCK_SKEW_SECONDS, INGEST_MAX_BACKLOG_DAYS, INGEST_HTTP_MAX_READINGS, INGEST_HTTP_MAX_ERRORS,
+    INGEST_LINE_LIMIT, WRITE_BATCH_SIZE
+)
+
+# Règles communes à toutes les mesures reçues, par le port TCP (socket_server) comme par
+# /api/ingest : bornes d'horodatage, doublons, détection des défauts, puis écriture par le writer.
+BULK_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def check_timestamp(epoch, now):
+    # Heure donnée par le capteur : ni trop en avance, ni plus vieille que INGEST_MAX_BACKLOG_DAYS
+    if not now - INGEST_MAX_BACKLOG_DAYS * 86400 <= epoch <= now + INGEST_CLOCK_SKEW_SECONDS:
+        raise ValueError(f"horodatage hors limites : {epoch}")
+
+def admit(device_id, temperature, humidity, epoch, seq=None):
+    # Renvoie None pour une mesure déjà reçue, sinon le champ de bits des défauts (anomaly.check).
+    # La marque de doublon n'est posée que par mark_stored, une fois la mesure enregistrée
+    if seq is not None and is_duplicate(device_id, seq, epoch):
+        return None
+    return check(device_id, temperature, humidity, epoch)
+
+def is_recent(measured_at):
+    return measured_at is None or (datetime.now() - measured_at).total_seconds() < INGEST_CLOCK_SKEW_SECONDS
+
+def record(device_id, temperature, humidity, flags, measured_at=None, seq=None):
+    # Écriture dans le journal local (journal.py), au retour la mesure survit à un arrêt du serveur ;
+    # une mesure en quarantaine n'y va pas (finish). False si la mesure n'a pas pu être journalisée
+    return is_quarantined(flags) or add_measurement(device_id, temperature, humidity, flags, measured_at, seq)
+
+def finish(device_id, temperature, humidity, flags, measured_at=None, notify=True):
+    # Suite du traitement, qui peut attendre le réseau (hors de la boucle asyncio pour le port TCP) :
+    # quarantaine en base, état courant vers Home Assistant
+    if is_quarantined(flags):
+        quarantine(device_id, temperature, humidity, flags, measured_at)
+    # Home Assistant ne reçoit que l'état courant, pas le rattrapage d'un arriéré
+    elif notify and is_recent(measured_at) and get_homeassistant_enabled():
+        send_to_home_assistant(device_id, temperature, humidity)
+
+def store(device_id, temperature, humidity, flags, measured_at=None, seq=None, notify=True):
+    # record puis finish ; renvoie False si la mesure n'a pas pu être journalisée
+    if not record(device_id, temperature, humidity, flags, measured_at, seq):
+        return False
+    finish(device_id, temperature, humidity, flags, measured_at, notify)
+    return True
+
+def _parse_time(value, now):
+    # Epoch en secondes ou date ISO locale ("AAAA-MM-JJ HH:MM:SS"), à la seconde : c'est avec le
+    # capteur la clé d'une mesure, elle ne peut pas être remplacée par l'heure d'arrivée
+    if value is None or value == "":
+        raise ValueError("time manquant")
+    try:
+        epoch = float(value)
+    except (TypeError, ValueError):
+        epoch = datetime.fromisoformat(str(value).replace("T", " ")).timestamp()
+    check_timestamp(epoch, now)
+    # À la seconde, comme la clé (device_id, time, epoch) de measurements
+    epoch = int(epoch)
+    return epoch, datetime.fromtimestamp(epoch)
+
+def _parse_seq(value):
+    # Entier positif ou nul (nombre JSON ou texte CSV) ; absent = None
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("seq invalide")
+    try:
+        seq = int(value) if not isinstance(value, float) or value.is_integer() else None
+    except (ValueError, OverflowError):
+        seq = None
+    if seq is None or not 0 <= seq <= 0xFFFFFFFF:
+        raise ValueError("seq invalide")
+    return seq
+
+def _parse_bulk_reading(record, now):
+    # record : dict lu d'une ligne NDJSON ou CSV -> (device_id, temperature, humidity, epoch, heure, seq)
+    device_id = str(record.get("device_id") or "").strip()
+    if not device_id or len(device_id) > 64:
+        raise ValueError("device_id manquant ou invalide")
+    try:
+        temperature = float(record["temperature"])
+        humidity = float(record["humidity"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("temperature ou humidity manquante ou invalide")
+    seq = _parse_seq(record.get("seq"))
+    epoch, measured_at = _parse_time(record.get("time"), now)
+    return device_id, temperature, humidity, epoch, measured_at, seq
+
+def _records(stream, fmt):
+    # Lecture en flux, ligne par ligne : (numéro de ligne, dict ou exception de décodage)
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        missing = {"device_id", "temperature", "humidity"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"colonnes CSV manquantes : {', '.join(sorted(missing))}")
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(text, 1):
+        if len(line) > INGEST_LINE_LIMIT:
+            yield number, ValueError("ligne trop longue")
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"JSON invalide : {e}")
+            continue
+        yield number, record if isinstance(record, dict) else ValueError("objet JSON attendu")
+
+def _reject(result, number, error):
+    result["rejected"] += 1
+    if len(result["errors"]) < INGEST_HTTP_MAX_ERRORS:
+        result["errors"].append({"line": number, "error": str(error)})
+
+def _existing_keys(readings):
+    # Clés (device_id, epoch) de ces mesures déjà présentes en base ; vide si la base ne répond pas
+    # (les doublons seront alors écartés par le writer sans être signalés)
+    devices = sorted({reading[0] for reading in readings})
+    times = [reading[4] for reading in readings]
+    try:
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT device_id, epoch FROM measurements WHERE device_id IN ({', '.join(['%s'] * len(devices))}) "
+                "AND time >= %s AND time <= %s",
+                devices + [min(times), max(times)]
+            )
+            return set(cursor.fetchall())
+    except Exception as e:
+        logging.warning(f"Ingestion HTTP : doublons en base non vérifiés ({e})")
+        return set()
+
+def _store_chunk(pending, result, latest_recent):
+    # pending : [(numéro de ligne, mesure analysée)] ; une lecture de la base pour tout le paquet
+    existing = _existing_keys([reading for _, reading in pending])
+    for number, (device_id, temperature, humidity, epoch, measured_at, seq) in pending:
+        if (device_id, epoch) in existing:
+            result["duplicates"] += 1
+            continue
+        flags = admit(device_id, temperature, humidity, epoch, seq)
+        if flags is None:
+            result["duplicates"] += 1
+            continue
+        if not store(device_id, temperature, humidity, flags, measured_at, seq, notify=False):
+            _reject(result, number, "journal indisponible")
+            continue
+        if seq is not None:
+            mark_stored(device_id, seq, epoch)
+        if is_quarantined(flags):
+            result["quarantined"] += 1
+        else:
+            result["accepted"] += 1
+            if is_recent(measured_at):
+                latest_recent[device_id] = (temperature, humidity)
+
+def ingest_bulk(stream, fmt, compressed=False):
+    # Corps NDJSON ou CSV (éventuellement gzip) de plusieurs milliers de mesures : chaque mesure
+    # passe par les mêmes règles que le port TCP ; une mesure refusée n'arrête pas le lot.
+    # La réponse ne compte comme acceptées que les mesures réellement enregistrées : une mesure
+    # dont la clé (device_id, epoch) est déjà en base ou déjà vue dans la requête n'en fait pas partie.
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    result = {"accepted": 0, "duplicates": 0, "quarantined": 0, "rejected": 0, "errors": []}
+    latest_recent = {}  # dernière mesure récente par capteur, transmise une fois à Home Assistant
+    pending = []        # mesures lues, enregistrées par paquets de WRITE_BATCH_SIZE
+    seen = set()        # clés (device_id, epoch) déjà lues dans la requête
+    count = 0
+    try:
+        for number, record in _records(stream, fmt):
+            if count >= INGEST_HTTP_MAX_READINGS:
+                result["errors"].append({"line": number, "error": f"limite de {INGEST_HTTP_MAX_READINGS} mesures atteinte, suite ignorée"})
+                break
+            count += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                reading = _parse_bulk_reading(record, time.time())
+                key = (reading[0], reading[3])
+                if key in seen:
+                    raise ValueError("une autre mesure de ce capteur a la même seconde dans la requête")
+                seen.add(key)
+            except (ValueError, TypeError, OverflowError) as e:
+                # TypeError, OverflowError : champ d'un type inattendu (liste, objet, nombre hors limites)
+                _reject(result, number, e)
+                continue
+            pending.append((number, reading))
+            if len(pending) >= WRITE_BATCH_SIZE:
+                _store_chunk(pending, result, latest_recent)
+                pending = []
+    except (ValueError, csv.Error, OSError, EOFError, zlib.error) as e:
+        # Corps illisible (gzip tronqué, en-tête CSV incomplet, ...) : les mesures déjà lues restent acceptées
+        result["errors"].append({"line": None, "error": f"lecture interrompue : {e}"})
+    if pending:
+        _store_chunk(pending, result, latest_recent)
+    # La réponse vaut acquittement : les mesures acceptées sont sur disque avant qu'elle parte
+    journal.sync(force=True)
+    if latest_recent and get_homeassistant_enabled():
+        for device_id, (temperature, humidity) in latest_recent.items():
+            send_to_home_assistant(device_id, temperature, humidity)
+    logging.info(
+        f"Ingestion HTTP ({fmt}) : {result['accepted']} acceptée(s), {result['duplicates']} doublon(s), "
+        f"{result['quarantined']} en quarantaine, {result['rejected']} rejetée(s)"
+    )
+    return result
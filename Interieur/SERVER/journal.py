@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import shutil
+import logging
+from threading import Lock, Condition
+
+from config import JOURNAL_DIR, JOURNAL_SEGMENT_BYTES, JOURNAL_FSYNC_INTERVAL_MS
+
+# Journal d'écriture local (write-ahead) : chaque mesure acceptée est ajoutée à un segment
+# "<numéro>.wal" (une ligne JSON par mesure) avant tout accès à la base. Le writer relit le journal
+# avec deux curseurs indépendants : "db" (measurements) et "csv" (segments journaliers), dont les
+# positions sont enregistrées dans checkpoint.json. Un segment entièrement relu par les deux est
+# supprimé. Après un arrêt brutal, la relecture reprend au dernier point de reprise : les mesures
+# déjà en base sont ignorées par la clé unique (device_id, time, epoch).
+CURSORS = ("db", "csv")
+
+_lock = Lock()
+_added = Condition(_lock)
+_dir = None
+_segments = []      # numéros des segments présents, croissants ; le dernier reçoit les ajouts
+_file = None        # segment courant ouvert en ajout
+_size = 0           # taille du segment courant
+_pending = 0        # mesures ajoutées depuis la dernière relecture "db" (réveil du writer)
+_dirty = False      # données ajoutées depuis le dernier fsync
+_last_fsync = 0.0
+_appended = 0       # mesures ajoutées depuis l'ouverture
+_synced = 0         # ... dont celles déjà sur disque (fsync)
+_waiters = []       # (mesures à synchroniser, fonction) en attente d'un fsync (when_synced)
+_positions = {}     # curseur -> (numéro de segment, offset)
+
+def _segment_path(directory, number):
+    return os.path.join(directory, f"{number:010d}.wal")
+
+def _path(number):
+    return _segment_path(_dir, number)
+
+def _list_segments(directory):
+    return sorted(int(f[:-4]) for f in os.listdir(directory) if f.endswith(".wal") and f[:-4].isdigit())
+
+def _load_positions(directory, segments):
+    first = segments[0] if segments else 1
+    try:
+        with open(os.path.join(directory, "checkpoint.json")) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = {}
+    positions = {}
+    for cursor in CURSORS:
+        segment, offset = saved.get(cursor, (first, 0))
+        # Segment du point de reprise disparu : reprise au premier segment restant
+        positions[cursor] = (segment, offset) if segment >= first else (first, 0)
+    return positions
+
+def _write_checkpoint(directory, positions):
+    # Sans fsync : un point de reprise perdu ne fait que relire des mesures déjà écrites
+    path = os.path.join(directory, "checkpoint.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({cursor: list(position) for cursor, position in positions.items()}, f)
+    os.replace(path + ".tmp", path)
+
+def _save_checkpoint():
+    _write_checkpoint(_dir, _positions)
+
+def _mark_synced():
+    # Appelé sous _lock après un fsync du segment courant : renvoie les fonctions à appeler hors du verrou
+    global _synced, _waiters
+    _synced = _appended
+    ready = [callback for count, callback in _waiters if count <= _synced]
+    _waiters = [(count, callback) for count, callback in _waiters if count > _synced]
+    return ready
+
+def _call(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Journal : notification de synchronisation : {e}")
+
+def _rotate():
+    # Appelé sous _lock : le segment plein est synchronisé puis fermé, un nouveau est ouvert
+    global _file, _size, _dirty
+    if _file is not None:
+        _file.flush()
+        os.fsync(_file.fileno())
+        _file.close()
+    number = _segments[-1] + 1 if _segments else 1
+    _segments.append(number)
+    _file = open(_path(number), "ab")
+    _size = 0
+    _dirty = False
+
+def open_journal(name="main"):
+    # Un journal par processus écrivain (processus principal, processus d'ingestion de workers.py)
+    global _dir, _segments, _positions
+    with _lock:
+        if _file is not None:
+            return
+        _dir = os.path.join(JOURNAL_DIR, name)
+        os.makedirs(_dir, exist_ok=True)
+        _segments = _list_segments(_dir)
+        _positions = _load_positions(_dir, _segments)
+        if _segments:
+            logging.info(f"Journal {name} : {len(_segments)} segment(s) à relire depuis {_positions}")
+        # Les ajouts partent toujours dans un nouveau segment : la fin éventuellement tronquée
+        # d'un segment précédent n'est jamais prolongée
+        _rotate()
+
+def close_journal():
+    global _file
+    ready = []
+    with _lock:
+        if _file is not None:
+            _file.flush()
+            os.fsync(_file.fileno())
+            _file.close()
+            _file = None
+            ready = _mark_synced()
+    _call(ready)
+
+def append(row):
+    # row : (device_id, time, temperature, humidity, flags, seq, epoch) ; écrit dans le cache du système,
+    # fsync groupé par sync() toutes les JOURNAL_FSYNC_INTERVAL_MS (0 = à chaque mesure).
+    # Renvoie False si la mesure n'a pas pu être journalisée (journal fermé, disque plein, ...)
+    global _size, _pending, _dirty, _appended
+    line = (json.dumps(row, separators=(",", ":")) + "\n").encode("utf-8")
+    ready = []
+    with _lock:
+        if _file is None:
+            return False
+        try:
+            if _size >= JOURNAL_SEGMENT_BYTES:
+                _rotate()
+            _file.write(line)
+            _file.flush()
+            if JOURNAL_FSYNC_INTERVAL_MS <= 0:
+                os.fsync(_file.fileno())
+        except OSError as e:
+            logging.error(f"Écriture dans le journal : {e}")
+            return False
+        _size += len(line)
+        _pending += 1
+        _appended += 1
+        _dirty = JOURNAL_FSYNC_INTERVAL_MS > 0
+        if not _dirty:
+            ready = _mark_synced()
+        _added.notify()
+    _call(ready)
+    return True
+
+def wait(count, timeout):
+    # Writer : attend count mesures en attente, au plus timeout secondes ; True si elles y sont
+    with _lock:
+        return _added.wait_for(lambda: _pending >= count, timeout)
+
+def when_synced(callback):
+    # Validation groupée : callback est appelé (par le thread qui fait le prochain fsync) une fois sur
+    # disque toutes les mesures ajoutées jusqu'ici, aussitôt si c'est déjà le cas
+    with _lock:
+        if _synced < _appended:
+            _waiters.append((_appended, callback))
+            return
+    _call([callback])
+
+def sync(force=False):
+    global _dirty, _last_fsync
+    now = time.monotonic()
+    with _lock:
+        if _file is None or not _dirty or (not force and now - _last_fsync < JOURNAL_FSYNC_INTERVAL_MS / 1000):
+            return
+        _file.flush()
+        os.fsync(_file.fileno())
+        _dirty = False
+        _last_fsync = now
+        ready = _mark_synced()
+    _call(ready)
+
+def _read(directory, position, last, max_rows):
+    # Lignes complètes à partir de position, sans dépasser le segment last -> (mesures, position après la dernière)
+    segment, offset = position
+    rows = []
+    while len(rows) < max_rows:
+        path = _segment_path(directory, segment)
+        try:
+            size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    try:
+                        rows.append(tuple(json.loads(line)))
+                    except ValueError:
+                        logging.warning(f"Journal : ligne illisible ignorée dans {path}")
+                    if len(rows) >= max_rows:
+                        break
+        except FileNotFoundError:
+            size = offset
+        if len(rows) >= max_rows or segment >= last:
+            break
+        # Segment terminé : un reste sans fin de ligne vient d'un arrêt brutal pendant l'écriture
+        if offset < size:
+            logging.warning(f"Journal : fin tronquée de {path} ignorée ({size - offset} octets)")
+        segment, offset = segment + 1, 0
+    return rows, (segment, offset)
+
+def read(cursor, max_rows):
+    # Lignes complètes à partir de la position du curseur -> (mesures, position après la dernière)
+    global _pending
+    with _lock:
+        current = _segments[-1]
+    rows, position = _read(_dir, _positions[cursor], current, max_rows)
+    if cursor == "db":
+        with _lock:
+            _pending = max(_pending - len(rows), 0) if rows else 0
+    return rows, position
+
+def advance(cursor, position):
+    # Point de reprise du curseur, puis suppression des segments relus par tous les curseurs
+    with _lock:
+        if _positions[cursor] == position:
+            return
+        _positions[cursor] = position
+        _save_checkpoint()
+        done = min(segment for segment, _ in _positions.values())
+        while len(_segments) > 1 and _segments[0] < done:
+            os.remove(_path(_segments.pop(0)))
+
+def orphans(owned):
+    # Journaux qu'aucun processus en service ne relit : INGEST_PROCESSES réduit ou remis à 0
+    try:
+        names = os.listdir(JOURNAL_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(n for n in names if n not in owned and os.path.isdir(os.path.join(JOURNAL_DIR, n)))
+
+def replay_orphan(name, write_db, write_csv, max_rows):
+    # Relit un journal abandonné avec ses propres points de reprise : write_csv puis write_db
+    # reçoivent les mesures par lots et renvoient False en cas d'échec. Le dossier est supprimé une
+    # fois relu ; True si c'est fait, False à retenter (base indisponible, ...)
+    directory = os.path.join(JOURNAL_DIR, name)
+    segments = _list_segments(directory)
+    positions = _load_positions(directory, segments)
+    for cursor, write in (("csv", write_csv), ("db", write_db)):
+        while segments:
+            rows, position = _read(directory, positions[cursor], segments[-1], max_rows)
+            if rows and not write(rows):
+                return False
+            if position != positions[cursor]:
+                positions[cursor] = position
+                _write_checkpoint(directory, positions)
+            if not rows:
+                break
+    shutil.rmtree(directory)
+    logging.info(f"Journal {name} abandonné relu puis supprimé")
+    return True
+
+def get_journal_stats():
+    with _lock:
+        segments = list(_segments)
+        positions = dict(_positions)
+    backlog = {}
+    for cursor, (segment, offset) in positions.items():
+        total = -offset
+        for number in segments:
+            if number >= segment:
+                try:
+                    total += os.path.getsize(_path(number))
+                except FileNotFoundError:
+                    pass
+        backlog[cursor] = max(total, 0)
+    return {"segments": len(segments), "backlog_bytes": backlog}
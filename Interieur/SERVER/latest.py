@@ -0,0 +1,56 @@
+import logging
+from datetime import datetime
+from threading import Lock
+
+from db import get_mysql_connection
+
+# Dernière mesure connue par capteur : {device_id: {"temperature", "humidity", "flags", "time", "last_seen"}}
+# "time" est l'heure de la mesure, "last_seen" celle de la dernière réception du capteur,
+# "flags" les défauts signalés sur cette mesure (anomaly.py).
+_lock = Lock()
+_latest = {}
+
+def update(device_id, temperature, humidity, t=None, seen=None, flags=0):
+    # Appelé par le chemin d'ingestion à chaque mesure reçue
+    t = t or datetime.now()
+    with _lock:
+        current = _latest.get(device_id)
+        if current is None or t >= current["time"]:
+            _latest[device_id] = {
+                "temperature": temperature, "humidity": humidity, "flags": flags, "time": t, "last_seen": seen or t
+            }
+        else:
+            # Mesure plus ancienne que celle connue : seul le passage du capteur est noté
+            current["last_seen"] = max(current["last_seen"], seen or datetime.now())
+
+def get_latest(device_id=None):
+    # Sans device_id : la mesure la plus récente tous capteurs confondus
+    with _lock:
+        if device_id is not None:
+            reading = _latest.get(device_id)
+            return dict(reading, device_id=device_id) if reading else None
+        if not _latest:
+            return None
+        device_id = max(_latest, key=lambda d: _latest[d]["time"])
+        return dict(_latest[device_id], device_id=device_id)
+
+def get_all():
+    with _lock:
+        return {device_id: dict(reading) for device_id, reading in _latest.items()}
+
+def refresh():
+    # (Re)charge la dernière mesure de chaque capteur depuis la base : au démarrage du serveur,
+    # ou avant chaque vérification dans un processus séparé (sendmail.py)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT m.device_id, m.time, m.temperature, m.humidity, m.flags
+            FROM measurements m
+            JOIN (SELECT device_id, MAX(time) AS time FROM measurements GROUP BY device_id) l
+              ON m.device_id = l.device_id AND m.time = l.time
+        """)
+        rows = cursor.fetchall()
+    for device_id, t, temperature, humidity, flags in rows:
+        update(device_id, temperature, humidity, t, flags=flags)
+    logging.info(f"Dernières mesures chargées pour {len(rows)} capteur(s)")
+    return len(rows)
@@ -0,0 +1,193 @@
+import json
+import asyncio
+import logging
+from threading import Lock
+from urllib.parse import urlsplit, parse_qs
+
+from db import get_mysql_connection
+from utils import get_measurements
+from writer import add_commit_listener
+from alerts import ALERT_DERIVED_COLUMNS, get_alert_config, is_alert
+from climate import derive_one
+from anomaly import flag_names
+import latest
+from config import SERVER_ADDRESS, LIVE_PORT, LIVE_CLIENT_QUEUE, LIVE_KEEPALIVE_SECONDS, LIVE_READ_TIMEOUT
+
+# Diffusion en direct (Server-Sent Events) des mesures validées en base et des changements d'alerte.
+# Le serveur tourne dans la boucle asyncio de l'ingestion : un client connecté ne coûte qu'une
+# file asyncio, aucun thread Flask. L'id SSE d'une mesure est son id en base, ce qui permet la
+# reprise (Last-Event-ID) directement depuis measurements.
+
+_loop = None
+_clients = set()       # une asyncio.Queue par client connecté
+_state_lock = Lock()
+_last_id = None        # dernier id diffusé (None tant qu'aucun client n'est connecté)
+_alert_state = {}      # device_id -> (alerte en cours, défauts de la dernière mesure)
+
+def _format(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+def _fanout(messages):
+    # Exécuté dans la boucle asyncio ; un client trop lent est déconnecté plutôt que de tout bloquer
+    for client in list(_clients):
+        try:
+            for message in messages:
+                client.put_nowait(message)
+        except asyncio.QueueFull:
+            _clients.discard(client)
+            while not client.empty():
+                client.get_nowait()
+            client.put_nowait(None)
+
+def _alert_changes(device_ids):
+    config = get_alert_config()
+    if not config:
+        return []
+    events = []
+    for device_id in device_ids:
+        reading = latest.get_latest(device_id)
+        if reading is None:
+            continue
+        alert = is_alert(reading["temperature"], reading["humidity"], config)
+        faults = flag_names(reading["flags"])
+        if _alert_state.get(device_id) != (alert, faults):
+            _alert_state[device_id] = (alert, faults)
+            events.append(_format("alert", {
+                "device_id": device_id,
+                "alert": alert,
+                "faults": faults,
+                "temperature": reading["temperature"],
+                "humidity": reading["humidity"],
+                **derive_one(reading["temperature"], reading["humidity"]),
+                "temp_min": config[0],
+                "temp_max": config[1],
+                "humidity_min": config[2],
+                "humidity_max": config[3],
+                **dict(zip(ALERT_DERIVED_COLUMNS, config[4:]))
+            }))
+    return events
+
+def _on_commit(batch):
+    # Thread du writer : lecture des lignes validées (avec leur id) puis remise à la boucle
+    global _last_id
+    if _loop is None or not _clients:
+        return
+    with _state_lock:
+        if _last_id is None:
+            return
+        rows = get_measurements(since_id=_last_id)
+        if rows:
+            _last_id = rows[-1]["id"]
+        messages = [_format("measurement", row, row["id"]) for row in rows]
+        messages += _alert_changes({row[0] for row in batch})
+    if messages:
+        _loop.call_soon_threadsafe(_fanout, messages)
+
+def _init_last_id():
+    global _last_id
+    with _state_lock:
+        if _last_id is None:
+            with get_mysql_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT MAX(id) FROM measurements")
+                _last_id = cursor.fetchone()[0] or 0
+        return _last_id
+
+async def _read_request(reader):
+    request_line = (await asyncio.wait_for(reader.readline(), LIVE_READ_TIMEOUT)).decode("latin-1")
+    headers = {}
+    while True:
+        line = (await asyncio.wait_for(reader.readline(), LIVE_READ_TIMEOUT)).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    method, target = (request_line.split(" ") + ["", ""])[:2]
+    return method, urlsplit(target), headers
+
+async def handle_stream(reader, writer):
+    global _last_id
+    loop = asyncio.get_running_loop()
+    client = None
+    try:
+        method, url, headers = await _read_request(reader)
+        if method != "GET" or url.path != "/stream":
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+            + f"retry: {LIVE_KEEPALIVE_SECONDS * 1000}\n\n".encode()
+        )
+        await writer.drain()
+        # Abonnement avant la reprise : rien n'est perdu entre les deux, les doublons sont filtrés par id
+        client = asyncio.Queue(maxsize=LIVE_CLIENT_QUEUE)
+        _clients.add(client)
+        await loop.run_in_executor(None, _init_last_id)
+        resume = headers.get("last-event-id") or parse_qs(url.query).get("last_id", [None])[0]
+        sent_id = None
+        if resume and resume.isdigit():
+            sent_id = int(resume)
+            rows = await loop.run_in_executor(None, lambda: get_measurements(since_id=sent_id))
+            for row in rows:
+                writer.write(_format("measurement", row, row["id"]))
+                sent_id = row["id"]
+            await writer.drain()
+        while True:
+            try:
+                message = await asyncio.wait_for(client.get(), LIVE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Commentaire SSE : garde la connexion ouverte à travers les proxys
+                writer.write(b": keepalive\n\n")
+                await writer.drain()
+                continue
+            if message is None:
+                break
+            if sent_id is not None and message.startswith(b"id: "):
+                if int(message[4:message.index(b"\n")]) <= sent_id:
+                    continue
+            writer.write(message)
+            await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as e:
+        logging.error(f"Flux SSE : {e}")
+    finally:
+        if client is not None:
+            _clients.discard(client)
+            if not _clients:
+                with _state_lock:
+                    _last_id = None
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def start_live_server():
+    # Démarré par socket_server.serve() dans sa boucle, ou par run_live_server ; LIVE_PORT=0 désactive la diffusion
+    global _loop
+    _loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(handle_stream, SERVER_ADDRESS, LIVE_PORT)
+    # Après l'ouverture du port : sans serveur, les lots n'ont personne à qui être diffusés
+    add_commit_listener(_on_commit)
+    logging.info(f"Diffusion SSE sur {SERVER_ADDRESS}:{LIVE_PORT}/stream")
+    return server
+
+def run_live_server():
+    # Boucle dédiée quand l'ingestion tourne dans des processus séparés (workers.py) : les lots
+    # validés par les workers sont relayés aux listeners de ce processus
+    async def main():
+        server = await start_live_server()
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+def get_live_stats():
+    return {"clients": len(_clients), "last_id": _last_id}
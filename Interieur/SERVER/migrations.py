@@ -0,0 +1,401 @@
+import sys
+import logging
+from datetime import datetime, date
+
+from db import get_mysql_connection, is_sqlite, as_datetime
+from sequence import TABLES, bump
+from climate import DERIVED, derive
+from alerts import ALERT_DERIVED_COLUMNS
+
+# Nombre de partitions mensuelles créées à l'avance sur measurements
+PARTITIONS_AHEAD_MONTHS = 3
+# Mesures recalculées par requête lors de l'ajout des grandeurs dérivées (migration 8)
+DERIVED_BACKFILL_CHUNK = 50000
+
+def _ddl(sql):
+    # Les DDL sont écrits pour MySQL ; seules les clés auto-incrémentées diffèrent sous SQLite
+    if is_sqlite():
+        return sql.replace("INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+    return sql
+
+def _index_exists(cursor, table, index):
+    if is_sqlite():
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+            (table, index)
+        )
+        return cursor.fetchone()[0] > 0
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+def _column_exists(cursor, table, column):
+    if is_sqlite():
+        cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+def _month_start(d, offset=0):
+    month = d.month - 1 + offset
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+def _partition_clause(month):
+    # Partition pAAAAMM : mesures strictement antérieures au mois suivant
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{_month_start(month, 1):%Y-%m-%d}'))"
+
+def _base_schema(cursor):
+    # Tables historiques du projet : sans effet sur une base existante
+    cursor.execute(_ddl("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(64) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            email VARCHAR(255),
+            email_verified TINYINT(1) NOT NULL DEFAULT 0,
+            email_token VARCHAR(255),
+            reset_token VARCHAR(255),
+            creation_date VARCHAR(32),
+            last_login VARCHAR(32),
+            is_admin TINYINT(1) NOT NULL DEFAULT 0,
+            can_access_panel TINYINT(1) NOT NULL DEFAULT 0,
+            otp_secret VARCHAR(64) DEFAULT '',
+            active TINYINT(1) NOT NULL DEFAULT 1
+        )
+    """))
+    cursor.execute(_ddl("""
+        CREATE TABLE IF NOT EXISTS measurements (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            device_id VARCHAR(64) NOT NULL,
+            time DATETIME NOT NULL,
+            temperature FLOAT NOT NULL,
+            humidity FLOAT NOT NULL
+        )
+    """))
+    cursor.execute(_ddl("""
+        CREATE TABLE IF NOT EXISTS admin_logs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            admin_username VARCHAR(64),
+            action VARCHAR(255),
+            target VARCHAR(255),
+            timestamp DATETIME
+        )
+    """))
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alert_config (
+            id INT PRIMARY KEY,
+            temp_min FLOAT,
+            temp_max FLOAT,
+            humidity_min FLOAT,
+            humidity_max FLOAT
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            id INT PRIMARY KEY,
+            homeassistant_enabled TINYINT(1) NOT NULL DEFAULT 1
+        )
+    """)
+    ignore = "INSERT OR IGNORE" if is_sqlite() else "INSERT IGNORE"
+    cursor.execute(f"{ignore} INTO settings (id, homeassistant_enabled) VALUES (1, 1)")
+    cursor.execute(_ddl("""
+        CREATE TABLE IF NOT EXISTS sequence (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            table_name VARCHAR(64) NOT NULL UNIQUE,
+            total BIGINT NOT NULL DEFAULT 0,
+            updated_at DATETIME
+        )
+    """))
+
+def _measurement_indexes(cursor):
+    # Couvre ORDER BY time DESC LIMIT 1, les plages de dates et WHERE device_id = ...
+    if not is_sqlite():
+        cursor.execute("ALTER TABLE measurements MODIFY time DATETIME NOT NULL")
+    if not _index_exists(cursor, "measurements", "idx_measurements_device_time"):
+        cursor.execute("CREATE INDEX idx_measurements_device_time ON measurements (device_id, time)")
+    if not _index_exists(cursor, "measurements", "idx_measurements_time"):
+        cursor.execute("CREATE INDEX idx_measurements_time ON measurements (time)")
+
+def _rollup_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS measurements_rollup (
+            resolution INT NOT NULL,
+            device_id VARCHAR(64) NOT NULL,
+            bucket DATETIME NOT NULL,
+            count INT NOT NULL,
+            temp_sum DOUBLE NOT NULL,
+            temp_min FLOAT NOT NULL,
+            temp_max FLOAT NOT NULL,
+            temp_last FLOAT NOT NULL,
+            hum_sum DOUBLE NOT NULL,
+            hum_min FLOAT NOT NULL,
+            hum_max FLOAT NOT NULL,
+            hum_last FLOAT NOT NULL,
+            last_time DATETIME NOT NULL,
+            PRIMARY KEY (resolution, device_id, bucket)
+        )
+    """)
+    if not _index_exists(cursor, "measurements_rollup", "idx_rollup_bucket"):
+        cursor.execute("CREATE INDEX idx_rollup_bucket ON measurements_rollup (resolution, bucket)")
+
+def _partition_measurements(cursor):
+    # La clé de partitionnement doit appartenir à toutes les clés uniques : PK (id, time)
+    if is_sqlite():
+        # Pas de partitions sous SQLite : la purge passe par des DELETE par lots
+        return
+    cursor.execute("ALTER TABLE measurements DROP PRIMARY KEY, ADD PRIMARY KEY (id, time)")
+    cursor.execute("SELECT MIN(time) FROM measurements")
+    first = as_datetime(cursor.fetchone()[0]) or datetime.now()
+    month = _month_start(first)
+    last = _month_start(date.today(), PARTITIONS_AHEAD_MONTHS)
+    clauses = []
+    while month <= last:
+        clauses.append(_partition_clause(month))
+        month = _month_start(month, 1)
+    clauses.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    cursor.execute(f"ALTER TABLE measurements PARTITION BY RANGE (TO_DAYS(time)) ({', '.join(clauses)})")
+
+def _retention_state(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS retention_state (
+            device_id VARCHAR(64) NOT NULL,
+            step INT NOT NULL,
+            compacted_until DATETIME NOT NULL,
+            PRIMARY KEY (device_id, step)
+        )
+    """)
+
+def _sequence_counters(cursor):
+    # Dernier COUNT(*) complet : les compteurs sont ensuite tenus à jour à chaque écriture
+    # (sequence.bump) et vérifiés par python sequence.py reconcile
+    for table in TABLES:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        total = cursor.fetchone()[0]
+        cursor.execute("DELETE FROM sequence WHERE table_name = %s", (table,))
+        cursor.execute(
+            "INSERT INTO sequence (table_name, total, updated_at) VALUES (%s, %s, %s)",
+            (table, total, datetime.now())
+        )
+
+def _stats_cache(cursor):
+    # Résumés statistiques des périodes closes (stats.py), un JSON par période tous capteurs confondus
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stats_cache (
+            period VARCHAR(8) NOT NULL,
+            period_start DATETIME NOT NULL,
+            period_end DATETIME NOT NULL,
+            thresholds VARCHAR(128) NOT NULL,
+            summary MEDIUMTEXT NOT NULL,
+            computed_at DATETIME NOT NULL,
+            PRIMARY KEY (period, period_start)
+        )
+    """)
+    if not _index_exists(cursor, "stats_cache", "idx_stats_cache_end"):
+        cursor.execute("CREATE INDEX idx_stats_cache_end ON stats_cache (period_end)")
+
+def _derived_metrics(cursor):
+    # Point de rosée, humidité absolue et indice de chaleur stockés avec chaque mesure (climate.py),
+    # et seuils d'alerte facultatifs sur ces grandeurs (NULL = non surveillé)
+    for table, columns in (("measurements", DERIVED), ("alert_config", ALERT_DERIVED_COLUMNS)):
+        for column in columns:
+            if not _column_exists(cursor, table, column):
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} FLOAT NULL")
+    # Calcul des mesures existantes par tranches d'id ; sous MySQL chaque tranche est validée
+    # à part pour ne pas tenir une transaction sur toute la table
+    last_id = 0
+    while True:
+        cursor.execute(
+            "SELECT id, temperature, humidity FROM measurements WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, DERIVED_BACKFILL_CHUNK)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        ids, temperatures, humidities = zip(*rows)
+        dew_points, abs_humidities, heat_indexes = derive(temperatures, humidities)
+        cursor.executemany(
+            "UPDATE measurements SET dew_point = %s, abs_humidity = %s, heat_index = %s WHERE id = %s",
+            list(zip(dew_points.tolist(), abs_humidities.tolist(), heat_indexes.tolist(), ids))
+        )
+        if not is_sqlite():
+            cursor.execute("COMMIT")
+        last_id = ids[-1]
+
+def _anomaly_flags(cursor):
+    # Défauts détectés à l'ingestion (anomaly.py) : champ de bits sur chaque mesure, et table
+    # des mesures inutilisables mises à l'écart
+    if not _column_exists(cursor, "measurements", "flags"):
+        cursor.execute("ALTER TABLE measurements ADD COLUMN flags SMALLINT NOT NULL DEFAULT 0")
+    cursor.execute(_ddl("""
+        CREATE TABLE IF NOT EXISTS measurements_quarantine (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            device_id VARCHAR(64) NOT NULL,
+            time DATETIME NOT NULL,
+            temperature FLOAT NULL,
+            humidity FLOAT NULL,
+            flags SMALLINT NOT NULL
+        )
+    """))
+    if not _index_exists(cursor, "measurements_quarantine", "idx_quarantine_time"):
+        cursor.execute("CREATE INDEX idx_quarantine_time ON measurements_quarantine (time)")
+
+def _natural_key(cursor):
+    # Clé naturelle (device_id, time) : une mesure renvoyée (ACK perdu, nouvel essai) est ignorée à
+    # l'insertion (INSERT IGNORE). Une clé unique d'une table partitionnée doit contenir la colonne
+    # de partitionnement : (device_id, seq) n'est pas possible, seq est gardé pour le suivi.
+    if not _column_exists(cursor, "measurements", "seq"):
+        cursor.execute("ALTER TABLE measurements ADD COLUMN seq INT UNSIGNED NULL")
+    # Doublons déjà présents : la plus ancienne ligne (plus petit id) est gardée
+    if is_sqlite():
+        cursor.execute("""
+            DELETE FROM measurements WHERE id NOT IN (
+                SELECT MIN(id) FROM measurements GROUP BY device_id, time
+            )
+        """)
+    else:
+        cursor.execute("""
+            DELETE m FROM measurements m
+            JOIN measurements d ON d.device_id = m.device_id AND d.time = m.time AND d.id < m.id
+        """)
+    if cursor.rowcount > 0:
+        logging.warning(
+            f"{cursor.rowcount} mesure(s) en double supprimée(s) ; "
+            "les agrégats concernés se recalculent avec python rollups.py backfill"
+        )
+        bump(cursor, "measurements", -cursor.rowcount)
+    # L'index unique remplace l'index (device_id, time) de la migration 2, pour les mêmes lectures
+    if _index_exists(cursor, "measurements", "idx_measurements_device_time"):
+        if is_sqlite():
+            cursor.execute("DROP INDEX idx_measurements_device_time")
+        else:
+            cursor.execute("ALTER TABLE measurements DROP INDEX idx_measurements_device_time")
+    if not _index_exists(cursor, "measurements", "uq_measurements_device_time"):
+        cursor.execute("CREATE UNIQUE INDEX uq_measurements_device_time ON measurements (device_id, time)")
+
+def _utc_epoch(cursor):
+    # L'heure locale est ambiguë au passage à l'heure d'hiver : deux mesures distinctes de l'heure
+    # répétée auraient le même (device_id, time). La clé unique porte aussi sur epoch (secondes UTC) ;
+    # time y reste, une clé unique d'une table partitionnée devant contenir la colonne de partitionnement.
+    if not _column_exists(cursor, "measurements", "epoch"):
+        cursor.execute("ALTER TABLE measurements ADD COLUMN epoch BIGINT NULL")
+    # Lignes existantes : heure locale convertie avec le fuseau du serveur
+    if is_sqlite():
+        cursor.execute(
+            "UPDATE measurements SET epoch = CAST(ROUND((julianday(time, 'utc') - 2440587.5) * 86400) AS INTEGER) "
+            "WHERE epoch IS NULL"
+        )
+    else:
+        cursor.execute("UPDATE measurements SET epoch = UNIX_TIMESTAMP(time) WHERE epoch IS NULL")
+    if _index_exists(cursor, "measurements", "uq_measurements_device_time"):
+        if is_sqlite():
+            cursor.execute("DROP INDEX uq_measurements_device_time")
+        else:
+            cursor.execute("ALTER TABLE measurements DROP INDEX uq_measurements_device_time")
+    # (device_id, time) en tête : l'index sert toujours les lectures par capteur et par plage
+    if not _index_exists(cursor, "measurements", "uq_measurements_device_epoch"):
+        cursor.execute("CREATE UNIQUE INDEX uq_measurements_device_epoch ON measurements (device_id, time, epoch)")
+
+# Migrations ordonnées : (version, description, fonction(cursor))
+MIGRATIONS = [
+    (1, "schéma de base", _base_schema),
+    (2, "index (device_id, time) et (time) sur measurements", _measurement_indexes),
+    (3, "table measurements_rollup", _rollup_table),
+    (4, "partitionnement mensuel de measurements", _partition_measurements),
+    (5, "table retention_state", _retention_state),
+    (6, "compteurs de lignes maintenus dans sequence", _sequence_counters),
+    (7, "table stats_cache", _stats_cache),
+    (8, "grandeurs dérivées (point de rosée, humidité absolue, indice de chaleur)", _derived_metrics),
+    (9, "défauts de capteur : measurements.flags et table measurements_quarantine", _anomaly_flags),
+    (10, "clé unique (device_id, time) et colonne seq sur measurements", _natural_key),
+    (11, "colonne epoch (UTC) dans la clé unique de measurements", _utc_epoch),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at DATETIME NOT NULL
+        )
+    """)
+
+def get_schema_version():
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        _ensure_version_table(cursor)
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        version = cursor.fetchone()[0]
+    return version or 0
+
+def upgrade():
+    current = get_schema_version()
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logging.info(f"Migration {version} : {description}")
+        # Les DDL MySQL sont validés implicitement : une migration par connexion, version notée à la fin.
+        # Sous SQLite, la migration et sa version sont validées ensemble.
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            migrate(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)",
+                (version, description, datetime.now())
+            )
+            conn.commit()
+    return get_schema_version()
+
+def check_schema():
+    version = get_schema_version()
+    if version < LATEST_VERSION:
+        raise SystemExit(
+            f"Schéma de base de données obsolète (version {version}, attendue {LATEST_VERSION}). "
+            f"Lancez : python migrations.py upgrade"
+        )
+
+def add_future_partitions(months_ahead=PARTITIONS_AHEAD_MONTHS):
+    # Découpe p_future pour que les prochains mois aient chacun leur partition
+    if is_sqlite():
+        return 0
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT partition_name FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = 'measurements'
+              AND partition_name LIKE 'p2%'
+        """)
+        names = [row[0] for row in cursor.fetchall()]
+        if not names:
+            return 0
+        month = _month_start(datetime.strptime(max(names), "p%Y%m").date(), 1)
+        last = _month_start(date.today(), months_ahead)
+        clauses = []
+        while month <= last:
+            clauses.append(_partition_clause(month))
+            month = _month_start(month, 1)
+        if clauses:
+            clauses.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+            cursor.execute(f"ALTER TABLE measurements REORGANIZE PARTITION p_future INTO ({', '.join(clauses)})")
+        return len(clauses) - 1 if clauses else 0
+
+if __name__ == "__main__":
+    # python migrations.py [upgrade | status | partitions]
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "upgrade":
+        print(f"Schéma en version {upgrade()}")
+    elif command == "partitions":
+        print(f"{add_future_partitions()} partition(s) ajoutée(s)")
+    elif command == "status":
+        print(f"Schéma en version {get_schema_version()} / {LATEST_VERSION}")
+    else:
+        print("Usage : python migrations.py [upgrade | status | partitions]")
+        sys.exit(1)
@@ -0,0 +1,244 @@
+import time
+import logging
+from datetime import datetime, timedelta
+
+from db import get_mysql_connection, is_sqlite, as_datetime
+from sequence import bump
+from climate import derive
+from anomaly import purge_quarantine
+import httpcache
+import stats
+import archive
+from config import (
+    RETENTION_POLICY, RETENTION_MAX_AGE_DAYS, RETENTION_CHUNK_HOURS, RETENTION_DELETE_BATCH,
+    RETENTION_INTERVAL_SECONDS
+)
+
+def get_policy(device_id):
+    return sorted(RETENTION_POLICY.get(device_id, RETENTION_POLICY.get("default", [])))
+
+def _floor(t, step):
+    midnight = t.replace(hour=0, minute=0, second=0, microsecond=0)
+    seconds = int((t - midnight).total_seconds())
+    return midnight + timedelta(seconds=seconds - seconds % step)
+
+def _avg_row_length(cursor):
+    if is_sqlite():
+        # Taille du fichier rapportée au nombre de lignes de measurements
+        cursor.execute("SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()")
+        size = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM measurements")
+        count = cursor.fetchone()[0]
+        return size // count if count else 0
+    cursor.execute("""
+        SELECT avg_row_length FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = 'measurements'
+    """)
+    row = cursor.fetchone()
+    return (row[0] or 0) if row else 0
+
+def _get_progress(cursor, device_id, step):
+    cursor.execute(
+        "SELECT compacted_until FROM retention_state WHERE device_id = %s AND step = %s",
+        (device_id, step)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _set_progress(cursor, device_id, step, until):
+    # REPLACE : même syntaxe sous MySQL et SQLite, la ligne n'a pas d'autre colonne
+    cursor.execute(
+        "REPLACE INTO retention_state (device_id, step, compacted_until) VALUES (%s, %s, %s)",
+        (device_id, step, until)
+    )
+
+def compact_chunk(device_id, step, start, end):
+    # Remplace les mesures de [start, end) par une moyenne par pas de "step" secondes ;
+    # renvoie (lignes supprimées, lignes réécrites).
+    # La ligne la plus ancienne (plus petit id) de chaque pas est réécrite, les autres supprimées :
+    # les id restent stables pour les curseurs since_id.
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, time, temperature, humidity, flags FROM measurements
+            WHERE device_id = %s AND time >= %s AND time < %s
+            ORDER BY time ASC, id ASC
+        """, (device_id, start, end))
+        buckets = {}
+        for row in cursor.fetchall():
+            buckets.setdefault(_floor(row[1], step), []).append(row)
+        updates = []
+        deletes = []
+        for bucket, rows in buckets.items():
+            if len(rows) == 1 and rows[0][1] == bucket:
+                continue
+            keep = min(rows, key=lambda r: r[0])
+            # Les mesures signalées (anomaly.py) n'entrent dans la moyenne que si le pas n'a rien d'autre
+            clean = [r for r in rows if not r[4]]
+            averaged = clean or rows
+            flags = 0
+            for r in averaged:
+                flags |= r[4]
+            temperature = sum(r[2] for r in averaged) / len(averaged)
+            humidity = sum(r[3] for r in averaged) / len(averaged)
+            updates.append((bucket, int(bucket.timestamp()), temperature, humidity, flags, keep[0], keep[1]))
+            deletes.extend(r[0] for r in rows if r[0] != keep[0])
+        # Suppressions d'abord : la ligne gardée prend l'heure du pas, qu'une autre ligne du pas
+        # peut occuper (clé unique device_id, time, epoch)
+        for i in range(0, len(deletes), 1000):
+            ids = deletes[i:i + 1000]
+            cursor.execute(
+                f"DELETE FROM measurements WHERE device_id = %s AND time >= %s AND time < %s "
+                f"AND id IN ({', '.join(['%s'] * len(ids))})",
+                [device_id, start, end] + ids
+            )
+        if updates:
+            # Grandeurs dérivées recalculées à partir des moyennes, pour tous les pas d'un coup
+            derived = zip(*(column.tolist() for column in derive([u[2] for u in updates], [u[3] for u in updates])))
+            cursor.executemany(
+                "UPDATE measurements SET time = %s, epoch = %s, temperature = %s, humidity = %s, flags = %s, "
+                "dew_point = %s, abs_humidity = %s, heat_index = %s WHERE id = %s AND time = %s",
+                [u[:5] + d + u[5:] for u, d in zip(updates, derived)]
+            )
+        bump(cursor, "measurements", -len(deletes))
+        _set_progress(cursor, device_id, step, end)
+        conn.commit()
+    return len(deletes), len(updates)
+
+def compact_device(device_id, now=None):
+    # Renvoie (lignes supprimées, plages [début, fin) dont des mesures ont changé)
+    now = now or datetime.now()
+    tiers = get_policy(device_id)
+    chunk = timedelta(hours=RETENTION_CHUNK_HOURS)
+    removed = 0
+    touched = []
+    for i, (age_days, step) in enumerate(tiers):
+        # Fenêtre du palier : plus vieux que age_days, plus récent que le palier suivant
+        upper = _floor(now - timedelta(days=age_days), 86400)
+        lower = _floor(now - timedelta(days=tiers[i + 1][0]), 86400) if i + 1 < len(tiers) else None
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            start = _get_progress(cursor, device_id, step)
+            if start is None:
+                cursor.execute("SELECT MIN(time) FROM measurements WHERE device_id = %s", (device_id,))
+                first = as_datetime(cursor.fetchone()[0])
+                if first is None:
+                    continue
+                start = _floor(first, 86400)
+        if lower is not None and start < lower:
+            start = lower
+        # Reprise possible à tout moment : la progression est enregistrée à chaque fenêtre
+        while start < upper:
+            end = min(start + chunk, upper)
+            deleted, updated = compact_chunk(device_id, step, start, end)
+            removed += deleted
+            if deleted or updated:
+                if touched and touched[-1][1] == start:
+                    touched[-1] = (touched[-1][0], end)
+                else:
+                    touched.append((start, end))
+            start = end
+    return removed, touched
+
+def _drop_partitions(cutoff):
+    # Supprime les partitions mensuelles entièrement antérieures à cutoff (MySQL uniquement)
+    dropped_bytes = 0
+    dropped = []
+    if is_sqlite():
+        return dropped, dropped_bytes
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT partition_name, data_length + index_length FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = 'measurements'
+              AND partition_name LIKE 'p2%'
+        """)
+        for name, size in cursor.fetchall():
+            month = datetime.strptime(name, "p%Y%m")
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            if next_month <= cutoff:
+                dropped.append(name)
+                dropped_bytes += size or 0
+        if dropped:
+            # Le DROP PARTITION est validé implicitement : lignes comptées avant, compteur ajusté après
+            cursor.execute(f"SELECT COUNT(*) FROM measurements PARTITION ({', '.join(dropped)})")
+            rows = cursor.fetchone()[0]
+            cursor.execute(f"ALTER TABLE measurements DROP PARTITION {', '.join(dropped)}")
+            bump(cursor, "measurements", -rows)
+            conn.commit()
+    return dropped, dropped_bytes
+
+def purge_older_than(cutoff):
+    # Supprime les partitions entièrement antérieures à cutoff, puis le reste par petits lots
+    dropped, dropped_bytes = _drop_partitions(cutoff)
+    # SQLite n'a pas de DELETE ... LIMIT : lot choisi par sous-requête
+    if is_sqlite():
+        query = "DELETE FROM measurements WHERE id IN (SELECT id FROM measurements WHERE time < %s LIMIT %s)"
+    else:
+        query = "DELETE FROM measurements WHERE time < %s LIMIT %s"
+    deleted = 0
+    while True:
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (cutoff, RETENTION_DELETE_BATCH))
+            count = cursor.rowcount
+            bump(cursor, "measurements", -count)
+            conn.commit()
+        deleted += count
+        if count < RETENTION_DELETE_BATCH:
+            break
+    return dropped, dropped_bytes, deleted
+
+def run_retention(now=None):
+    now = now or datetime.now()
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        row_length = _avg_row_length(cursor)
+        cursor.execute("SELECT DISTINCT device_id FROM measurements_rollup WHERE resolution = 86400")
+        devices = [row[0] for row in cursor.fetchall()]
+    compacted = 0
+    touched = []
+    for device_id in devices:
+        removed, ranges = compact_device(device_id, now)
+        compacted += removed
+        touched.extend(ranges)
+    dropped, dropped_bytes, deleted = [], 0, 0
+    if RETENTION_MAX_AGE_DAYS is not None:
+        cutoff = now - timedelta(days=RETENTION_MAX_AGE_DAYS)
+        dropped, dropped_bytes, deleted = purge_older_than(cutoff)
+        if deleted or dropped:
+            touched.append((None, cutoff))
+    quarantined = purge_quarantine(now)
+    report = {
+        "compacted_rows": compacted,
+        "deleted_rows": deleted,
+        "dropped_partitions": dropped,
+        "quarantine_deleted": quarantined,
+        # Estimation : lignes retirées x taille moyenne d'une ligne + taille des partitions supprimées
+        "bytes_reclaimed": (compacted + deleted) * row_length + dropped_bytes,
+    }
+    if touched:
+        # Des mesures existantes ont changé : réponses en cache, résumés statistiques et mois
+        # archivés des plages concernées ne sont plus valides
+        httpcache.invalidate()
+        for start, end in touched:
+            stats.invalidate(start, end)
+            archive.invalidate(start, end - timedelta(seconds=1))
+    logging.info(f"Rétention : {report}")
+    return report
+
+def retention_loop():
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            logging.error(f"Rétention des mesures : {e}")
+        time.sleep(RETENTION_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from migrations import check_schema
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    check_schema()
+    print(run_retention())
@@ -0,0 +1,159 @@
+import sys
+import logging
+from datetime import datetime, timedelta
+
+from db import get_mysql_connection, is_sqlite, as_datetime
+
+# Granularités maintenues (secondes) : minute, heure, jour
+RESOLUTIONS = (60, 3600, 86400)
+
+# Fusion d'un agrégat partiel dans le seau existant ; last_* est mis à jour avant last_time
+UPSERT_ROLLUP = """
+    INSERT INTO measurements_rollup
+        (resolution, device_id, bucket, count, temp_sum, temp_min, temp_max, temp_last,
+         hum_sum, hum_min, hum_max, hum_last, last_time)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        count = count + VALUES(count),
+        temp_sum = temp_sum + VALUES(temp_sum),
+        temp_min = LEAST(temp_min, VALUES(temp_min)),
+        temp_max = GREATEST(temp_max, VALUES(temp_max)),
+        temp_last = IF(VALUES(last_time) >= last_time, VALUES(temp_last), temp_last),
+        hum_sum = hum_sum + VALUES(hum_sum),
+        hum_min = LEAST(hum_min, VALUES(hum_min)),
+        hum_max = GREATEST(hum_max, VALUES(hum_max)),
+        hum_last = IF(VALUES(last_time) >= last_time, VALUES(hum_last), hum_last),
+        last_time = GREATEST(last_time, VALUES(last_time))
+"""
+
+# Même fusion sous SQLite : les SET lisent tous l'ancienne ligne, l'ordre est indifférent
+UPSERT_ROLLUP_SQLITE = """
+    INSERT INTO measurements_rollup
+        (resolution, device_id, bucket, count, temp_sum, temp_min, temp_max, temp_last,
+         hum_sum, hum_min, hum_max, hum_last, last_time)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (resolution, device_id, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        temp_sum = temp_sum + excluded.temp_sum,
+        temp_min = min(temp_min, excluded.temp_min),
+        temp_max = max(temp_max, excluded.temp_max),
+        temp_last = CASE WHEN excluded.last_time >= last_time THEN excluded.temp_last ELSE temp_last END,
+        hum_sum = hum_sum + excluded.hum_sum,
+        hum_min = min(hum_min, excluded.hum_min),
+        hum_max = max(hum_max, excluded.hum_max),
+        hum_last = CASE WHEN excluded.last_time >= last_time THEN excluded.hum_last ELSE hum_last END,
+        last_time = max(last_time, excluded.last_time)
+"""
+
+def bucket_start(t, resolution):
+    if resolution == 60:
+        return t.replace(second=0, microsecond=0)
+    if resolution == 3600:
+        return t.replace(minute=0, second=0, microsecond=0)
+    return t.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def aggregate(rows):
+    # rows : (device_id, time, temperature, humidity[, flags]) -> lignes prêtes pour UPSERT_ROLLUP
+    buckets = {}
+    for device_id, t, temperature, humidity, *_ in rows:
+        if isinstance(t, str):
+            t = datetime.strptime(t, "%Y-%m-%d %H:%M:%S")
+        for resolution in RESOLUTIONS:
+            key = (resolution, device_id, bucket_start(t, resolution))
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [1, temperature, temperature, temperature, temperature,
+                                humidity, humidity, humidity, humidity, t]
+                continue
+            b[0] += 1
+            b[1] += temperature
+            b[2] = min(b[2], temperature)
+            b[3] = max(b[3], temperature)
+            b[5] += humidity
+            b[6] = min(b[6], humidity)
+            b[7] = max(b[7], humidity)
+            if t >= b[9]:
+                b[4] = temperature
+                b[8] = humidity
+                b[9] = t
+    return [key + tuple(b) for key, b in buckets.items()]
+
+def update_rollups(cursor, rows):
+    # Appelé dans la transaction d'écriture des mesures (writer.write_batch)
+    cursor.executemany(UPSERT_ROLLUP_SQLITE if is_sqlite() else UPSERT_ROLLUP, aggregate(rows))
+
+def pick_resolution(resolution):
+    # Granularité la plus grossière qui reste au moins aussi fine que la résolution demandée
+    candidates = [r for r in RESOLUTIONS if r <= resolution]
+    return max(candidates) if candidates else None
+
+def get_rollups(start, end, resolution, device_id=None):
+    granularity = pick_resolution(resolution)
+    if granularity is None:
+        return None, []
+    query = """
+        SELECT device_id, bucket, count,
+               temp_sum / count, temp_min, temp_max, temp_last,
+               hum_sum / count, hum_min, hum_max, hum_last
+        FROM measurements_rollup
+        WHERE resolution = %s AND bucket BETWEEN %s AND %s
+    """
+    params = [granularity, bucket_start(start, granularity), end]
+    if device_id:
+        query += " AND device_id = %s"
+        params.append(device_id)
+    query += " ORDER BY bucket ASC"
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return granularity, cursor.fetchall()
+
+def backfill(start=None, end=None):
+    # Recalcule les agrégats jour par jour à partir des mesures brutes (une transaction par jour).
+    # À lancer de préférence ingestion arrêtée : une mesure écrite pendant le recalcul du jour
+    # en cours peut être comptée deux fois. Ne pas l'appliquer aux périodes déjà compactées
+    # par retention.py : les agrégats exacts seraient remplacés par des moyennes de moyennes.
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(time), MAX(time) FROM measurements")
+        first, last = (as_datetime(t) for t in cursor.fetchone())
+    if first is None:
+        return 0
+    day = bucket_start(start or first, 86400)
+    end = end or last
+    total = 0
+    while day <= end:
+        next_day = day + timedelta(days=1)
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT device_id, time, temperature, humidity FROM measurements "
+                "WHERE time >= %s AND time < %s AND flags = 0",
+                (day, next_day)
+            )
+            rows = cursor.fetchall()
+            cursor.execute(
+                "DELETE FROM measurements_rollup WHERE bucket >= %s AND bucket < %s",
+                (day, next_day)
+            )
+            if rows:
+                update_rollups(cursor, rows)
+            conn.commit()
+        total += len(rows)
+        logging.info(f"Rollups recalculés pour {day:%Y-%m-%d} : {len(rows)} mesures")
+        day = next_day
+    return total
+
+if __name__ == "__main__":
+    # python rollups.py backfill [AAAA-MM-JJ [AAAA-MM-JJ]]
+    from dotenv import load_dotenv
+    from migrations import check_schema
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print("Usage : python rollups.py backfill [début AAAA-MM-JJ] [fin AAAA-MM-JJ]")
+        sys.exit(1)
+    start = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    end = datetime.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else None
+    check_schema()
+    print(f"{backfill(start, end)} mesures agrégées")
@@ -0,0 +1,211 @@
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import time
+import shutil
+import logging
+from datetime import datetime, date
+from threading import Lock
+
+from config import CSV_FILE, SEGMENTS_DIR, SEGMENT_INDEX_FILE, SEGMENT_FSYNC_INTERVAL_SECONDS
+
+HEADER = ["ID", "Date/Heure", "Temperature (C)", "Humidite (%)"]
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_lock = Lock()
+_open_files = {}  # (device_id, jour) -> fichier ouvert en ajout
+_index = None     # {device_id: {"AAAA-MM-JJ": {"file", "start", "end", "rows", "closed"}}}
+_last_fsync = 0.0
+
+def _device_dir(device_id):
+    return os.path.join(SEGMENTS_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", device_id))
+
+def _parse_time(t):
+    if isinstance(t, datetime):
+        return t
+    # Format actuel, puis celui des anciennes lignes de data.csv
+    for fmt in (TIME_FORMAT, "%d-%m-%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S"):
+        try:
+            return datetime.strptime(t, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Date invalide : {t!r}")
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(SEGMENT_INDEX_FILE) as f:
+                _index = json.load(f)
+        except FileNotFoundError:
+            _index = {}
+    return _index
+
+def _save_index():
+    # Écriture atomique : fichier temporaire puis renommage
+    tmp = SEGMENT_INDEX_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_index, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, SEGMENT_INDEX_FILE)
+
+def _open_segment(device_id, day):
+    key = (device_id, day)
+    file = _open_files.get(key)
+    if file is None:
+        directory = _device_dir(device_id)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{day}.csv")
+        new = not os.path.exists(path)
+        file = open(path, mode="a", newline="", buffering=64 * 1024)
+        if new:
+            csv.writer(file).writerow(HEADER)
+        _open_files[key] = file
+        _load_index().setdefault(device_id, {}).setdefault(day, {
+            "file": os.path.relpath(path, SEGMENTS_DIR), "start": None, "end": None, "rows": 0, "closed": False
+        })
+    return file
+
+def _sync(force=False):
+    global _last_fsync
+    now = time.monotonic()
+    if not force and now - _last_fsync < SEGMENT_FSYNC_INTERVAL_SECONDS:
+        return
+    for file in _open_files.values():
+        file.flush()
+        os.fsync(file.fileno())
+    _save_index()
+    _last_fsync = now
+
+def _compress(device_id, day):
+    entry = _index[device_id][day]
+    path = os.path.join(SEGMENTS_DIR, entry["file"])
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+    entry["file"] += ".gz"
+    entry["closed"] = True
+
+def close_segments(before=None):
+    # Ferme et compresse les segments des jours antérieurs à "before" (aujourd'hui par défaut)
+    before = (before or date.today()).isoformat()
+    closed = 0
+    with _lock:
+        index = _load_index()
+        for (device_id, day), file in list(_open_files.items()):
+            if day < before:
+                file.close()
+                del _open_files[(device_id, day)]
+        for device_id, days in index.items():
+            for day, entry in days.items():
+                if day < before and not entry["closed"]:
+                    _compress(device_id, day)
+                    closed += 1
+        if closed:
+            _save_index()
+    return closed
+
+def append_rows(rows):
+    # rows : (device_id, time, temperature, humidity) ; une écriture bufferisée par segment et par lot
+    today = date.today().isoformat()
+    stale = False
+    with _lock:
+        index = _load_index()
+        groups = {}
+        for row in rows:
+            t = _parse_time(row[1])
+            groups.setdefault((row[0], t.date().isoformat()), []).append((row[0], t.strftime(TIME_FORMAT), row[2], row[3]))
+        for (device_id, day), group in groups.items():
+            entry = index.get(device_id, {}).get(day)
+            if entry and entry["closed"]:
+                # Mesure tardive pour un jour déjà compressé : ajoutée comme nouveau membre gzip
+                with gzip.open(os.path.join(SEGMENTS_DIR, entry["file"]), "at", newline="") as file:
+                    csv.writer(file).writerows(group)
+            else:
+                csv.writer(_open_segment(device_id, day)).writerows(group)
+                entry = index[device_id][day]
+            times = [r[1] for r in group]
+            entry["start"] = min([entry["start"]] + times) if entry["start"] else min(times)
+            entry["end"] = max([entry["end"]] + times) if entry["end"] else max(times)
+            entry["rows"] += len(group)
+        _sync(force=SEGMENT_FSYNC_INTERVAL_SECONDS <= 0)
+        stale = any(day < today for (_, day) in _open_files)
+    if stale:
+        close_segments()
+
+def find_segments(start, end, device_id=None):
+    # Segments dont la plage [start, end] recoupe celle demandée, d'après l'index seul
+    start, end = start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)
+    with _lock:
+        index = _load_index()
+        found = []
+        for device, days in index.items():
+            if device_id and device != device_id:
+                continue
+            for day, entry in sorted(days.items()):
+                if entry["rows"] and entry["start"] <= end and entry["end"] >= start:
+                    found.append(dict(entry, device_id=device, day=day))
+        # Les segments ouverts doivent être lisibles sur disque
+        for file in _open_files.values():
+            file.flush()
+    return found
+
+def iter_rows(start, end, device_id=None):
+    # Mesures (device_id, time, temperature, humidity) de la plage, sans ouvrir les autres segments
+    start_s, end_s = start.strftime(TIME_FORMAT), end.strftime(TIME_FORMAT)
+    for entry in find_segments(start, end, device_id):
+        path = os.path.join(SEGMENTS_DIR, entry["file"])
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", newline="") as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for row in reader:
+                if start_s <= row[1] <= end_s:
+                    yield row[0], row[1], float(row[2]), float(row[3])
+
+def flush_segments():
+    with _lock:
+        if _index is not None:
+            _sync(force=True)
+
+def initialize_segments():
+    os.makedirs(SEGMENTS_DIR, exist_ok=True)
+
+def migrate_csv(csv_file=CSV_FILE):
+    # Découpe l'ancien data.csv en segments journaliers, puis ferme les jours passés
+    initialize_segments()
+    batch = []
+    count = 0
+    with open(csv_file, newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 4:
+                continue
+            batch.append((row[0], _parse_time(row[1]), float(row[2]), float(row[3])))
+            if len(batch) >= 10000:
+                append_rows(batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        append_rows(batch)
+        count += len(batch)
+    flush_segments()
+    close_segments()
+    return count
+
+if __name__ == "__main__":
+    # python segments.py migrate [chemin/data.csv] | close
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "migrate":
+        print(f"{migrate_csv(sys.argv[2] if len(sys.argv) > 2 else CSV_FILE)} mesures migrées vers {SEGMENTS_DIR}")
+    elif command == "close":
+        print(f"{close_segments()} segment(s) fermé(s)")
+    else:
+        print("Usage : python segments.py migrate [data.csv] | close")
+        sys.exit(1)
@@ -5,8 +5,12 @@ import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from datetime import datetime
+from html import escape
 from db import get_mysql_connection
-import mysql.connector
+from sequence import bump
+import latest
+from alerts import ALERT_CONFIG_QUERY, is_alert
+from anomaly import flag_names
 load_dotenv()
 
 DB_FILE = os.environ.get("DB_FILE")
@@ -60,6 +64,7 @@ def log_admin_action(admin_username, action, target=None):
             "INSERT INTO admin_logs (admin_username, action, target, timestamp) VALUES (%s, %s, %s, %s)",
             (admin_username, action, target, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
         )
+        bump(cursor, "admin_logs", 1)
         conn.commit()
 
 # Fonction pour envoyer un email
@@ -103,7 +108,7 @@ def sendmail(destinataire, sujet, contenu_texte, contenu_html=None):
     
 # Fonction pour envoyer un email d'alerte
 
-def send_alert_email(temperature, temp_min, temp_max, humidity, humidity_min, humidity_max):
+def send_alert_email(device_id, temperature, temp_min, temp_max, humidity, humidity_min, humidity_max):
     with get_mysql_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT email FROM users WHERE email IS NOT NULL AND email != ''")
@@ -113,7 +118,7 @@ def send_alert_email(temperature, temp_min, temp_max, humidity, humidity_min, hu
         print("[INFO] Aucun destinataire email trouvé.")
         return False, "Pas d'emails configurés"
 
-    subject = "⚠️ Alerte seuil dépassé ! ⚠️"
+    subject = f"⚠️ Alerte seuil dépassé : capteur {device_id} ⚠️"
     image_url = "https://cdn-icons-png.flaticon.com/512/564/564619.png"
     logo_url = LOGO_URL
 
@@ -128,7 +133,7 @@ def send_alert_email(temperature, temp_min, temp_max, humidity, humidity_min, hu
             <div style="padding:32px 24px 24px 24px;">
                 <p style="font-size:17px;color:#333;">Bonjour,</p>
                 <p style="font-size:16px;color:#555;">
-                    <b>Un seuil de température ou d'humidité a été dépassé :</b>
+                    <b>Un seuil de température ou d'humidité a été dépassé sur le capteur {escape(device_id)} :</b>
                 </p>
                 <table style="width:100%;border-collapse:collapse;margin:20px 0;">
                     <thead>
@@ -167,7 +172,7 @@ def send_alert_email(temperature, temp_min, temp_max, humidity, humidity_min, hu
     """
 
     text = (
-        f"Alerte seuil dépassé !\n\n"
+        f"Alerte seuil dépassé sur le capteur {device_id} !\n\n"
         f"Température : {temperature}°C (min {temp_min} / max {temp_max})\n"
         f"Humidité : {humidity}% (min {humidity_min} / max {humidity_max})\n"
     )
@@ -386,39 +391,45 @@ def check_and_send_alert():
     try:
         with get_mysql_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT temp_min, temp_max, humidity_min, humidity_max FROM alert_config WHERE id=%s", (1,))
+            cursor.execute(ALERT_CONFIG_QUERY)
             alert_conf = cursor.fetchone()
-            if not alert_conf:
-                print("[WARN] Config alerte introuvable")
-                return
-
-            temp_min, temp_max, humidity_min, humidity_max = alert_conf
+        if not alert_conf:
+            print("[WARN] Config alerte introuvable")
+            return
 
-            cursor.execute("SELECT device_id, temperature, humidity, time FROM measurements ORDER BY time DESC LIMIT 1")
-            last_measure = cursor.fetchone()
+        temp_min, temp_max, humidity_min, humidity_max = alert_conf[:4]
 
-        if not last_measure:
+        # Processus séparé du serveur : le registre est rechargé depuis la base à chaque vérification
+        latest.refresh()
+        readings = latest.get_all()
+        if not readings:
             print("[WARN] Aucune mesure trouvée")
             return
 
-        device_id, temperature, humidity, measure_time = last_measure
-        print(f"[DEBUG] Mesure → Température: {temperature}, Humidité: {humidity}")
         print(f"[DEBUG] Seuils → Temp: {temp_min}-{temp_max}, Hum: {humidity_min}-{humidity_max}")
-
-        alert = (
-            temperature < temp_min or temperature > temp_max or
-            humidity < humidity_min or humidity > humidity_max
-        )
-
-        if alert:
-            print("[DEBUG] Seuil dépassé → alerte requise")
+        alerts = []
+        for device_id, reading in readings.items():
+            temperature, humidity = reading["temperature"], reading["humidity"]
+            print(f"[DEBUG] Mesure {device_id} → Température: {temperature}, Humidité: {humidity}")
+            if reading["flags"]:
+                print(f"[WARN] Capteur {device_id} en défaut : {', '.join(flag_names(reading['flags']))}")
+            # Seuils de température/humidité et, s'ils sont définis, de point de rosée, humidité absolue, indice de chaleur
+            if is_alert(temperature, humidity, alert_conf):
+                alerts.append((device_id, temperature, humidity))
+
+        if alerts:
+            print(f"[DEBUG] Seuil dépassé ({', '.join(a[0] for a in alerts)}) → alerte requise")
             if can_send_alert():
-                success, msg = send_alert_email(temperature, temp_min, temp_max, humidity, humidity_min, humidity_max)
-                if success:
-                    print("[INFO]", msg)
+                sent = False
+                for device_id, temperature, humidity in alerts:
+                    success, msg = send_alert_email(device_id, temperature, temp_min, temp_max, humidity, humidity_min, humidity_max)
+                    if success:
+                        print("[INFO]", device_id, msg)
+                        sent = True
+                    else:
+                        print("[ERREUR]", device_id, msg)
+                if sent:
                     update_last_alert_time()
-                else:
-                    print("[ERREUR]", msg)
             else:
                 print("[INFO] Délai entre alertes non expiré")
         else:
@@ -1,28 +1,101 @@
+import sys
+import time
+import logging
+from datetime import datetime
+
 from db import get_mysql_connection
+from config import SEQUENCE_RECONCILE_CHUNK, SEQUENCE_RECONCILE_INTERVAL_SECONDS
+
+# Tables dont le nombre de lignes est tenu à jour dans sequence
+TABLES = ["users", "measurements", "admin_logs", "alert_config"]
 
-def update_sequence_table():
-    tables = ["users", "measurements", "admin_logs", "alert_config"]
+def bump(cursor, table, delta):
+    # À appeler dans la transaction qui insère ou supprime les lignes : compteur et données restent cohérents
+    if delta:
+        cursor.execute(
+            "UPDATE sequence SET total = total + %s, updated_at = %s WHERE table_name = %s",
+            (delta, datetime.now(), table)
+        )
+
+def get_sequence_totals():
+    # Lecture des compteurs seuls (une ligne par table), sans parcourir les tables comptées
     with get_mysql_connection() as conn:
         cursor = conn.cursor()
-        for table in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table}")
-            total = cursor.fetchone()[0]
-            cursor.execute("SELECT id FROM sequence WHERE table_name = %s", (table,))
-            exists = cursor.fetchone()
-            if exists:
+        cursor.execute("SELECT table_name, total FROM sequence")
+        return cursor.fetchall()
+
+def _count_chunked(table, max_id, chunk):
+    # COUNT(*) par plages d'id : chaque requête reste courte, même sur une grosse table
+    total = 0
+    low = 0
+    while low < max_id:
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE id > %s AND id <= %s",
+                (low, min(low + chunk, max_id))
+            )
+            total += cursor.fetchone()[0]
+        low += chunk
+    return total
+
+def reconcile(chunk=SEQUENCE_RECONCILE_CHUNK):
+    # Vérifie chaque compteur et corrige la dérive éventuelle ; renvoie {table: (avant, après)}
+    drift = {}
+    for table in TABLES:
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT MAX(id) FROM {table}")
+            max_id = cursor.fetchone()[0] or 0
+        counted = _count_chunked(table, max_id, chunk)
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT total FROM sequence WHERE table_name = %s", (table,))
+            row = cursor.fetchone()
+            # Les lignes arrivées pendant le comptage (id > max_id) sont comptées dans la même instruction
+            if row is None:
                 cursor.execute(
-                    "UPDATE sequence SET total = %s, updated_at = NOW() WHERE table_name = %s",
-                    (total, table)
+                    f"INSERT INTO sequence (table_name, total, updated_at) "
+                    f"SELECT %s, %s + COUNT(*), %s FROM {table} WHERE id > %s",
+                    (table, counted, datetime.now(), max_id)
                 )
             else:
                 cursor.execute(
-                    "INSERT INTO sequence (table_name, total, updated_at) VALUES (%s, %s, NOW())",
-                    (table, total)
+                    f"UPDATE sequence SET total = %s + (SELECT COUNT(*) FROM {table} WHERE id > %s), "
+                    f"updated_at = %s WHERE table_name = %s",
+                    (counted, max_id, datetime.now(), table)
                 )
-        conn.commit()
+            cursor.execute("SELECT total FROM sequence WHERE table_name = %s", (table,))
+            total = cursor.fetchone()[0]
+            conn.commit()
+        before = row[0] if row else None
+        if before != total:
+            logging.warning(f"Compteur {table} corrigé : {before} -> {total}")
+            drift[table] = (before, total)
+    return drift
 
-def get_sequence_totals():
-    with get_mysql_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT table_name, total FROM sequence")
-        return cursor.fetchall()
\ No newline at end of file
+def reconcile_loop():
+    # Vérification périodique facultative (SEQUENCE_RECONCILE_INTERVAL_SECONDS)
+    while True:
+        time.sleep(SEQUENCE_RECONCILE_INTERVAL_SECONDS)
+        try:
+            reconcile()
+        except Exception as e:
+            logging.error(f"Vérification des compteurs : {e}")
+
+if __name__ == "__main__":
+    # python sequence.py [show | reconcile]
+    from dotenv import load_dotenv
+    from migrations import check_schema
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "show"
+    check_schema()
+    if command == "reconcile":
+        print(f"Compteurs corrigés : {reconcile() or 'aucun'}")
+    elif command == "show":
+        for table, total in get_sequence_totals():
+            print(f"{table} : {total}")
+    else:
+        print("Usage : python sequence.py [show | reconcile]")
+        sys.exit(1)
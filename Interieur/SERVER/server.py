@@ -1,7 +1,10 @@
 import os
+import sys
 import time
+import signal
 import secrets
 import logging
+from datetime import datetime
 from threading import Thread
 
 from flask import (
@@ -16,13 +19,23 @@ from admin import admin_bp
 from api import api_bp
 from config import (
     SERVER_ADDRESS, SERVER_PORT, WEB_DIR, DATA_DIR, CSV_FILE, BACKUP_DIR,
-    BACKUP_INTERVAL_SECONDS, BACKUP_RETENTION_DAYS, CLEANUP_INTERVAL_SECONDS
+    BACKUP_INTERVAL_SECONDS, BACKUP_RETENTION_DAYS, CLEANUP_INTERVAL_SECONDS,
+    SEQUENCE_RECONCILE_INTERVAL_SECONDS, LIVE_PORT, INGEST_PROCESSES
 )
 from limiter_config import limiter
-from utils import add_measurement, get_all_measurements, initialize_csv
-from backup import backup_csv, cleanup_old_backups
-from sequence import update_sequence_table
+from utils import add_measurement, get_all_measurements, get_measurements
+from segments import initialize_segments
+from writer import start_writer
+from backup import backup_segments, cleanup_old_backups
+from retention import retention_loop
+from sequence import reconcile_loop
+from latest import refresh as load_latest_readings
+from httpcache import cached, start_http_cache
+from stats import start_stats_cache
+from archive import start_archive
+from migrations import check_schema, add_future_partitions
 from socket_server import start_socket_server
+from workers import start_ingest_workers, owned_journals
 from sendmail import log_admin_action
 from auth import admin_required
 from db import get_mysql_connection
@@ -60,7 +73,7 @@ logging.getLogger().addHandler(logging.StreamHandler())
 
 @app.route("/")
 def index():
-    return render_template("index.html", server_address=SERVER_ADDRESS)
+    return render_template("index.html", server_address=SERVER_ADDRESS, live_port=LIVE_PORT)
 
 @app.route("/historique")
 def historique():
@@ -71,8 +84,25 @@ def rgpd():
     return render_template("rgpd.html")
 
 @app.route("/data")
+@cached
 def get_data():
-    return jsonify(get_all_measurements())
+    # Sans paramètre : toute la table (compatibilité). Sinon lecture incrémentale :
+    # ?since_id=<id> ou ?since=<AAAA-MM-JJ HH:MM:SS>, et/ou ?limit=<n> (n dernières mesures)
+    # ?format=columnar : tableaux parallèles (voir utils.rows_to_columns)
+    since_id = request.args.get("since_id", type=int)
+    since_time = request.args.get("since")
+    limit = request.args.get("limit", type=int)
+    columnar = request.args.get("format") == "columnar"
+    if since_id is None and since_time is None and limit is None:
+        return jsonify(get_all_measurements(columnar=columnar))
+    if since_time is not None:
+        try:
+            since_time = datetime.fromisoformat(since_time.replace("T", " "))
+        except ValueError:
+            return jsonify({"error": "Paramètre since invalide"}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "Paramètre limit invalide"}), 400
+    return jsonify(get_measurements(since_id=since_id, since_time=since_time, limit=limit, columnar=columnar))
 
 @app.route("/alerte")
 def alerte():
@@ -82,9 +112,31 @@ def alerte():
 # ========== MAIN ==========
 if __name__ == "__main__":
     time.sleep(1)
-    update_sequence_table()
-    initialize_csv()
-    Thread(target=start_socket_server, daemon=True).start()
-    Thread(target=backup_csv, daemon=True).start()
+    # Refuse de démarrer sur un schéma non migré (python migrations.py upgrade)
+    check_schema()
+    add_future_partitions()
+    # Registre des dernières mesures par capteur (check_alert, Home Assistant)
+    load_latest_readings()
+    # Validateurs ETag des lectures JSON, tenus à jour par le writer
+    start_http_cache()
+    # Résumés statistiques des périodes closes : invalidés par les mesures tardives
+    start_stats_cache()
+    # Mois archivés : invalidés si une écriture les touche encore
+    start_archive()
+    initialize_segments()
+    # Relit aussi les journaux des processus d'ingestion qui ne seront pas relancés
+    start_writer(owned=owned_journals(INGEST_PROCESSES))
+    # SIGTERM (systemd) -> sortie normale pour que les hooks atexit synchronisent et ferment le journal,
+    # puis tentent une dernière relecture vers la base et les segments CSV
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if INGEST_PROCESSES > 0:
+        # Ingestion dans des processus séparés (SO_REUSEPORT), hors du GIL du processus Flask
+        start_ingest_workers(INGEST_PROCESSES)
+    else:
+        Thread(target=start_socket_server, daemon=True).start()
+    Thread(target=backup_segments, daemon=True).start()
     Thread(target=cleanup_old_backups, daemon=True).start()
+    Thread(target=retention_loop, daemon=True).start()
+    if SEQUENCE_RECONCILE_INTERVAL_SECONDS:
+        Thread(target=reconcile_loop, daemon=True).start()
     app.run(host="0.0.0.0", port=5000)
@@ -1,36 +1,243 @@
-import socket
+import time
+import asyncio
+import queue
 import logging
-from config import SERVER_ADDRESS, SERVER_PORT
-from utils import add_measurement
-from homeassistant import send_to_home_assistant
-from admin import get_homeassistant_enabled
-
-def start_socket_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((SERVER_ADDRESS, SERVER_PORT))
-    server_socket.listen(5)
-    logging.info(f"Serveur à l'écoute sur {SERVER_ADDRESS}:{SERVER_PORT}")
+from datetime import datetime
+from threading import Thread
+from config import (
+    SERVER_ADDRESS, SERVER_PORT, INGEST_BACKLOG, INGEST_LINE_LIMIT, INGEST_READ_TIMEOUT,
+    INGEST_QUEUE_SIZE, INGEST_WORKERS, INGEST_SESSION_TIMEOUT, INGEST_FRAME_MAX_READINGS, LIVE_PORT
+)
+from live import start_live_server
+from ingest import check_timestamp, admit, record, finish
+from dedup import mark_stored
+import journal
+
+# Les mesures sont journalisées dans la boucle asyncio (ingest.record, disque local) ; la suite du
+# traitement qui attend le réseau (quarantaine en base, Home Assistant) passe par cette file :
+# (device_id, temperature, humidity, flags, heure de mesure ou None = heure d'arrivée)
+readings_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+# Compteurs de réception, tenus par la seule boucle asyncio (agrégés entre processus par workers.py)
+_stats = {
+    "connections": 0,  # connexions acceptées
+    "frames": 0,       # trames v2 reçues
+    "readings": 0,     # mesures journalisées ou mises en quarantaine
+    "duplicates": 0,   # mesures déjà reçues, acquittées sans écriture
+    "rejected": 0,     # mesures illisibles, hors limites ou refusées (file pleine, journal indisponible)
+}
+
+# Deux formats acceptés sur le même port :
+# - v1, une mesure par ligne, sans réponse : "ID:<id> Temperature:<t>C Humidity:<h>%"
+# - v2, connexion persistante, trames de mesures horodatées par le capteur :
+#     "V2 <trame> <id> <n>" puis n lignes "<séquence> <epoch> <température> <humidité>"
+#   réponse "ACK <trame> <acceptées> <rejetées> <dernière séquence>" une fois ses mesures dans le
+#   journal local et sur disque (le capteur les efface alors de sa mémoire RTC)
+#   (les doublons d'une trame renvoyée comptent comme acceptés : ils sont déjà enregistrés),
+#   ou "NACK <trame> <raison>" : le capteur garde alors ses mesures et renverra la trame.
+FRAME_VERSION = "V2"
+
+def parse_measurement(data):
+    # Format attendu : "ID:<id> Temperature:<t>C Humidity:<h>%"
+    if "ID:" not in data or "Temperature:" not in data or "Humidity:" not in data:
+        raise ValueError(f"Format de données inattendu : {data!r}")
+    device_id = data.split("ID:")[1].split(" ")[0].strip()
+    temperature = float(data.split("Temperature:")[1].split("C")[0].strip())
+    humidity = float(data.split("Humidity:")[1].split("%")[0].strip())
+    if not device_id:
+        raise ValueError(f"Identifiant manquant : {data!r}")
+    return device_id, temperature, humidity
+
+def parse_frame_reading(data):
+    # "<séquence> <epoch> <température> <humidité>" -> (séquence, epoch, température, humidité)
+    parts = data.split()
+    if len(parts) != 4:
+        raise ValueError(f"Mesure de trame inattendue : {data!r}")
+    return int(parts[0]), int(parts[1]), float(parts[2]), float(parts[3])
 
+def process_readings():
     while True:
-        client_socket, client_address = server_socket.accept()
-        logging.info(f"Connexion de {client_address}")
+        device_id, temperature, humidity, flags, measured_at = readings_queue.get()
         try:
-            data = client_socket.recv(1024).decode("utf-8")
-            if data:
-                logging.info(f"Données reçues : {data}")
-                if "ID:" in data and "Temperature:" in data and "Humidity:" in data:
-                    try:
-                        device_id = data.split("ID:")[1].split(" ")[0].strip()
-                        temperature = float(data.split("Temperature:")[1].split("C")[0].strip())
-                        humidity = float(data.split("Humidity:")[1].split("%")[0].strip())
-                        add_measurement(device_id, temperature, humidity)
-                        if get_homeassistant_enabled():
-                            send_to_home_assistant(device_id, temperature, humidity)
-                    except ValueError as ve:
-                        logging.error(f"Extraction des données : {ve}")
-                else:
-                    logging.warning("Format de données inattendu.")
+            finish(device_id, temperature, humidity, flags, measured_at)
         except Exception as e:
-            logging.error(f"Réception données socket : {e}")
+            logging.error(f"Traitement mesure {device_id} : {e}")
         finally:
-            client_socket.close()
\ No newline at end of file
+            readings_queue.task_done()
+
+async def _journal_synced():
+    # Validation groupée : attend le prochain fsync du journal (writer, toutes les
+    # JOURNAL_FSYNC_INTERVAL_MS) sans bloquer la boucle ; False s'il n'arrive pas à temps
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def wake():
+        try:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+        except RuntimeError:
+            pass  # boucle arrêtée
+
+    journal.when_synced(wake)
+    try:
+        await asyncio.wait_for(done, timeout=INGEST_READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+async def handle_frame(header, reader, writer):
+    # Trame v2 : toutes ses mesures sont lues avant de répondre ; renvoie False si la connexion
+    # doit être fermée (en-tête illisible, la suite du flux ne peut plus être découpée)
+    parts = header.split()
+    if len(parts) != 4 or not parts[3].isdigit():
+        writer.write(f"NACK {parts[1] if len(parts) > 1 else '-'} entete\n".encode())
+        await writer.drain()
+        return False
+    _, frame_id, device_id, count = parts
+    count = int(count)
+    if count > INGEST_FRAME_MAX_READINGS:
+        writer.write(f"NACK {frame_id} taille\n".encode())
+        await writer.drain()
+        return False
+    lines = [
+        (await asyncio.wait_for(reader.readline(), timeout=INGEST_READ_TIMEOUT)).decode("utf-8", errors="replace").strip()
+        for _ in range(count)
+    ]
+    # La boucle est seule à remplir la file : la place vérifiée ici reste disponible
+    _stats["frames"] += 1
+    if readings_queue.maxsize - readings_queue.qsize() < count:
+        _stats["rejected"] += count
+        logging.error(f"File de traitement pleine, trame {frame_id} de {device_id} refusée")
+        writer.write(f"NACK {frame_id} occupe\n".encode())
+        await writer.drain()
+        return True
+    now = time.time()
+    accepted = rejected = duplicates = 0
+    last_seq = -1
+    for i, data in enumerate(lines):
+        try:
+            seq, epoch, temperature, humidity = parse_frame_reading(data)
+            check_timestamp(epoch, now)
+        except ValueError as ve:
+            logging.warning(f"Trame {frame_id} de {device_id} : {ve}")
+            rejected += 1
+            continue
+        # Mesure déjà reçue (ACK perdu) : écartée avant la détection de défauts et la base
+        flags = admit(device_id, temperature, humidity, epoch, seq)
+        if flags is None:
+            accepted += 1
+            duplicates += 1
+            last_seq = max(last_seq, seq)
+            continue
+        measured_at = datetime.fromtimestamp(epoch)
+        if not record(device_id, temperature, humidity, flags, measured_at, seq):
+            # Journal indisponible : pas d'ACK, le capteur garde la trame et la renverra ; les
+            # mesures déjà journalisées seront alors reconnues comme doublons
+            _stats["readings"] += accepted - duplicates
+            _stats["duplicates"] += duplicates
+            _stats["rejected"] += rejected + len(lines) - i
+            logging.error(f"Journal indisponible, trame {frame_id} de {device_id} refusée")
+            writer.write(f"NACK {frame_id} journal\n".encode())
+            await writer.drain()
+            return True
+        accepted += 1
+        last_seq = max(last_seq, seq)
+        readings_queue.put_nowait((device_id, temperature, humidity, flags, measured_at))
+        mark_stored(device_id, seq, epoch)
+    # Une coupure de courant ne doit pas perdre une mesure acquittée : l'ACK attend le fsync, même
+    # pour des doublons (trame renvoyée après ce NACK, journalisée mais peut-être pas encore sur disque)
+    if accepted and not await _journal_synced():
+        _stats["readings"] += accepted - duplicates
+        _stats["duplicates"] += duplicates
+        _stats["rejected"] += rejected
+        logging.error(f"Journal non synchronisé à temps, trame {frame_id} de {device_id} non acquittée")
+        writer.write(f"NACK {frame_id} journal\n".encode())
+        await writer.drain()
+        return True
+    _stats["readings"] += accepted - duplicates
+    _stats["duplicates"] += duplicates
+    _stats["rejected"] += rejected
+    logging.info(
+        f"Trame {frame_id} de {device_id} : {accepted} mesure(s) acceptée(s) dont {duplicates} doublon(s), "
+        f"{rejected} rejetée(s)"
+    )
+    writer.write(f"ACK {frame_id} {accepted} {rejected} {last_seq}\n".encode())
+    await writer.drain()
+    return True
+
+async def handle_client(reader, writer):
+    client_address = writer.get_extra_info("peername")
+    logging.info(f"Connexion de {client_address}")
+    _stats["connections"] += 1
+    timeout = INGEST_READ_TIMEOUT
+    try:
+        while True:
+            # Une mesure par ligne ; la dernière peut arriver sans "\n" avant la fermeture
+            line = await asyncio.wait_for(reader.readline(), timeout=timeout)
+            if not line:
+                break
+            data = line.decode("utf-8", errors="replace").strip()
+            if not data:
+                continue
+            if data.startswith(FRAME_VERSION + " "):
+                # Connexion persistante : le capteur n'envoie qu'une trame par cycle de mesure
+                timeout = INGEST_SESSION_TIMEOUT
+                if not await handle_frame(data, reader, writer):
+                    break
+                continue
+            logging.info(f"Données reçues : {data}")
+            try:
+                reading = parse_measurement(data)
+            except ValueError as ve:
+                logging.warning(f"Extraction des données : {ve}")
+                _stats["rejected"] += 1
+                continue
+            if readings_queue.full():
+                _stats["rejected"] += 1
+                logging.error(f"File de traitement pleine, mesure ignorée : {data}")
+                continue
+            # Détection des défauts dans la boucle : mesures d'un même capteur vues dans l'ordre, coût constant
+            flags = admit(*reading, time.time())
+            if not record(*reading, flags):
+                _stats["rejected"] += 1
+                continue
+            readings_queue.put_nowait(reading + (flags, None))
+            _stats["readings"] += 1
+    except asyncio.TimeoutError:
+        logging.warning(f"Délai dépassé pour {client_address}")
+    except ValueError as e:
+        # Ligne plus longue que INGEST_LINE_LIMIT
+        logging.warning(f"Ligne invalide de {client_address} : {e}")
+    except Exception as e:
+        logging.error(f"Réception données socket : {e}")
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+def get_ingest_stats():
+    stats = dict(_stats)
+    stats["pending"] = readings_queue.qsize()
+    return stats
+
+async def serve(reuse_port=False, live=True):
+    # reuse_port : plusieurs processus écoutent SERVER_PORT, le noyau répartit les connexions (workers.py)
+    server = await asyncio.start_server(
+        handle_client, SERVER_ADDRESS, SERVER_PORT,
+        backlog=INGEST_BACKLOG, limit=INGEST_LINE_LIMIT, reuse_port=reuse_port
+    )
+    logging.info(f"Serveur à l'écoute sur {SERVER_ADDRESS}:{SERVER_PORT}")
+    # Le flux SSE partage la boucle de l'ingestion (processus principal seulement) ; s'il ne peut pas
+    # démarrer, l'ingestion continue sans lui
+    if live and LIVE_PORT:
+        try:
+            await start_live_server()
+        except OSError as e:
+            logging.error(f"Diffusion SSE sur le port {LIVE_PORT} impossible, ingestion sans flux en direct : {e}")
+    async with server:
+        await server.serve_forever()
+
+def start_socket_server(reuse_port=False, live=True):
+    for _ in range(INGEST_WORKERS):
+        Thread(target=process_readings, daemon=True).start()
+    asyncio.run(serve(reuse_port, live))
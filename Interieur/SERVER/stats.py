@@ -0,0 +1,206 @@
+import json
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from db import get_mysql_connection, epoch_sql, as_datetime
+from writer import add_commit_listener
+from alerts import get_alert_config
+import archive
+from config import STATS_PERCENTILES, STATS_MAX_GAP_SECONDS, STATS_BATCH_DAYS
+
+# Statistiques par capteur et par période (jour, semaine, mois), calculées sur des tableaux numpy.
+# Le résumé d'une période close est calculé une fois puis gardé dans stats_cache ; seule la
+# période en cours est recalculée à chaque requête. Les seuils d'alerte utilisés sont enregistrés
+# avec le résumé : un changement de seuils rend les résumés existants obsolètes.
+PERIODS = ("day", "week", "month")
+
+def period_start(t, period):
+    day = t.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+def next_period(start, period):
+    if period == "week":
+        return start + timedelta(days=7)
+    if period == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start + timedelta(days=1)
+
+def _naive_epoch(t):
+    # Même convention que db.epoch_sql : l'heure enregistrée lue comme une heure UTC
+    return (t - datetime(1970, 1, 1)).total_seconds()
+
+def _load(start, end):
+    # Mesures de [start, end[ triées par capteur puis par heure :
+    # (capteurs, indice du capteur par ligne, epochs, températures, humidités, conversion datetime -> epoch)
+    if archive.covers(start, end - timedelta(seconds=1)):
+        # Mois archivés : epochs en heure locale (datetime.timestamp)
+        devices = archive.archived_devices(start, end)
+        limit = end.timestamp()
+        owners, epochs, temperatures, humidities = [np.empty(0, np.int32)], [], [], []
+        for i, device in enumerate(devices):
+            t, temp, hum = archive.read_range(device, start, end)
+            keep = t < limit
+            owners.append(np.full(keep.sum(), i, dtype=np.int32))
+            epochs.append(t[keep])
+            temperatures.append(temp[keep])
+            humidities.append(hum[keep])
+        return (
+            devices, np.concatenate(owners),
+            np.concatenate(epochs or [[]]).astype(np.float64),
+            np.concatenate(temperatures or [[]]).astype(np.float64),
+            np.concatenate(humidities or [[]]).astype(np.float64),
+            datetime.timestamp
+        )
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT device_id, {epoch_sql("time")}, temperature, humidity FROM measurements
+            WHERE time >= %s AND time < %s
+            ORDER BY device_id, time
+        """, (start, end))
+        rows = cursor.fetchall()
+    index = {}
+    owners = np.fromiter((index.setdefault(row[0], len(index)) for row in rows), dtype=np.int32, count=len(rows))
+    epochs = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    temperatures = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+    humidities = np.fromiter((row[3] for row in rows), dtype=np.float64, count=len(rows))
+    return list(index), owners, epochs, temperatures, humidities, _naive_epoch
+
+def _round(value):
+    return round(float(value), 2)
+
+def _series(values, durations, days, low, high):
+    percentiles = np.percentile(values, STATS_PERCENTILES)
+    # Amplitude journalière : max - min de chaque jour (les jours sont contigus, les lignes étant triées)
+    firsts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    amplitudes = np.maximum.reduceat(values, firsts) - np.minimum.reduceat(values, firsts)
+    return {
+        "min": _round(values.min()),
+        "max": _round(values.max()),
+        "mean": _round(values.mean()),
+        "std": _round(values.std()),
+        "percentiles": {f"p{p}": _round(v) for p, v in zip(STATS_PERCENTILES, percentiles)},
+        "seconds_below_min": None if low is None else int(durations[values < low].sum()),
+        "seconds_above_max": None if high is None else int(durations[values > high].sum()),
+        "daily_amplitude": {"mean": _round(amplitudes.mean()), "max": _round(amplitudes.max())}
+    }
+
+def _summarize(epochs, temperatures, humidities, day_edges, end_epoch, config):
+    # Chaque mesure vaut jusqu'à la suivante (ou la fin de période), au plus STATS_MAX_GAP_SECONDS
+    durations = np.minimum(np.diff(epochs, append=end_epoch), STATS_MAX_GAP_SECONDS)
+    days = np.searchsorted(day_edges, epochs, side="right")
+    temp_min, temp_max, humidity_min, humidity_max = config[:4] if config else (None, None, None, None)
+    return {
+        "count": len(epochs),
+        "temperature": _series(temperatures, durations, days, temp_min, temp_max),
+        "humidity": _series(humidities, durations, days, humidity_min, humidity_max)
+    }
+
+def _compute(periods, period, config):
+    # periods : débuts de périodes consécutives -> {début: {device_id: résumé}}
+    start, end = periods[0], next_period(periods[-1], period)
+    devices, owners, epochs, temperatures, humidities, to_epoch = _load(start, end)
+    edges = np.array([to_epoch(p) for p in periods] + [to_epoch(end)])
+    day_edges = []
+    day = start
+    while day < end:
+        day += timedelta(days=1)
+        day_edges.append(to_epoch(day))
+    day_edges = np.array(day_edges)
+    summaries = {p: {} for p in periods}
+    device_bounds = np.searchsorted(owners, np.arange(len(devices) + 1))
+    for i, device in enumerate(devices):
+        lo, hi = device_bounds[i], device_bounds[i + 1]
+        cuts = np.searchsorted(epochs[lo:hi], edges) + lo
+        for j, p in enumerate(periods):
+            a, b = cuts[j], cuts[j + 1]
+            if a < b:
+                summaries[p][device] = _summarize(
+                    epochs[a:b], temperatures[a:b], humidities[a:b], day_edges, edges[j + 1], config
+                )
+    return summaries
+
+def _batches(periods, period):
+    # Périodes consécutives regroupées en plages d'au plus STATS_BATCH_DAYS jours (une lecture chacune)
+    batch = []
+    for p in periods:
+        if batch and (next_period(p, period) - batch[0] > timedelta(days=STATS_BATCH_DAYS) or p != next_period(batch[-1], period)):
+            yield batch
+            batch = []
+        batch.append(p)
+    if batch:
+        yield batch
+
+def get_stats(start, end, period="day", device_id=None):
+    # Périodes entières intersectant [start, end] : [{device_id, start, end, count, temperature, humidity}]
+    config = get_alert_config()
+    thresholds = json.dumps(list(config)) if config else ""
+    now = datetime.now()
+    periods = []
+    p = period_start(start, period)
+    while p <= end:
+        periods.append(p)
+        p = next_period(p, period)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT period_start, summary FROM stats_cache "
+            "WHERE period = %s AND period_start >= %s AND period_start <= %s AND thresholds = %s",
+            (period, periods[0], periods[-1], thresholds)
+        )
+        summaries = {as_datetime(row[0]): json.loads(row[1]) for row in cursor.fetchall()}
+    missing = [p for p in periods if p not in summaries]
+    computed = {}
+    for batch in _batches(missing, period):
+        computed.update(_compute(batch, period, config))
+    closed = [p for p in computed if next_period(p, period) <= now]
+    if closed:
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "REPLACE INTO stats_cache (period, period_start, period_end, thresholds, summary, computed_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [(period, p, next_period(p, period), thresholds, json.dumps(computed[p]), now) for p in closed]
+            )
+            conn.commit()
+    summaries.update(computed)
+    results = []
+    for p in periods:
+        for device, summary in sorted(summaries[p].items()):
+            if device_id is None or device == device_id:
+                results.append(dict(summary, device_id=device, start=p, end=next_period(p, period)))
+    return results
+
+def invalidate(start, end=None):
+    # Supprime les résumés des périodes qui intersectent [start, end[ (start None : depuis le début,
+    # end None : jusqu'à maintenant) ; ils sont recalculés à la prochaine demande
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("period_end > %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("period_start < %s")
+        params.append(end)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM stats_cache {'WHERE ' + ' AND '.join(conditions) if conditions else ''}", params)
+        if cursor.rowcount:
+            logging.info(f"{cursor.rowcount} résumé(s) statistique(s) invalidé(s) entre {start} et {end}")
+        conn.commit()
+
+def _on_commit(batch):
+    # Mesures arrivées en retard dans une période close : son résumé est recalculé à la prochaine demande
+    oldest = min(as_datetime(row[1]) for row in batch)
+    if oldest >= period_start(datetime.now(), "day"):
+        return
+    invalidate(oldest)
+
+def start_stats_cache():
+    # Appelé au démarrage du serveur : invalide les résumés touchés par des mesures tardives
+    add_commit_listener(_on_commit)
@@ -2,16 +2,16 @@ from flask import (
     render_template, request, redirect, url_for, session, flash, Blueprint, send_file, current_app, jsonify, abort
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from db import get_mysql_connection
+from db import get_mysql_connection, IntegrityError
+from sequence import bump
+from export import iter_measurements, export_response
 from sendmail import send_verification_email, send_password_reset_email, send_delete_account_email, send_email_change_confirmation
 from auth import login_required
 import time
 import secrets
 from datetime import datetime
-import mysql.connector
 import pyotp
 import io
-import csv
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 import qrcode
 from config import SERVER_ADDRESS
@@ -50,6 +50,7 @@ def log_admin_action(admin_username, action, target=None):
             "INSERT INTO admin_logs (admin_username, action, target, timestamp) VALUES (%s, %s, %s, %s)",
             (admin_username, action, target, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
         )
+        bump(cursor, "admin_logs", 1)
         conn.commit()
 
 # ========== INSCRIPTION ==========
@@ -72,10 +73,11 @@ def register():
                     "INSERT INTO users (username, password, email, email_verified, email_token, creation_date, last_login) VALUES (%s, %s, %s, 0, %s, %s, %s)",
                     (username, hashed, email, token, datetime.now().strftime("%Y-%m-%d"), "")
                 )
+                bump(cursor, "users", 1)
                 conn.commit()
             send_verification_email(email, username, token, SERVER_ADDRESS)
             return render_template("register.html", message="Inscription réussie ! Un mail de vérification a été envoyé à votre adresse. Vérifiez-la puis connectez-vous.")
-        except mysql.connector.IntegrityError:
+        except IntegrityError:
             return render_template("register.html", error="Nom d'utilisateur déjà pris.")
         except Exception as e:
             logging.exception(e)  # Log la stack trace complète
@@ -399,19 +401,9 @@ def download_my_data():
         cursor = conn.cursor()
         cursor.execute("SELECT username, email, creation_date, last_login FROM users WHERE username = %s", (username,))
         user = cursor.fetchone()
-        cursor.execute("SELECT * FROM measurements WHERE device_id = %s", (username,))
-        measurements = cursor.fetchall()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["username", "email", "creation_date", "last_login"])
-    writer.writerow(user)
-    writer.writerow([])
-    # On écrit seulement les valeurs, sans les noms de colonnes
-    for row in measurements:
-        writer.writerow(row)
-    output.seek(0)
-    return send_file(io.BytesIO(output.getvalue().encode()), mimetype="text/csv",
-                     as_attachment=True, download_name="mes_donnees.csv")
+    # Infos du compte puis mesures, envoyées au fil de la lecture (voir export.py)
+    prefix = [["username", "email", "creation_date", "last_login"], user, []]
+    return export_response(iter_measurements(device_id=username), "csv", "mes_donnees", prefix)
 
 # ========== DEMANDER SUPPRESSION COMPTE ==========
 
@@ -455,6 +447,7 @@ def confirm_delete_account():
     with get_mysql_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        bump(cursor, "users", -cursor.rowcount)
         conn.commit()
     session.clear()
     return render_template("confirm_delete_account.html", success="Votre compte a bien été supprimé.")
@@ -1,57 +1,150 @@
-import os
-import csv
-import logging
 from datetime import datetime
 
-from db import get_mysql_connection
-from config import CSV_FILE, DATA_DIR
-
-def add_measurement(device_id, temperature, humidity):
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        with get_mysql_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO measurements (device_id, time, temperature, humidity) VALUES (%s, %s, %s, %s)",
-                (device_id, current_time, temperature, humidity)
-            )
-            conn.commit()
-        with open(CSV_FILE, mode="a", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow([device_id, current_time, temperature, humidity])
-    except Exception as e:
-        logging.error(f"Ajout de mesure : {e}")
-
-def get_all_measurements():
+import numpy as np
+
+from db import get_mysql_connection, epoch_sql
+from writer import enqueue_measurement
+from climate import DERIVED
+from anomaly import flag_names
+import latest
+from config import MEASUREMENTS_MAX_LIMIT
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+# Valeurs lues après id, device_id et time : mesure brute, grandeurs dérivées (climate.py)
+# puis défauts signalés à l'ingestion (anomaly.py)
+MEASUREMENT_COLUMNS = "temperature, humidity, " + ", ".join(DERIVED) + ", flags"
+
+def add_measurement(device_id, temperature, humidity, flags=0, measured_at=None, seq=None):
+    # flags : défauts signalés par anomaly.check (les mesures en quarantaine n'arrivent pas ici)
+    # measured_at, seq : heure et numéro de séquence donnés par le capteur (protocole v2), sinon
+    # heure d'arrivée et NULL. L'epoch est calculé avant le passage en texte : datetime.fromtimestamp
+    # et datetime.now marquent (fold) la deuxième occurrence de l'heure répétée en octobre
+    now = datetime.now().replace(microsecond=0)
+    t = measured_at.replace(microsecond=0) if measured_at else now
+    latest.update(device_id, temperature, humidity, t, seen=now, flags=flags)
+    # Écriture différée : la mesure part en base et dans le CSV avec le prochain lot
+    return enqueue_measurement(
+        (device_id, t.strftime("%Y-%m-%d %H:%M:%S"), temperature, humidity, flags, seq, int(t.timestamp()))
+    )
+
+def format_fr(dt):
+    if isinstance(dt, str):
+        try:
+            dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
+        except:
+            return dt
+    return dt.strftime("%d/%m/%Y %H:%M:%S")
+
+def rows_to_dicts(rows):
+    return [
+        {
+            "id": row[0],
+            "device_id": row[1],
+            "time": format_fr(row[2]),
+            "temperature": row[3],
+            "humidity": row[4],
+            **dict(zip(DERIVED, row[5:8])),
+            "flags": flag_names(row[8]) if row[8] is not None else None
+        }
+        for row in rows
+    ]
+
+def rows_to_columns(rows):
+    # Format colonnaire (?format=columnar) : tableaux parallèles construits d'un bloc, sans dict par ligne.
+    # "time" : heure enregistrée en secondes depuis 1970, comptée comme UTC (à afficher en UTC
+    # pour retrouver l'heure locale stockée) ; "device" : indice dans "devices".
+    # Les lectures colonnaires reçoivent déjà cette valeur de la base (db.epoch_sql).
+    if not rows:
+        return dict({"devices": [], "id": [], "device": [], "time": [], "temperature": [], "humidity": []},
+                    **{name: [] for name in DERIVED}, flags=[])
+    ids, devices, times, *values, flags = zip(*rows)
+    index = {}
+    device_index = [index.setdefault(device, len(index)) for device in devices]
+    if isinstance(times[0], datetime):
+        epochs = np.fromiter(
+            ((t.toordinal() - EPOCH_ORDINAL) * 86400 + t.hour * 3600 + t.minute * 60 + t.second for t in times),
+            dtype=np.int64, count=len(times)
+        )
+    else:
+        epochs = np.asarray(times, dtype=np.int64)
+    columns = {
+        "devices": list(index),
+        "id": list(ids),
+        "device": device_index,
+        "time": epochs.tolist(),
+        # Champ de bits (voir anomaly.FLAG_NAMES), null pour les mesures lues depuis l'archive
+        "flags": list(flags)
+    }
+    for name, column in zip(("temperature", "humidity") + DERIVED, values):
+        columns[name] = np.round(np.asarray(column, dtype=np.float64), 2).tolist()
+    return columns
+
+def _time_column(columnar):
+    return epoch_sql("time") if columnar else "time"
+
+def get_all_measurements(columnar=False):
     with get_mysql_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT device_id, time, temperature, humidity 
+        cursor.execute(f"""
+            SELECT id, device_id, {_time_column(columnar)}, {MEASUREMENT_COLUMNS}
             FROM measurements 
             ORDER BY time ASC
         """)
         rows = cursor.fetchall()
-    def format_fr(dt):
-        if isinstance(dt, str):
-            try:
-                dt = datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
-            except:
-                return dt
-        return dt.strftime("%d/%m/%Y %H:%M:%S")
-    return [
-        {
-            "device_id": row[0],
-            "time": format_fr(row[1]),
-            "temperature": row[2],
-            "humidity": row[3]
-        }
-        for row in rows
-    ]
+    return rows_to_columns(rows) if columnar else rows_to_dicts(rows)
 
-def initialize_csv():
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, mode="w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["ID", "Date/Heure", "Temperature (C)", "Humidite (%)"])
+def get_measurements(since_id=None, since_time=None, limit=None, columnar=False):
+    # Sans curseur : les "limit" dernières mesures (mode tail), sinon celles postérieures au curseur
+    limit = min(limit or MEASUREMENTS_MAX_LIMIT, MEASUREMENTS_MAX_LIMIT)
+    time_column = _time_column(columnar)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        if since_id is not None:
+            cursor.execute(f"""
+                SELECT id, device_id, {time_column}, {MEASUREMENT_COLUMNS}
+                FROM measurements
+                WHERE id > %s
+                ORDER BY id ASC
+                LIMIT %s
+            """, (since_id, limit))
+            rows = cursor.fetchall()
+        elif since_time is not None:
+            cursor.execute(f"""
+                SELECT id, device_id, {time_column}, {MEASUREMENT_COLUMNS}
+                FROM measurements
+                WHERE time > %s
+                ORDER BY time ASC, id ASC
+                LIMIT %s
+            """, (since_time, limit))
+            rows = cursor.fetchall()
+        else:
+            cursor.execute(f"""
+                SELECT id, device_id, {time_column}, {MEASUREMENT_COLUMNS}
+                FROM measurements
+                ORDER BY id DESC
+                LIMIT %s
+            """, (limit,))
+            rows = cursor.fetchall()[::-1]
+    return rows_to_columns(rows) if columnar else rows_to_dicts(rows)
+
+def get_measurements_range(start, end, device_id=None, epoch=False):
+    # Mesures brutes (id, device_id, time, temperature, humidity, grandeurs dérivées, flags) entre start et end inclus ;
+    # epoch=True : time en secondes (voir rows_to_columns)
+    time_column = _time_column(epoch)
+    with get_mysql_connection() as conn:
+        cursor = conn.cursor()
+        if device_id:
+            cursor.execute(f"""
+                SELECT id, device_id, {time_column}, {MEASUREMENT_COLUMNS}
+                FROM measurements
+                WHERE device_id = %s AND time BETWEEN %s AND %s
+                ORDER BY time ASC
+            """, (device_id, start, end))
+        else:
+            cursor.execute(f"""
+                SELECT id, device_id, {time_column}, {MEASUREMENT_COLUMNS}
+                FROM measurements
+                WHERE time BETWEEN %s AND %s
+                ORDER BY time ASC
+            """, (start, end))
+        return cursor.fetchall()
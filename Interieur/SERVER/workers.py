@@ -0,0 +1,170 @@
+import sys
+import time
+import atexit
+import signal
+import socket
+import logging
+import multiprocessing
+from datetime import datetime
+from threading import Thread, Event, Lock
+
+import latest
+from writer import start_writer, add_commit_listener, notify_commit, get_writer_stats, set_segment_sink
+from segments import append_rows
+from socket_server import start_socket_server, get_ingest_stats
+from live import run_live_server
+from config import INGEST_STATS_INTERVAL_SECONDS, INGEST_RESTART_MAX_DELAY_SECONDS, LIVE_PORT
+
+# Ingestion répartie sur plusieurs processus (INGEST_PROCESSES > 0) : chacun a sa boucle asyncio,
+# ses threads de traitement et son writer, et écoute SERVER_PORT avec SO_REUSEPORT (le noyau
+# répartit les connexions). Le processus principal relance les processus arrêtés, agrège leurs
+# compteurs et relaie les lots qu'ils ont validés à ses propres listeners (cache HTTP,
+# statistiques, flux SSE) et au registre des dernières mesures. Il est seul à écrire les segments
+# CSV : les processus d'ingestion lui envoient leurs mesures journalisées.
+# Une connexion reste sur un même processus ; après reconnexion, un capteur peut changer de
+# processus : détection des défauts et marques de doublons repartent de zéro, la clé unique
+# (device_id, time, epoch) reste le filet de sécurité.
+_ctx = multiprocessing.get_context("spawn")
+_events = None  # processus -> principal : ("batch", index, lot), ("rows", index, mesures) ou ("stats", index, relevé)
+_stop = Event()
+_lock = Lock()
+_processes = {}  # index -> multiprocessing.Process
+_started = {}    # index -> heure de lancement (monotonic)
+_retry_at = {}   # index -> heure de relance prévue
+_delays = {}     # index -> attente avant la prochaine relance (doublée à chaque arrêt rapproché)
+_restarts = {}   # index -> nombre de relances
+_reports = {}    # index -> dernier relevé des compteurs
+
+# ========== PROCESSUS D'INGESTION ==========
+
+def _report(index, events):
+    # Relevé périodique des compteurs, avec le débit d'écriture depuis le relevé précédent
+    written, since = 0, time.monotonic()
+    while True:
+        time.sleep(INGEST_STATS_INTERVAL_SECONDS)
+        writer = get_writer_stats()
+        now = time.monotonic()
+        rate = (writer["written"] - written) / (now - since)
+        written, since = writer["written"], now
+        events.put(("stats", index, {"ingest": get_ingest_stats(), "writer": writer, "rate": round(rate, 1)}))
+
+def worker_main(index, events):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s %(levelname)s ingest-{index} %(name)s %(message)s",
+        filename="app.log",
+        filemode="a",
+        force=True
+    )
+    logging.getLogger().addHandler(logging.StreamHandler())
+    # SIGTERM (arrêt du principal) -> sortie normale pour que les hooks atexit synchronisent et ferment
+    # le journal puis tentent une dernière relecture vers la base
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    set_segment_sink(lambda rows: events.put(("rows", index, rows)))
+    start_writer(f"ingest-{index}")
+    add_commit_listener(lambda batch: events.put(("batch", index, batch)))
+    Thread(target=_report, args=(index, events), daemon=True).start()
+    start_socket_server(reuse_port=True, live=False)
+
+# ========== PROCESSUS PRINCIPAL ==========
+
+def _spawn(index):
+    process = _ctx.Process(target=worker_main, args=(index, _events), name=f"ingest-{index}", daemon=True)
+    process.start()
+    _processes[index] = process
+    _started[index] = time.monotonic()
+    logging.info(f"Processus d'ingestion {index} lancé (pid {process.pid})")
+
+def _dispatch():
+    while True:
+        kind, index, payload = _events.get()
+        if kind == "stats":
+            with _lock:
+                _reports[index] = payload
+            continue
+        if kind == "rows":
+            try:
+                append_rows(payload)
+            except Exception as e:
+                logging.error(f"Écriture de {len(payload)} mesures du processus {index} dans les segments CSV : {e}")
+            continue
+        # Lot validé par un processus : registre des dernières mesures d'abord (alertes du flux SSE)
+        seen = datetime.now().replace(microsecond=0)
+        for device_id, t, temperature, humidity, flags, *_ in payload:
+            latest.update(device_id, temperature, humidity, datetime.fromisoformat(t), seen=seen, flags=flags)
+        notify_commit(payload)
+
+def _supervise():
+    while not _stop.wait(1):
+        now = time.monotonic()
+        for index, process in list(_processes.items()):
+            if process.is_alive():
+                continue
+            if index not in _retry_at:
+                # Un processus resté longtemps en service repart sans attente ; un arrêt en boucle
+                # espace les relances jusqu'à INGEST_RESTART_MAX_DELAY_SECONDS
+                if now - _started[index] > INGEST_RESTART_MAX_DELAY_SECONDS:
+                    _delays[index] = 1
+                _retry_at[index] = now + _delays[index]
+                logging.error(
+                    f"Processus d'ingestion {index} arrêté (code {process.exitcode}), relance dans {_delays[index]} s"
+                )
+                _delays[index] = min(_delays[index] * 2, INGEST_RESTART_MAX_DELAY_SECONDS)
+            elif now >= _retry_at[index]:
+                del _retry_at[index]
+                with _lock:
+                    _restarts[index] += 1
+                _spawn(index)
+
+def owned_journals(count):
+    # Journaux que les processus d'ingestion vont tenir (writer.start_writer du processus principal)
+    if count <= 0 or not hasattr(socket, "SO_REUSEPORT"):
+        return []
+    return [f"ingest-{index}" for index in range(count)]
+
+def stop_ingest_workers(timeout=15):
+    _stop.set()
+    for process in _processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in _processes.values():
+        process.join(timeout)
+
+def start_ingest_workers(count):
+    global _events
+    if not hasattr(socket, "SO_REUSEPORT"):
+        logging.error("SO_REUSEPORT indisponible : ingestion dans un thread du processus principal")
+        Thread(target=start_socket_server, daemon=True).start()
+        return
+    _events = _ctx.Queue()
+    for index in range(count):
+        _delays[index] = 1
+        _restarts[index] = 0
+        _spawn(index)
+    Thread(target=_dispatch, daemon=True).start()
+    Thread(target=_supervise, daemon=True).start()
+    atexit.register(stop_ingest_workers)
+    # Le flux SSE reste dans ce processus, alimenté par les lots relayés
+    if LIVE_PORT:
+        Thread(target=run_live_server, daemon=True).start()
+
+def get_ingest_totals():
+    # Compteurs de réception et d'écriture : ceux de ce processus, ou la somme des processus d'ingestion
+    if not _processes:
+        return {"processes": 0, "ingest": get_ingest_stats()}
+    with _lock:
+        reports = dict(_reports)
+        restarts = dict(_restarts)
+    total = {"ingest": {}, "writer": {}, "rate": 0.0}
+    for report in reports.values():
+        for section in ("ingest", "writer"):
+            for key, value in report[section].items():
+                if isinstance(value, (int, float)):
+                    total[section][key] = total[section].get(key, 0) + value
+        total["rate"] += report["rate"]
+    total["rate"] = round(total["rate"], 1)
+    workers = {
+        index: dict(reports.get(index, {}), pid=process.pid, alive=process.is_alive(), restarts=restarts[index])
+        for index, process in _processes.items()
+    }
+    return {"processes": len(_processes), "total": total, "workers": workers}
@@ -0,0 +1,246 @@
+import time
+import atexit
+import logging
+from threading import Thread, Event, Lock
+
+import journal
+from db import get_mysql_connection, is_sqlite, as_datetime
+from rollups import update_rollups
+from climate import derive
+from sequence import bump
+from segments import append_rows, flush_segments
+from config import WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL_MS, JOURNAL_FSYNC_INTERVAL_MS, JOURNAL_RETRY_MAX_SECONDS
+
+# Mesures (device_id, time, temperature, humidity, flags, seq, epoch) ajoutées au journal local
+# (journal.py) puis relues par lots : la base et les segments CSV sont alimentés depuis le journal,
+# chacun à son rythme. Une panne ou une lenteur de MySQL ne ralentit pas l'ingestion et ne perd
+# aucune mesure : le lot refusé est retenté, avec une attente croissante.
+_stop = Event()
+_thread = None
+_commit_listeners = []  # appelés avec chaque lot validé en base (diffusion en direct, ...)
+_segment_sink = append_rows  # copie CSV des mesures journalisées (voir set_segment_sink)
+_orphans = []  # journaux abandonnés à relire (processus principal, voir start_writer)
+_stats_lock = Lock()
+_stats = {
+    "enqueued": 0,   # mesures ajoutées au journal
+    "written": 0,    # mesures écrites en base
+    "batches": 0,    # lots écrits
+    "dropped": 0,    # mesures perdues (journal fermé ou disque en erreur)
+    "failed": 0,     # mesures d'un lot refusé par la base, retenté ensuite
+    "duplicates": 0, # mesures déjà en base, ignorées
+}
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+def get_writer_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["journal"] = journal.get_journal_stats()
+    return stats
+
+def enqueue_measurement(row):
+    # Ne dépend que du disque local : la mesure est dans le journal au retour
+    if not journal.append(row):
+        _count("dropped")
+        logging.error(f"Journal indisponible, mesure abandonnée : {row}")
+        return False
+    _count("enqueued")
+    return True
+
+def set_segment_sink(sink):
+    # Les segments CSV (index.json, fichiers du jour ouverts) n'ont qu'un propriétaire, le processus
+    # principal : un processus d'ingestion lui relaie ses mesures au lieu de les écrire (workers.py)
+    global _segment_sink
+    _segment_sink = sink
+
+def add_commit_listener(listener):
+    _commit_listeners.append(listener)
+
+def insert_rows(cursor, batch):
+    # batch : (device_id, time, temperature, humidity, flags, seq, epoch)
+    # Renvoie False si une mesure existait déjà (clé unique device_id, time, epoch) : rien d'autre n'est
+    # alors écrit et la transaction doit être annulée
+    # Grandeurs dérivées calculées pour tout le lot en une opération numpy
+    dew_points, abs_humidities, heat_indexes = derive([row[2] for row in batch], [row[3] for row in batch])
+    ignore = "INSERT OR IGNORE" if is_sqlite() else "INSERT IGNORE"
+    cursor.executemany(
+        f"{ignore} INTO measurements (device_id, time, temperature, humidity, flags, seq, epoch, dew_point, abs_humidity, heat_index) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+        [
+            tuple(row) + derived
+            for row, derived in zip(batch, zip(dew_points.tolist(), abs_humidities.tolist(), heat_indexes.tolist()))
+        ]
+    )
+    if cursor.rowcount != len(batch):
+        return False
+    # Agrégats minute/heure/jour (mesures sans défaut signalé) et compteur de lignes mis à jour
+    # dans la même transaction
+    update_rollups(cursor, [row for row in batch if not row[4]])
+    bump(cursor, "measurements", len(batch))
+    return True
+
+def drop_existing(cursor, batch):
+    # Retire du lot les mesures déjà en base et les doublons internes au lot (même capteur, même epoch)
+    times = [row[1] for row in batch]
+    devices = sorted({row[0] for row in batch})
+    cursor.execute(
+        f"SELECT device_id, epoch FROM measurements WHERE device_id IN ({', '.join(['%s'] * len(devices))}) "
+        "AND time >= %s AND time <= %s",
+        devices + [min(times), max(times)]
+    )
+    seen = set(cursor.fetchall())
+    fresh = []
+    for row in batch:
+        key = (row[0], row[6])
+        if key not in seen:
+            seen.add(key)
+            fresh.append(row)
+    return fresh
+
+def write_batch(batch):
+    # Renvoie False si la base a refusé le lot : il reste dans le journal et sera retenté
+    try:
+        with get_mysql_connection() as conn:
+            cursor = conn.cursor()
+            if not insert_rows(cursor, batch):
+                # Doublons : trame renvoyée non reconnue à la réception (dedup.py), ou relecture du
+                # journal après un arrêt brutal. Le lot est réécrit sans eux pour que agrégats,
+                # compteurs et notifications ne voient que les mesures réellement insérées.
+                conn.rollback()
+                fresh = drop_existing(cursor, batch)
+                _count("duplicates", len(batch) - len(fresh))
+                logging.info(f"{len(batch) - len(fresh)} mesure(s) déjà enregistrée(s) ignorée(s)")
+                batch = fresh
+                if batch and not insert_rows(cursor, batch):
+                    raise RuntimeError("doublons concurrents pendant la réécriture du lot")
+            conn.commit()
+    except Exception as e:
+        _count("failed", len(batch))
+        logging.error(f"Écriture d'un lot de {len(batch)} mesures : {e}")
+        return False
+    if batch:
+        _count("written", len(batch))
+        _count("batches")
+        notify_commit(batch)
+    return True
+
+def _with_epoch(row):
+    # Mesure journalisée avant la colonne epoch (migration 11) : heure locale convertie
+    return tuple(row) if len(row) > 6 else tuple(row) + (int(as_datetime(row[1]).timestamp()),)
+
+def notify_commit(batch):
+    # Aussi appelé par workers.py pour les lots validés par un processus d'ingestion
+    for listener in _commit_listeners:
+        try:
+            listener(batch)
+        except Exception as e:
+            logging.error(f"Notification d'un lot écrit : {e}")
+
+def _copy_segments(rows):
+    try:
+        _segment_sink(rows)
+    except Exception as e:
+        logging.error(f"Écriture de {len(rows)} mesures dans les segments CSV : {e}")
+        return False
+    return True
+
+def _drain_segments():
+    # Copie dans les segments CSV journaliers, indépendante de la base : elle avance même
+    # pendant une panne MySQL (une écriture bufferisée par lot)
+    while True:
+        rows, position = journal.read("csv", WRITE_BATCH_SIZE)
+        if not rows:
+            # Rien à copier, mais des segments terminés ont pu être dépassés
+            journal.advance("csv", position)
+            return
+        if not _copy_segments(rows):
+            return
+        journal.advance("csv", position)
+
+def flush():
+    # Écrit en base, par lots, tout le journal au-delà du point de reprise ; False si un lot est refusé
+    while True:
+        batch, position = journal.read("db", WRITE_BATCH_SIZE)
+        if not batch:
+            journal.advance("db", position)
+            return True
+        batch = [_with_epoch(row) for row in batch]
+        if not write_batch(batch):
+            return False
+        journal.advance("db", position)
+        if len(batch) < WRITE_BATCH_SIZE:
+            return True
+
+def _replay_orphans():
+    # Journaux laissés par des processus d'ingestion supprimés, relus avec la même écriture
+    # idempotente que le journal du processus ; arrêt au premier échec, repris après la prochaine
+    # écriture réussie
+    while _orphans:
+        name = _orphans[0]
+        try:
+            done = journal.replay_orphan(
+                name, lambda rows: write_batch([_with_epoch(row) for row in rows]), _copy_segments, WRITE_BATCH_SIZE
+            )
+        except OSError as e:
+            logging.error(f"Relecture du journal {name} : {e}")
+            done = False
+        if not done:
+            return
+        _orphans.pop(0)
+
+def _run():
+    tick = min(WRITE_FLUSH_INTERVAL_MS, JOURNAL_FSYNC_INTERVAL_MS or WRITE_FLUSH_INTERVAL_MS) / 1000
+    last_write = time.monotonic()
+    retry_at = 0.0
+    delay = 1
+    while not _stop.is_set():
+        now = time.monotonic()
+        if now < retry_at:
+            _stop.wait(min(tick, retry_at - now))
+            full = False
+        else:
+            full = journal.wait(WRITE_BATCH_SIZE, tick)
+        journal.sync()
+        _drain_segments()
+        # Le lot part dès WRITE_BATCH_SIZE mesures en attente ou WRITE_FLUSH_INTERVAL_MS après le précédent
+        now = time.monotonic()
+        if now < retry_at or not (full or now - last_write >= WRITE_FLUSH_INTERVAL_MS / 1000):
+            continue
+        last_write = now
+        if flush():
+            delay = 1
+            _replay_orphans()
+        else:
+            logging.warning(f"Base indisponible, mesures gardées dans le journal ; nouvel essai dans {delay} s")
+            retry_at = now + delay
+            delay = min(delay * 2, JOURNAL_RETRY_MAX_SECONDS)
+
+def start_writer(name="main", owned=None):
+    # name : journal du processus (workers.py : un par processus d'ingestion) ; la relecture de ce
+    # qui reste d'une exécution précédente commence aussitôt.
+    # owned (processus principal) : journaux tenus par les processus en service ; tous les autres
+    # dossiers de JOURNAL_DIR sont relus par ce writer puis supprimés
+    global _thread
+    if _thread is not None:
+        return
+    journal.open_journal(name)
+    if owned is not None:
+        _orphans.extend(journal.orphans(set(owned) | {name}))
+        if _orphans:
+            logging.info(f"Journaux abandonnés à relire : {_orphans}")
+    _thread = Thread(target=_run, daemon=True)
+    _thread.start()
+    atexit.register(shutdown_writer)
+
+def shutdown_writer(timeout=10):
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+    # Dernière tentative : ce que la base refuse reste dans le journal pour le prochain démarrage
+    journal.close_journal()
+    _drain_segments()
+    flush()
+    flush_segments()
+    logging.info(f"Writer arrêté : {get_writer_stats()}")
@@ -1,5 +1,5 @@
-const apiUrl = `/data`;
-let allData = [];
+const apiUrl = `/api/history`;
+const maxChartPoints = 2000; // Points renvoyés par le serveur pour les graphiques
 
 // --- Graphique Température ---
 const temperatureChart = new Chart(
@@ -103,14 +103,6 @@ const humidityChart = new Chart(
     }
 );
 
-function parseCustomDate(dateStr) {
-    // Format attendu : "19/07/2025 14:32:10"
-    const [datePart, timePart] = dateStr.split(' ');
-    const [day, month, year] = datePart.split('/').map(Number);
-    const [hours, minutes, seconds] = timePart.split(':').map(Number);
-    return new Date(year, month - 1, day, hours, minutes, seconds);
-}
-
 function updateCharts(filteredData) {
     const labels = filteredData.map(entry => entry.time);
     const temps = filteredData.map(entry => entry.temperature);
@@ -123,24 +115,30 @@ function updateCharts(filteredData) {
     humidityChart.update();
 }
 
-function filterDataByDateRange(startDate, endDate) {
-    const filtered = allData.filter(entry => {
-        const entryDate = entry.timestamp;
-        return entryDate >= startDate && entryDate <= endDate;
-    });
-    updateCharts(filtered);
+const timeFormat = new Intl.DateTimeFormat("fr-FR", {
+    timeZone: "UTC", day: "2-digit", month: "2-digit", year: "numeric",
+    hour: "2-digit", minute: "2-digit", second: "2-digit"
+});
+
+// Le serveur filtre la plage et réduit le nombre de points (maxPoints = 0 : données brutes)
+async function fetchHistory(startInput, endInput, maxPoints) {
+    const params = new URLSearchParams({ start: startInput, end: endInput, max_points: maxPoints, format: "columnar" });
+    const response = await fetch(`${apiUrl}?${params}`);
+    if (!response.ok) {
+        throw new Error("Erreur HTTP " + response.status);
+    }
+    // Format colonnaire : heures en secondes (heure enregistrée, à afficher en UTC), valeurs en tableaux
+    const points = (await response.json()).points;
+    return points.time.map((epoch, i) => ({
+        time: timeFormat.format(new Date(epoch * 1000)).replace(",", ""),
+        temperature: points.temperature[i],
+        humidity: points.humidity[i]
+    }));
 }
-async function loadData() {
+
+async function loadRange(startInput, endInput) {
     try {
-        const response = await fetch(apiUrl);
-        const jsonData = await response.json();
-        allData = jsonData.map(entry => ({
-            time: entry.time,
-            timestamp: parseCustomDate(entry.time),
-            temperature: parseFloat(entry.temperature),
-            humidity: parseFloat(entry.humidity)
-        }));
-        allData.sort((a, b) => a.timestamp - b.timestamp);
+        updateCharts(await fetchHistory(startInput, endInput, maxChartPoints));
     } catch (error) {
         console.error("Erreur lors du chargement des données :", error);
     }
@@ -158,7 +156,7 @@ document.getElementById("filterBtn").addEventListener("click", () => {
         alert("La date de début doit être antérieure à la date de fin.");
         return;
     }
-    filterDataByDateRange(startDate, endDate);
+    loadRange(startInput, endInput);
 });
 document.getElementById("toggleDarkMode").addEventListener("click", () => {
     document.body.classList.toggle("dark-mode");
@@ -166,7 +164,6 @@ document.getElementById("toggleDarkMode").addEventListener("click", () => {
     const button = document.getElementById("toggleDarkMode");
     button.innerHTML = isDark ? '<i class="fas fa-sun"></i> Désactiver le mode sombre' : '<i class="fas fa-moon"></i> Activer le mode sombre';
 });
-loadData();
 document.getElementById("downloadCSV").addEventListener("click", () => {
     const startInput = document.getElementById("startDateTime").value;
     const endInput = document.getElementById("endDateTime").value;
@@ -174,32 +171,7 @@ document.getElementById("downloadCSV").addEventListener("click", () => {
         alert("Veuillez sélectionner une plage de dates valide.");
         return;
     }
-    const start = new Date(startInput);
-    const end = new Date(endInput);
-    const filtered = allData.filter(entry => {
-        return entry.timestamp >= start && entry.timestamp <= end;
-    });
-    if (filtered.length === 0) {
-        alert("Aucune donnée disponible pour cette plage.");
-        return;
-    }
-    let csv = "Date/Heure,Température (°C),Humidité (%)\n";
-    filtered.forEach(row => {
-        csv += `${row.time},${row.temperature},${row.humidity}\n`;
-    });
-    const blob = new Blob([csv], {
-        type: "text/csv"
-    });
-    const url = URL.createObjectURL(blob);
-    const a = document.createElement("a");
-    a.href = url;
-    // Nom dynamique basé sur la date du jour
-    const now = new Date();
-    const pad = n => n.toString().padStart(2, '0');
-    const filename = `donnees_${pad(now.getDate())}-${pad(now.getMonth()+1)}-${now.getFullYear()}.csv`;
-    a.download = filename;
-    document.body.appendChild(a); // nécessaire pour Firefox
-    a.click();
-    document.body.removeChild(a);
-    URL.revokeObjectURL(url);
+    // Mesures brutes de la plage, envoyées en flux par le serveur
+    const params = new URLSearchParams({ start: startInput, end: endInput, format: "csv" });
+    window.location.href = `/api/export?${params}`;
 });
\ No newline at end of file
@@ -11,7 +11,9 @@ if (localStorage.getItem('theme') === 'dark') {
     document.body.classList.add('dark-mode');
 }
 let dataCache = [];
+let lastId = null; // Curseur : id de la dernière mesure reçue
 const maxPoints = 60; // Nombre maximum de points à afficher dans les graphiques
+const maxCache = 1000; // Nombre maximum de mesures gardées en mémoire (logs)
 
 // Récupération des contextes de dessin
 const temperatureCtx = document.getElementById('temperatureChart').getContext('2d');
@@ -135,115 +137,118 @@ const humidityChart = new Chart(humidityCtx, {
     }
   }
 });
-// Fonction pour mettre à jour les graphiques et les logs
+// Ajoute des mesures au cache puis met à jour les graphiques et les logs
+function renderMeasurements(data) {
+    lastId = data[data.length - 1].id;
+    dataCache = dataCache.concat(data).slice(-maxCache);
+    // Mise à jour des graphiques avec les dernières données
+    const labels = dataCache.slice(-maxPoints).map(d => d.time);
+    const temperatureData = dataCache.slice(-maxPoints).map(d => d.temperature);
+    const humidityData = dataCache.slice(-maxPoints).map(d => d.humidity);
+    // Mise à jour des graphiques
+    temperatureChart.data.labels = labels;
+    temperatureChart.data.datasets[0].data = temperatureData;
+    temperatureChart.update();
+    humidityChart.data.labels = labels;
+    humidityChart.data.datasets[0].data = humidityData;
+    humidityChart.update();
+    // Mise à jour des informations actuelles
+    const latest = dataCache[dataCache.length - 1];
+    document.getElementById('currentTemperature').textContent = `Température : ${latest.temperature} °C`;
+    document.getElementById('currentHumidity').textContent = `Humidité : ${latest.humidity} %`;
+    document.getElementById('currentTime').textContent = `Heure : ${latest.time}`;
+    // Logs : ajout des nouvelles mesures uniquement
+    const logList = document.getElementById('logList');
+    data.forEach(entry => {
+        const logEntry = document.createElement('div');
+        logEntry.textContent = `Identifiant : ${entry.device_id} - ${entry.time} - Température : ${entry.temperature} °C, Humidité : ${entry.humidity} %`;
+        logList.appendChild(logEntry);
+    });
+    while (logList.childElementCount > maxCache) {
+        logList.removeChild(logList.firstChild);
+    }
+    // Défilement automatique vers le bas
+    logList.scrollTop = logList.scrollHeight;
+}
+
+// Fonction pour mettre à jour les graphiques et les logs (polling)
 async function updateCharts() {
     try {
-        const response = await fetch("/data");
+        // Premier appel : les dernières mesures ; ensuite uniquement les nouvelles
+        const url = lastId === null ? `/data?limit=${maxCache}` : `/data?since_id=${lastId}`;
+        const response = await fetch(url);
         const data = await response.json();
-        dataCache = data; // Mise à jour du cache des données pour le CSV
-        // Mise à jour des graphiques avec toutes les données
-        const labels = dataCache.slice(-maxPoints).map(d => d.time);
-        const temperatureData = dataCache.slice(-maxPoints).map(d => d.temperature);
-        const humidityData = dataCache.slice(-maxPoints).map(d => d.humidity);
-        // Mise à jour des graphiques
-        temperatureChart.data.labels = labels;
-        temperatureChart.data.datasets[0].data = temperatureData;
-        temperatureChart.update();
-        humidityChart.data.labels = labels;
-        humidityChart.data.datasets[0].data = humidityData;
-        humidityChart.update();
-        // Mise à jour des informations actuelles
-        if (data.length > 0) {
-            const latest = data[data.length - 1];
-            document.getElementById('currentTemperature').textContent = `Température : ${latest.temperature} °C`;
-            document.getElementById('currentHumidity').textContent = `Humidité : ${latest.humidity} %`;
-            document.getElementById('currentTime').textContent = `Heure : ${latest.time}`;
-            // Appelle ta nouvelle fonction d'alerte async ici
-            await checkAlert();
+        if (data.length === 0) {
+            if (dataCache.length > 0) {
+                await checkAlert();
+            }
+            return;
         }
-        // Logs
-        const logList = document.getElementById('logList');
-        logList.innerHTML = '';
-        data.forEach(entry => {
-            const logEntry = document.createElement('div');
-            logEntry.textContent = `Identifiant : ${entry.device_id} - ${entry.time} - Température : ${entry.temperature} °C, Humidité : ${entry.humidity} %`;
-            logList.appendChild(logEntry);
-        });
-        // Défilement automatique vers le bas
-        logList.scrollTop = logList.scrollHeight;
+        renderMeasurements(data);
+        // Appelle ta nouvelle fonction d'alerte async ici
+        await checkAlert();
     } catch (error) {
         // Ne rien faire en cas d'erreur
     }
 }
 
-function downloadCSV() {
-    const rows = [
-        ["Identifiant", "Date/Heure", "Temperature (C)", "Humidite (%)"]
-    ];
-    dataCache.forEach(entry => {
-        rows.push([entry.device_id, entry.time, entry.temperature, entry.humidity]);
-    });
-    // Utilisation du point-virgule comme séparateur pour Excel FR
-    const csvContent = rows.map(e => e.join(";")).join("\n");
-    const blob = new Blob([csvContent], {
-        type: 'text/csv;charset=utf-8;'
-    });
-    const url = URL.createObjectURL(blob);
-    const a = document.createElement('a');
-    a.href = url;
-    a.download = "data.csv";
-    a.click();
-    URL.revokeObjectURL(url);
-    showToast("Fichier CSV téléchargé !");
+// Flux en direct (Server-Sent Events) : les mesures arrivent dès leur écriture en base.
+// Sans EventSource, sans port configuré ou après plusieurs échecs de connexion : polling toutes les 10 secondes.
+const livePort = document.querySelector('meta[name="live-port"]')?.content;
+let pollTimer = null;
+
+function startPolling() {
+    if (pollTimer === null) {
+        pollTimer = setInterval(updateCharts, 10000);
+    }
 }
 
-function downloadExcel() {
-    const wsData = [
-        ["Identifiant", "Date/Heure", "Temperature (C)", "Humidite (%)"]
-    ];
-    dataCache.forEach(entry => {
-        wsData.push([entry.device_id, entry.time, entry.temperature, entry.humidity]);
+function startLive() {
+    if (!window.EventSource || !livePort || livePort === '0') {
+        startPolling();
+        return;
+    }
+    // last_id : reprise après les mesures déjà chargées ; ensuite le navigateur envoie Last-Event-ID
+    const source = new EventSource(`${location.protocol}//${location.hostname}:${livePort}/stream?last_id=${lastId ?? ''}`);
+    let failures = 0;
+    source.onopen = () => {
+        failures = 0;
+    };
+    source.addEventListener('measurement', event => {
+        const entry = JSON.parse(event.data);
+        if (lastId === null || entry.id > lastId) {
+            renderMeasurements([entry]);
+        }
     });
-    const wb = XLSX.utils.book_new();
-    const ws = XLSX.utils.aoa_to_sheet(wsData);
-    XLSX.utils.book_append_sheet(wb, ws, "Données");
-    // Ajouter un graphique au fichier Excel (via `!charts`)
-    const chart = {
-        "!charts": [{
-            type: "line",
-            series: [{
-                name: "Température (C)",
-                values: `Données!B2:B${wsData.length}`
-            }, {
-                name: "Humidité (%)",
-                values: `Données!C2:C${wsData.length}`
-            }],
-            categories: `Données!A2:A${wsData.length}`,
-            title: "Évolution Température & Humidité",
-            position: {
-                tl: {
-                    row: 1,
-                    col: 4
-                },
-                br: {
-                    row: 16,
-                    col: 10
-                }
-            }
-        }]
+    source.addEventListener('alert', () => checkAlert());
+    source.onerror = () => {
+        failures += 1;
+        if (failures >= 3) {
+            source.close();
+            startPolling();
+        }
     };
-    Object.assign(ws, chart); // Injecter le graphique dans la feuille
-    // Télécharger le fichier Excel
-    XLSX.writeFile(wb, "data.xlsx");
-    showToast("Fichier XLSX téléchargé !");
+}
+
+// Les exports portent sur toutes les mesures : le serveur les envoie en flux (/api/export)
+function downloadExport(format) {
+    window.location.href = `/api/export?format=${format}`;
+    showToast(`Téléchargement du fichier ${format.toUpperCase()} lancé !`);
+}
+
+function downloadCSV() {
+    downloadExport("csv");
+}
+
+function downloadExcel() {
+    downloadExport("xlsx");
 }
 // Ajouter un bouton pour télécharger l'Excel
 document.getElementById('downloadExcelButton').addEventListener('click', downloadExcel);
 // Ajout d'un événement au bouton de téléchargement CSV 
 document.getElementById('downloadButton').addEventListener('click', downloadCSV);
-// Mise à jour automatique toutes les 10 secondes
-setInterval(updateCharts, 10000);
-updateCharts(); // Mise à jour initiale
+// Mise à jour initiale, puis flux en direct (ou polling)
+updateCharts().then(startLive);
 function getCardinalDirection(degrees) {
     const directions = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW'];
     const index = Math.round(degrees / 45) % 8;
@@ -383,7 +388,10 @@ async function checkAlert() {
     try {
         const response = await fetch('/api/check_alert');
         const data = await response.json();
-        if (data.alert) {
+        // Défauts de capteur signalés à l'ingestion (valeurs figées, sauts, valeurs aberrantes)
+        const faults = Object.entries(data.faults ?? {})
+            .map(([device, names]) => `${device} (${names.join(', ')})`);
+        if (data.alert || faults.length) {
             let alertBubble = document.getElementById('alert-bubble');
             if (!alertBubble) {
                 alertBubble = document.createElement('div');
@@ -398,9 +406,18 @@ async function checkAlert() {
                 alertBubble.style.zIndex = '1000';
                 document.body.appendChild(alertBubble);
             }
-            alertBubble.textContent =
-                `Alerte seuil : Temp=${data.temperature}°C (min ${data.temp_min}°C / max ${data.temp_max}°C), ` +
-                `Hum=${data.humidity}% (min ${data.humidity_min}% / max ${data.humidity_max}%)`;
+            const messages = [];
+            if (data.alert) {
+                messages.push(
+                    `Alerte seuil ${data.device_id ?? ''} : Temp=${data.temperature}°C (min ${data.temp_min}°C / max ${data.temp_max}°C), ` +
+                    `Hum=${data.humidity}% (min ${data.humidity_min}% / max ${data.humidity_max}%), ` +
+                    `Point de rosée=${data.dew_point}°C`
+                );
+            }
+            if (faults.length) {
+                messages.push(`Capteur en défaut : ${faults.join(' ; ')}`);
+            }
+            alertBubble.textContent = messages.join(' — ');
             alertBubble.style.display = 'block';
         } else {
             let alertBubble = document.getElementById('alert-bubble');
@@ -24,6 +24,9 @@ async function loadAlertValues() {
 		document.getElementById('temp_max').value = data.temp_max ?? '';
 		document.getElementById('humidity_min').value = data.humidity_min ?? '';
 		document.getElementById('humidity_max').value = data.humidity_max ?? '';
+		document.getElementById('dew_point_max').value = data.dew_point_max ?? '';
+		document.getElementById('abs_humidity_max').value = data.abs_humidity_max ?? '';
+		document.getElementById('heat_index_max').value = data.heat_index_max ?? '';
 	} catch (error) {
 		console.error('Erreur en récupérant les valeurs des alertes :', error);
 	}
@@ -47,11 +50,20 @@ alertForm.addEventListener('submit', async (e) => {
 		return;
 	}
 
+	// Seuils facultatifs : un champ vide désactive la surveillance (null)
+	const optional = id => {
+		const value = parseFloat(document.getElementById(id).value);
+		return isNaN(value) ? null : value;
+	};
+
 	const data = {
 		temp_min,
 		temp_max,
 		humidity_min,
-		humidity_max
+		humidity_max,
+		dew_point_max: optional('dew_point_max'),
+		abs_humidity_max: optional('abs_humidity_max'),
+		heat_index_max: optional('heat_index_max')
 	};
 
 	try {